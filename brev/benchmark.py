@@ -0,0 +1,319 @@
+"""
+Benchmarks for the vision pipeline.
+
+Usage:
+  python benchmark.py micro                              # per-function timings, stub models
+  python benchmark.py micro --backend torch --sizes 1024 --out before.json
+  python benchmark.py micro --baseline before.json       # compare against an earlier run
+  python benchmark.py load --requests 200 --concurrency 16
+  python benchmark.py load --endpoint /process-single/upload ~/photos/*.jpg
+
+`micro` imports vision_pipeline in-process and times segment_clothing,
+_crop_mask, classify_item and encode_image_base64 on synthetic outfit photos
+at several resolutions. By default it runs with INFERENCE_BACKEND=stub:
+deterministic CPU stand-ins for rembg, SegFormer and FashionCLIP, so it needs
+no GPU, no model downloads and no vLLM, and numbers are comparable across
+commits on the same machine. The stubs time our own pre/post-processing, not
+the networks; pass --backend torch / onnx / onnx-int8 to include them.
+
+`load` is a concurrent HTTP load generator for a running server. It reports
+p50/p95/p99 latency, requests per second and the mean of every stage in the
+server's Server-Timing header. For a self-contained run start the server as
+  INFERENCE_BACKEND=stub SKIP_LLM=1 CACHE_MAX_ITEMS=0 CACHE_DIR= python vision_pipeline.py
+Each synthetic request image is unique, so the result cache never answers.
+
+Both commands take --out to write the results as JSON and --baseline to print
+the change against a previous results file.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from PIL import Image, ImageDraw
+
+PALETTE = [(20, 20, 20), (30, 60, 140), (150, 30, 40), (90, 110, 60), (200, 170, 120)]
+
+
+def synthetic_outfit(height: int, seed: int = 0) -> Image.Image:
+    """A 2:3 outfit-like photo: top, trousers and shoes on a light background.
+
+    ``seed`` varies the colours and one marker pixel, so every seed gives a
+    different image (and a different result-cache key)."""
+    w, h = height * 2 // 3, height
+    img = Image.new("RGB", (w, h), (235, 235, 235))
+    draw = ImageDraw.Draw(img)
+    top, bottom = PALETTE[seed % len(PALETTE)], PALETTE[(seed + 2) % len(PALETTE)]
+    draw.rectangle((int(w * 0.25), int(h * 0.12), int(w * 0.75), int(h * 0.44)), fill=top)
+    draw.rectangle((int(w * 0.3), int(h * 0.46), int(w * 0.48), int(h * 0.84)), fill=bottom)
+    draw.rectangle((int(w * 0.52), int(h * 0.46), int(w * 0.7), int(h * 0.84)), fill=bottom)
+    draw.rectangle((int(w * 0.28), int(h * 0.87), int(w * 0.46), int(h * 0.93)), fill=(10, 10, 10))
+    draw.rectangle((int(w * 0.54), int(h * 0.87), int(w * 0.72), int(h * 0.93)), fill=(10, 10, 10))
+    img.putpixel((0, 0), (seed % 256, (seed // 256) % 256, 235))
+    return img
+
+
+def percentile(samples: list[float], p: float) -> float:
+    ordered = sorted(samples)
+    k = (len(ordered) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize(samples: list[float]) -> dict:
+    """Milliseconds summary of a list of durations in seconds."""
+    ms = [s * 1000 for s in samples]
+    return {
+        "n": len(ms),
+        "mean_ms": round(sum(ms) / len(ms), 3),
+        "p50_ms": round(percentile(ms, 50), 3),
+        "p95_ms": round(percentile(ms, 95), 3),
+        "p99_ms": round(percentile(ms, 99), 3),
+    }
+
+
+def print_comparison(results: dict, baseline_path: str, metric: str) -> None:
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nChange vs {baseline_path} ({metric}):")
+    for name, stats in results.items():
+        before = baseline.get(name, {}).get(metric)
+        if not before:
+            print(f"  {name:<36} (not in baseline)")
+            continue
+        change = (stats[metric] - before) / before * 100
+        print(f"  {name:<36} {before:>10.3f} → {stats[metric]:>10.3f}  ({change:+.1f}%)")
+
+
+# ─── micro ───
+
+
+def time_calls(fn, repeat: int, warmup: int) -> list[float]:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def run_micro(args) -> dict:
+    os.environ["INFERENCE_BACKEND"] = args.backend
+    os.environ.setdefault("SKIP_LLM", "1")
+    # Measure the functions, not the result cache
+    os.environ["CACHE_MAX_ITEMS"] = "0"
+    os.environ["CACHE_DIR"] = ""
+
+    import vision_pipeline as vp
+
+    print(f"Backend: {vp.INFERENCE_BACKEND} on {vp.DEVICE}; loading models...")
+    for name in ("rembg", "segformer", "fashionclip", "label_banks"):
+        vp.models.get(name)
+
+    results = {}
+    for size in args.sizes:
+        image = synthetic_outfit(size)
+        clean = vp.remove_background(image)
+        segments = vp.segment_clothing(clean)
+        if not segments:
+            print(f"  {size}px: no segments found, skipping")
+            continue
+        rgba = np.asarray(clean)
+        seg = max(segments, key=lambda s: s["area"])
+        crop = seg["cropped"]
+
+        cases = {
+            "segment_clothing": lambda: vp.segment_clothing(clean),
+            "_crop_mask": lambda: vp._crop_mask(rgba, seg["mask"], seg["offset"]),
+            "classify_item": lambda: vp.classify_item(crop),
+            "encode_image_base64": lambda: vp.encode_image_base64(crop),
+        }
+        print(f"\n{size}px ({image.size[0]}×{image.size[1]}, crop {crop.size[0]}×{crop.size[1]}):")
+        for fn_name, fn in cases.items():
+            stats = summarize(time_calls(fn, args.repeat, args.warmup))
+            results[f"{fn_name}@{size}"] = stats
+            print(
+                f"  {fn_name:<22} mean {stats['mean_ms']:>9.3f} ms  "
+                f"p50 {stats['p50_ms']:>9.3f}  p95 {stats['p95_ms']:>9.3f}"
+            )
+    return results
+
+
+# ─── load ───
+
+
+def _request_bodies(args) -> list[bytes]:
+    if args.images:
+        bodies = []
+        for path in args.images:
+            with open(path, "rb") as f:
+                bodies.append(f.read())
+        return [bodies[i % len(bodies)] for i in range(args.requests)]
+    bodies = []
+    for i in range(args.requests):
+        buf = io.BytesIO()
+        synthetic_outfit(args.size, seed=i).save(buf, format="JPEG", quality=90)
+        bodies.append(buf.getvalue())
+    return bodies
+
+
+def _parse_server_timing(header: str) -> dict[str, float]:
+    timings = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.startswith("dur="):
+            timings[name] = float(params[4:])
+    return timings
+
+
+def run_load(args) -> dict:
+    url = f"{args.url}{args.endpoint}"
+    upload = args.endpoint.endswith("/upload")
+    bodies = _request_bodies(args)
+    print(f"Sending {len(bodies)} requests to {url} with concurrency {args.concurrency}...")
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    latencies: list[float] = []
+    stage_ms: dict[str, list[float]] = {}
+    errors: dict[str, int] = {}
+    lock = threading.Lock()
+
+    def send(body: bytes) -> None:
+        start = time.perf_counter()
+        try:
+            if upload:
+                resp = session.post(
+                    url,
+                    data=body,
+                    headers={"Content-Type": "application/octet-stream"},
+                    timeout=args.timeout,
+                )
+            else:
+                resp = session.post(
+                    url, json={"image_base64": base64.b64encode(body).decode()}, timeout=args.timeout
+                )
+            elapsed = time.perf_counter() - start
+            error = None if resp.ok else f"HTTP {resp.status_code}"
+            timings = _parse_server_timing(resp.headers.get("Server-Timing", ""))
+        except requests.RequestException as e:
+            error, timings = type(e).__name__, {}
+        with lock:
+            if error:
+                errors[error] = errors.get(error, 0) + 1
+                return
+            latencies.append(elapsed)
+            for name, ms in timings.items():
+                stage_ms.setdefault(name, []).append(ms)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        list(pool.map(send, bodies))
+    wall = time.perf_counter() - start
+
+    if not latencies:
+        print(f"ERROR: every request failed: {errors}")
+        sys.exit(1)
+
+    stats = summarize(latencies)
+    stats["rps"] = round(len(latencies) / wall, 2)
+    stats["errors"] = sum(errors.values())
+    print(
+        f"\n  ok {len(latencies)}  errors {stats['errors']}  "
+        f"in {wall:.1f}s → {stats['rps']:.2f} req/s"
+    )
+    print(
+        f"  latency ms: mean {stats['mean_ms']:.1f}  p50 {stats['p50_ms']:.1f}  "
+        f"p95 {stats['p95_ms']:.1f}  p99 {stats['p99_ms']:.1f}"
+    )
+    for error, count in errors.items():
+        print(f"  {count} × {error}")
+    if stage_ms:
+        print("  server stages (mean ms, from Server-Timing):")
+        for name, values in stage_ms.items():
+            print(f"    {name:<18} {sum(values) / len(values):>9.2f}")
+
+    results = {args.endpoint: stats}
+    results.update(
+        {
+            f"{args.endpoint}#{name}": {"mean_ms": round(sum(v) / len(v), 3)}
+            for name, v in stage_ms.items()
+        }
+    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vision pipeline benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_micro = sub.add_parser("micro", help="In-process per-function timings")
+    p_micro.add_argument(
+        "--backend",
+        default="stub",
+        choices=["stub", "torch", "onnx", "onnx-int8"],
+        help="Inference backend (default: stub, no model downloads)",
+    )
+    p_micro.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[512, 1024, 2048],
+        help="Synthetic image heights in pixels (default: 512 1024 2048)",
+    )
+    p_micro.add_argument("--repeat", type=int, default=20, help="Timed calls per case")
+    p_micro.add_argument("--warmup", type=int, default=3, help="Untimed calls per case")
+
+    p_load = sub.add_parser("load", help="Concurrent HTTP load against a running server")
+    p_load.add_argument("images", nargs="*", help="Photos to send (default: synthetic)")
+    p_load.add_argument(
+        "--url",
+        default="http://localhost:8000",
+        help="Server URL (default: http://localhost:8000)",
+    )
+    p_load.add_argument(
+        "--endpoint",
+        default="/process-outfit/upload",
+        help="Endpoint to hit (default: /process-outfit/upload)",
+    )
+    p_load.add_argument("--requests", type=int, default=100, help="Total requests")
+    p_load.add_argument("--concurrency", type=int, default=8, help="Requests in flight")
+    p_load.add_argument("--size", type=int, default=1024, help="Synthetic image height")
+    p_load.add_argument("--timeout", type=float, default=300, help="Per-request timeout (s)")
+
+    for p in (p_micro, p_load):
+        p.add_argument("--out", help="Write results as JSON")
+        p.add_argument("--baseline", help="Compare against a previous --out file")
+
+    args = parser.parse_args()
+    try:
+        results = run_micro(args) if args.command == "micro" else run_load(args)
+    except requests.ConnectionError:
+        print(f"ERROR: Cannot connect to {args.url}")
+        print("Make sure the server is running: python vision_pipeline.py")
+        sys.exit(1)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWrote {args.out}")
+    if args.baseline:
+        print_comparison(results, args.baseline, "mean_ms")
+
+
+if __name__ == "__main__":
+    main()
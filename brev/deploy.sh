@@ -33,9 +33,11 @@ print('  • Loading FashionCLIP...')
 CLIPProcessor.from_pretrained('patrickjohncyh/fashion-clip')
 CLIPModel.from_pretrained('patrickjohncyh/fashion-clip')
 
-print('  • Loading rembg (U2-Net)...')
 os.environ['U2NET_HOME'] = os.path.expanduser('~/.u2net')
-new_session('u2net')
+rembg_models = {os.getenv('REMBG_MODEL', 'u2net'), os.getenv('REMBG_SINGLE_MODEL', 'u2net')}
+for name in sorted(rembg_models):
+    print(f'  • Loading rembg ({name})...')
+    new_session(name)
 
 print('  ✅ Vision models cached.')
 "
@@ -55,6 +57,11 @@ echo "  Pane 2 — Vision Pipeline (FastAPI on port 8000):"
 echo "    source venv/bin/activate"
 echo "    python vision_pipeline.py"
 echo ""
+echo "  CPU-only hosts — optional ONNX backend for SegFormer + FashionCLIP:"
+echo "    python export_onnx.py export --int8"
+echo "    python export_onnx.py check --backend onnx-int8 <photos...>"
+echo "    INFERENCE_BACKEND=onnx-int8 SKIP_LLM=1 python vision_pipeline.py"
+echo ""
 echo "=== QUICK START (copy-paste) ==="
 echo ""
 echo "  tmux new -s vlyzo"
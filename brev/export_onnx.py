@@ -0,0 +1,247 @@
+"""
+Export SegFormer and FashionCLIP to ONNX for the CPU inference backend,
+and check the exported graphs against the PyTorch path.
+
+Usage:
+  python export_onnx.py export                  # fp32 graphs → onnx/
+  python export_onnx.py export --int8           # + dynamic int8-quantized copies
+  python export_onnx.py check --backend onnx-int8 ~/photos/*.jpg
+
+Then start the server with INFERENCE_BACKEND=onnx (or onnx-int8).
+
+The check runs the same images through the torch backend and the chosen
+ONNX backend and reports:
+  • SegFormer pixel label agreement (argmax at model resolution)
+  • FashionCLIP image / text embedding cosine drift (1 - cosine)
+  • top-1 agreement for every zero-shot label bank
+"""
+
+import os
+import sys
+import json
+import argparse
+
+# The export and the parity reference both need the PyTorch models
+os.environ["INFERENCE_BACKEND"] = "torch"
+
+import torch  # noqa: E402
+from PIL import Image, ImageDraw  # noqa: E402
+
+import vision_pipeline as vp  # noqa: E402
+
+OPSET = 17
+
+
+class SegformerLogits(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model(pixel_values=pixel_values).logits
+
+
+class ClipImageFeatures(torch.nn.Module):
+    def __init__(self, clip):
+        super().__init__()
+        self.vision_model = clip.vision_model
+        self.visual_projection = clip.visual_projection
+
+    def forward(self, pixel_values):
+        pooled = self.vision_model(pixel_values=pixel_values).pooler_output
+        return self.visual_projection(pooled)
+
+
+class ClipTextFeatures(torch.nn.Module):
+    def __init__(self, clip):
+        super().__init__()
+        self.text_model = clip.text_model
+        self.text_projection = clip.text_projection
+
+    def forward(self, input_ids, attention_mask):
+        pooled = self.text_model(
+            input_ids=input_ids, attention_mask=attention_mask
+        ).pooler_output
+        return self.text_projection(pooled)
+
+
+def export(out_dir: str, int8: bool) -> None:
+    os.makedirs(out_dir, exist_ok=True)
+    # Trace on CPU so the graphs carry no device-specific ops
+    backend = vp.TorchBackend(device="cpu").load()
+    segformer_processor = vp.SegformerImageProcessor.from_pretrained(vp.SEGFORMER_MODEL_ID)
+    fashionclip_processor = vp.CLIPProcessor.from_pretrained(vp.FASHIONCLIP_MODEL_ID)
+
+    sample = [Image.new("RGB", (640, 480), (200, 180, 160))] * 2
+    seg_pixels = segformer_processor(images=sample, return_tensors="pt")["pixel_values"]
+    clip_pixels = fashionclip_processor(images=sample, return_tensors="pt")["pixel_values"]
+    text = fashionclip_processor(
+        text=["a photo of Jeans", "a photo of a T-Shirt"],
+        return_tensors="pt",
+        padding=True,
+        truncation=True,
+    )
+
+    graphs = {
+        "segformer": (
+            SegformerLogits(backend.segformer),
+            (seg_pixels,),
+            ["pixel_values"],
+            {"pixel_values": {0: "batch"}, "output": {0: "batch"}},
+        ),
+        "clip_image": (
+            ClipImageFeatures(backend.clip),
+            (clip_pixels,),
+            ["pixel_values"],
+            {"pixel_values": {0: "batch"}, "output": {0: "batch"}},
+        ),
+        "clip_text": (
+            ClipTextFeatures(backend.clip),
+            (text["input_ids"], text["attention_mask"]),
+            ["input_ids", "attention_mask"],
+            {
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "output": {0: "batch"},
+            },
+        ),
+    }
+
+    for name, (module, args, input_names, dynamic_axes) in graphs.items():
+        path = os.path.join(out_dir, f"{name}.onnx")
+        print(f"Exporting {name} → {path}")
+        module.eval()
+        with torch.no_grad():
+            torch.onnx.export(
+                module,
+                args,
+                path,
+                input_names=input_names,
+                output_names=["output"],
+                dynamic_axes=dynamic_axes,
+                opset_version=OPSET,
+                do_constant_folding=True,
+            )
+
+        if int8:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            qpath = os.path.join(out_dir, f"{name}.int8.onnx")
+            print(f"Quantizing {name} → {qpath}")
+            quantize_dynamic(path, qpath, weight_type=QuantType.QInt8)
+
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump(
+            {
+                "segformer": vp.SEGFORMER_MODEL_ID,
+                "fashionclip": vp.FASHIONCLIP_MODEL_ID,
+                "logit_scale": backend.logit_scale,
+                "opset": OPSET,
+                "int8": int8,
+            },
+            f,
+            indent=2,
+        )
+    print("Done.")
+
+
+def _synthetic_images(n: int) -> list[Image.Image]:
+    """Flat-background garment-like shapes, for when no photos are given."""
+    colors = [(20, 20, 20), (240, 240, 240), (30, 60, 140), (150, 30, 40), (90, 110, 60)]
+    images = []
+    for i in range(n):
+        img = Image.new("RGB", (512, 768), (235, 235, 235))
+        draw = ImageDraw.Draw(img)
+        color = colors[i % len(colors)]
+        draw.rectangle((140, 120, 372, 400), fill=color)  # torso
+        draw.rectangle((160, 400, 250, 700), fill=colors[(i + 2) % len(colors)])  # legs
+        draw.rectangle((262, 400, 352, 700), fill=colors[(i + 2) % len(colors)])
+        images.append(img)
+    return images
+
+
+def check(backend_name: str, image_paths: list[str], min_agreement: float) -> bool:
+    # Loading the processors through the registry also loads the torch reference
+    segformer_processor = vp.models.get("segformer")
+    fashionclip_processor = vp.models.get("fashionclip")
+    reference = vp.inference_backend
+    candidate = vp.load_backend(backend_name).load()
+
+    images = [Image.open(p).convert("RGB") for p in image_paths] or _synthetic_images(8)
+    print(f"Comparing torch vs {backend_name} on {len(images)} images\n")
+
+    # SegFormer — per-pixel argmax agreement at model resolution
+    seg_pixels = segformer_processor(images=images, return_tensors="pt")["pixel_values"]
+    ref_seg = reference.segformer_logits(seg_pixels).argmax(dim=1)
+    cand_seg = candidate.segformer_logits(seg_pixels).argmax(dim=1)
+    seg_agreement = (ref_seg == cand_seg).float().mean().item()
+
+    # FashionCLIP image tower — embedding drift
+    clip_pixels = fashionclip_processor(images=images, return_tensors="pt")["pixel_values"]
+    ref_img = vp._image_features(clip_pixels, reference)
+    cand_img = vp._image_features(clip_pixels, candidate)
+    img_cos = (ref_img * cand_img).sum(dim=-1)
+
+    # FashionCLIP text tower — label-bank matrix drift + per-bank top-1 agreement
+    ref_cls = vp.LabelBankClassifier(vp.LABEL_BANKS, backend=reference)
+    cand_cls = vp.LabelBankClassifier(vp.LABEL_BANKS, backend=candidate)
+    text_cos = (ref_cls.text_matrix * cand_cls.text_matrix).sum(dim=-1)
+
+    ref_probs = ref_cls.probabilities(ref_img)
+    cand_probs = cand_cls.probabilities(cand_img)
+    bank_agreement = {
+        name: (ref_probs[name].argmax(dim=-1) == cand_probs[name].argmax(dim=-1))
+        .float()
+        .mean()
+        .item()
+        for name in vp.LABEL_BANKS
+    }
+
+    print(f"  SegFormer pixel agreement:   {seg_agreement:.4f}")
+    print(
+        f"  Image embedding drift:       mean {1 - img_cos.mean().item():.5f}  "
+        f"max {1 - img_cos.min().item():.5f}"
+    )
+    print(
+        f"  Text embedding drift:        mean {1 - text_cos.mean().item():.5f}  "
+        f"max {1 - text_cos.min().item():.5f}"
+    )
+    print("  Top-1 label agreement:")
+    for name, agreement in bank_agreement.items():
+        print(f"    {name:<10} {agreement:.4f}")
+
+    worst = min([seg_agreement, *bank_agreement.values()])
+    ok = worst >= min_agreement
+    print(f"\n{'PASS' if ok else 'FAIL'} (worst agreement {worst:.4f}, threshold {min_agreement})")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ONNX export + parity check")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_export = sub.add_parser("export", help="Export ONNX graphs")
+    p_export.add_argument("--out", default=vp.ONNX_DIR, help="Output directory")
+    p_export.add_argument(
+        "--int8", action="store_true", help="Also write dynamic int8-quantized graphs"
+    )
+
+    p_check = sub.add_parser("check", help="Compare an ONNX backend against torch")
+    p_check.add_argument("images", nargs="*", help="Photos to compare on (default: synthetic)")
+    p_check.add_argument("--backend", default="onnx", choices=["onnx", "onnx-int8"])
+    p_check.add_argument(
+        "--min-agreement",
+        type=float,
+        default=0.9,
+        help="Fail if any label agreement falls below this (default: 0.9)",
+    )
+
+    args = parser.parse_args()
+    if args.command == "export":
+        export(args.out, args.int8)
+    else:
+        sys.exit(0 if check(args.backend, args.images, args.min_agreement) else 1)
+
+
+if __name__ == "__main__":
+    main()
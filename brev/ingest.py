@@ -0,0 +1,168 @@
+"""
+Bulk wardrobe import through POST /process-batch.
+
+Usage:
+  python ingest.py ~/photos/wardrobe/                 # every image in a folder
+  python ingest.py shirt.jpg jeans.jpg --single       # single-item shots
+  python ingest.py ~/photos/*.jpg --out results.ndjson --batch-size 50
+  python ingest.py ~/photos/ --embedding-encoding f16 --crop-format webp --crop-max-side 512
+
+Images are sent in batches of --batch-size; the server overlaps decoding,
+background removal, segmentation and classification across the whole batch
+and streams back one result per image as it finishes. Each result is printed
+as it arrives and, with --out, appended to an NDJSON file.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import requests
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".heic")
+
+
+def collect_images(paths: list[str]) -> list[str]:
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                images.extend(
+                    os.path.join(root, name)
+                    for name in sorted(files)
+                    if name.lower().endswith(IMAGE_EXTENSIONS)
+                )
+        else:
+            images.append(path)
+    return images
+
+
+def ingest_batch(url: str, paths: list[str], params: dict, timeout: float):
+    """POST one batch and yield the streamed events (dicts) as they arrive."""
+    files = []
+    try:
+        for path in paths:
+            files.append(("files", (os.path.basename(path), open(path, "rb"))))
+        with requests.post(
+            f"{url}/process-batch", params=params, files=files, stream=True, timeout=timeout
+        ) as resp:
+            resp.raise_for_status()
+            for line in resp.iter_lines():
+                if line:
+                    yield json.loads(line)
+    finally:
+        for _, (_, f) in files:
+            f.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-import wardrobe photos")
+    parser.add_argument("paths", nargs="+", help="Image files and/or folders")
+    parser.add_argument(
+        "--url",
+        default="http://localhost:8000",
+        help="Server URL (default: http://localhost:8000)",
+    )
+    parser.add_argument(
+        "--single",
+        action="store_true",
+        help="Photos are single items (skip SegFormer)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=25,
+        help="Images per /process-batch request (default: 25)",
+    )
+    parser.add_argument(
+        "--full-resolution",
+        action="store_true",
+        help="Cut crops at the source resolution",
+    )
+    parser.add_argument(
+        "--embedding-encoding",
+        default="list",
+        choices=["list", "f32", "f16", "int8"],
+        help="Embedding format in results (default: list of floats)",
+    )
+    parser.add_argument(
+        "--crop-format",
+        default="png",
+        choices=["png", "webp", "jpeg", "none"],
+        help="Cropped image format in results (default: png)",
+    )
+    parser.add_argument("--crop-quality", type=int, default=85, help="WebP/JPEG quality")
+    parser.add_argument(
+        "--crop-max-side", type=int, default=0, help="Downscale crops to this size (0 = off)"
+    )
+    parser.add_argument("--out", help="Append results to this NDJSON file")
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=600,
+        help="Seconds to wait for a batch (default: 600)",
+    )
+    args = parser.parse_args()
+
+    images = collect_images(args.paths)
+    if not images:
+        print("ERROR: no images found")
+        sys.exit(1)
+
+    kind = "single" if args.single else "outfit"
+    params = {
+        "kind": kind,
+        "embedding_encoding": args.embedding_encoding,
+        "crop_format": args.crop_format,
+        "crop_quality": args.crop_quality,
+        "crop_max_side": args.crop_max_side,
+    }
+    if args.full_resolution:
+        params["full_resolution"] = "true"
+    out = open(args.out, "a") if args.out else None
+    print(f"Importing {len(images)} images ({kind}) via {args.url}/process-batch")
+
+    start = time.time()
+    done = failed = items = 0
+    try:
+        for offset in range(0, len(images), args.batch_size):
+            batch = images[offset : offset + args.batch_size]
+            for event in ingest_batch(args.url, batch, params, args.timeout):
+                if event["event"] == "done":
+                    continue
+                path = batch[event["index"]]
+                done += 1
+                if event["event"] == "error":
+                    failed += 1
+                    print(f"  [{done}/{len(images)}] FAILED {path}: {event['detail']}")
+                    continue
+
+                result = event["result"]
+                items += result["items_found"]
+                labels = ", ".join(
+                    f"{it['segment_label']}→{it['category']['label']}" for it in result["items"]
+                )
+                cached = " (cached)" if event["cached"] else ""
+                print(f"  [{done}/{len(images)}] {path}: {labels or 'no items'}{cached}")
+                if out:
+                    out.write(json.dumps({"path": path, **result}) + "\n")
+                    out.flush()
+    except requests.ConnectionError:
+        print(f"ERROR: Cannot connect to {args.url}")
+        print("Make sure the server is running: python vision_pipeline.py")
+        sys.exit(1)
+    finally:
+        if out:
+            out.close()
+
+    elapsed = time.time() - start
+    print(
+        f"\nDone: {done - failed} images, {items} items, {failed} failed "
+        f"in {elapsed:.1f}s ({done / elapsed:.2f} images/s)"
+    )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Bulk re-classification of stored FashionCLIP embeddings through POST /reclassify.
+
+Usage:
+  python reclassify.py items.ndjson --out attrs.ndjson
+  python reclassify.py items.ndjson --banks banks.json --template "a product photo of {}"
+  python reclassify.py items.ndjson --local --columns --out updates.ndjson
+
+Input is NDJSON (or a JSON array) of rows with an "id" and an "embedding",
+e.g. an export of wardrobe_items(id, embedding). The embedding can be a float
+list or pgvector text ("[0.1,0.2,...]"). Rows are sent in batches of
+--batch-size as float16 base64, and one result per row is appended to --out.
+
+--banks is a JSON object of label banks that replace or extend the server's
+(e.g. {"category": [...], "fit": ["slim fit", "relaxed fit"]}). --columns
+writes wardrobe_items column names (ai_category, ai_style, ..., tags) ready
+for an upsert. --local scores in-process instead of calling a server.
+"""
+
+import sys
+import json
+import time
+import base64
+import argparse
+
+import numpy as np
+import requests
+
+# ItemOut attribute → wardrobe_items column (supabase/migrations/*_add_ai_wardrobe.sql)
+COLUMNS = {
+    "style": "ai_style",
+    "color": "ai_color",
+    "pattern": "ai_pattern",
+    "material": "ai_material",
+    "season": "ai_season",
+}
+
+
+def read_rows(path: str) -> list[dict]:
+    f = sys.stdin if path == "-" else open(path)
+    with f:
+        text = f.read().strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def embedding_matrix(rows: list[dict]) -> np.ndarray:
+    vectors = []
+    for row in rows:
+        emb = row["embedding"]
+        if isinstance(emb, str):  # pgvector text
+            emb = json.loads(emb)
+        vectors.append(emb)
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def reclassify_remote(
+    url: str, ids: list[str], vectors: np.ndarray, banks: dict, template: str, timeout: float
+) -> list[dict]:
+    payload = {
+        "items": [
+            {"id": item_id, "embedding": base64.b64encode(vec.astype("<f2").tobytes()).decode()}
+            for item_id, vec in zip(ids, vectors)
+        ],
+        "embedding_encoding": "f16",
+        "label_banks": banks,
+    }
+    if template:
+        payload["prompt_template"] = template
+    resp = requests.post(f"{url}/reclassify", json=payload, timeout=timeout)
+    if not resp.ok:
+        raise RuntimeError(f"/reclassify returned {resp.status_code}: {resp.text[:500]}")
+    return resp.json()["items"]
+
+
+def to_columns(item: dict) -> dict:
+    row = {
+        "id": item["id"],
+        "ai_category": item["category"]["label"],
+        "ai_category_confidence": item["category"]["confidence"],
+        "tags": item["tags"],
+    }
+    for attr, column in COLUMNS.items():
+        row[column] = item[attr]["label"]
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-classify stored embeddings")
+    parser.add_argument("input", help="NDJSON / JSON file of {id, embedding} rows (- for stdin)")
+    parser.add_argument(
+        "--url",
+        default="http://localhost:8000",
+        help="Server URL (default: http://localhost:8000)",
+    )
+    parser.add_argument(
+        "--local",
+        action="store_true",
+        help="Score in-process (loads FashionCLIP here) instead of calling the server",
+    )
+    parser.add_argument("--banks", help="JSON file of label banks to replace / add")
+    parser.add_argument("--template", help='Prompt template, e.g. "a photo of {}"')
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=20000,
+        help="Rows per /reclassify request (default: 20000)",
+    )
+    parser.add_argument(
+        "--columns",
+        action="store_true",
+        help="Write wardrobe_items column names instead of the API item shape",
+    )
+    parser.add_argument("--out", help="Append results to this NDJSON file (default: stdout)")
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=300,
+        help="Seconds to wait for a batch (default: 300)",
+    )
+    args = parser.parse_args()
+
+    banks = {}
+    if args.banks:
+        with open(args.banks) as f:
+            banks = json.load(f)
+
+    rows = read_rows(args.input)
+    if not rows:
+        print("ERROR: no rows in input", file=sys.stderr)
+        sys.exit(1)
+    ids = [str(row["id"]) for row in rows]
+    vectors = embedding_matrix(rows)
+    del rows
+
+    if args.local:
+        import vision_pipeline as vp
+
+    out = open(args.out, "a") if args.out else sys.stdout
+    print(f"Re-classifying {len(ids)} embeddings...", file=sys.stderr)
+    start = time.time()
+    try:
+        for offset in range(0, len(ids), args.batch_size):
+            batch_ids = ids[offset : offset + args.batch_size]
+            batch = vectors[offset : offset + args.batch_size]
+            if args.local:
+                results = [
+                    {"id": item_id, **fields}
+                    for item_id, fields in zip(
+                        batch_ids, vp.reclassify_embeddings(batch, banks, args.template)
+                    )
+                ]
+            else:
+                results = reclassify_remote(
+                    args.url, batch_ids, batch, banks, args.template, args.timeout
+                )
+            for item in results:
+                out.write(json.dumps(to_columns(item) if args.columns else item) + "\n")
+            out.flush()
+            print(f"  {offset + len(batch_ids)}/{len(ids)}", file=sys.stderr)
+    except requests.ConnectionError:
+        print(f"ERROR: Cannot connect to {args.url}", file=sys.stderr)
+        print("Make sure the server is running: python vision_pipeline.py", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if args.out:
+            out.close()
+
+    elapsed = time.time() - start
+    print(
+        f"Done: {len(ids)} items in {elapsed:.1f}s ({len(ids) / elapsed * 60:,.0f} items/min)",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -16,16 +16,28 @@ tmux new-session -d -s $SESSION -n main
 # Pane 0: vLLM (Nemotron)
 tmux send-keys -t $SESSION:main.0 "cd ~/vlyzo-bumbl/brev && source venv/bin/activate && echo '🚀 Starting vLLM (Nemotron)...' && vllm serve nvidia/NVIDIA-Nemotron-Nano-9B-v2 --port 8001 --trust-remote-code --dtype bfloat16" Enter
 
-# Wait for vLLM to load (~90 seconds)
-echo "⏳ Waiting 90s for vLLM to load Nemotron..."
-sleep 90
-
-# Split horizontally and start Vision Pipeline in pane 1
+# Start Vision Pipeline in pane 1 right away — it loads its models in parallel with vLLM
 tmux split-window -h -t $SESSION:main
 tmux send-keys -t $SESSION:main.1 "cd ~/vlyzo-bumbl/brev && source venv/bin/activate && echo '🚀 Starting Vision Pipeline...' && python vision_pipeline.py" Enter
 
+wait_for() {
+    local name=$1 url=$2 timeout=${3:-600}
+    echo "⏳ Waiting for $name ($url)..."
+    for ((i = 0; i < timeout; i += 2)); do
+        if curl -sf "$url" > /dev/null; then
+            echo "✅ $name ready after ${i}s"
+            return 0
+        fi
+        sleep 2
+    done
+    echo "⚠️  $name not ready after ${timeout}s — check its tmux pane"
+}
+
+wait_for "vLLM (Nemotron)" http://localhost:8001/health
+wait_for "Vision Pipeline" http://localhost:8000/ready
+
 echo ""
-echo "✅ Both servers starting in tmux session '$SESSION'"
+echo "✅ Both servers running in tmux session '$SESSION'"
 echo ""
 echo "   Pane 0 (left):  vLLM on port 8001"
 echo "   Pane 1 (right): Vision Pipeline on port 8000"
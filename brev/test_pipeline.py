@@ -8,10 +8,13 @@ Usage:
 Examples:
   python test_pipeline.py ~/photos/outfit.jpg
   python test_pipeline.py ~/photos/shirt.jpg --single
+  python test_pipeline.py ~/photos/outfit.jpg --upload
+  python test_pipeline.py ~/photos/outfit.jpg --job
 """
 
 import sys
 import json
+import time
 import base64
 import argparse
 import requests
@@ -30,6 +33,16 @@ def main():
         default="http://localhost:8000",
         help="Server URL (default: http://localhost:8000)",
     )
+    parser.add_argument(
+        "--upload",
+        action="store_true",
+        help="Send the raw file to the /upload endpoint instead of base64 JSON",
+    )
+    parser.add_argument(
+        "--job",
+        action="store_true",
+        help="Submit to POST /jobs and poll GET /jobs/{id} for the result",
+    )
     parser.add_argument(
         "--save-crops",
         action="store_true",
@@ -39,7 +52,8 @@ def main():
 
     # Read and encode the image
     with open(args.image_path, "rb") as f:
-        image_base64 = base64.b64encode(f.read()).decode()
+        image_bytes = f.read()
+    image_base64 = base64.b64encode(image_bytes).decode()
 
     # Check server health
     print(f"Checking server at {args.url}...")
@@ -58,18 +72,62 @@ def main():
 
     # Send the image
     endpoint = "/process-single" if args.single else "/process-outfit"
+    if args.job:
+        endpoint = "/jobs"
+    elif args.upload:
+        endpoint += "/upload"
     print(f"Sending image to {endpoint}...")
     print(f"  File: {args.image_path}")
-    print(f"  Size: {len(image_base64) // 1024} KB (base64)")
+    if args.upload:
+        print(f"  Size: {len(image_bytes) // 1024} KB (raw)")
+    else:
+        print(f"  Size: {len(image_base64) // 1024} KB (base64)")
     print()
 
-    resp = requests.post(
-        f"{args.url}{endpoint}",
-        json={"image_base64": image_base64},
-        timeout=120,
-    )
-    resp.raise_for_status()
-    result = resp.json()
+    if args.job:
+        kind = "single" if args.single else "outfit"
+        if args.upload:
+            resp = requests.post(
+                f"{args.url}/jobs",
+                params={"kind": kind},
+                data=image_bytes,
+                headers={"Content-Type": "application/octet-stream"},
+                timeout=30,
+            )
+        else:
+            resp = requests.post(
+                f"{args.url}/jobs",
+                json={"image_base64": image_base64, "kind": kind},
+                timeout=30,
+            )
+        resp.raise_for_status()
+        job_id = resp.json()["job_id"]
+        print(f"Queued job {job_id}, polling...")
+        while True:
+            job = requests.get(f"{args.url}/jobs/{job_id}", timeout=10).json()
+            if job["status"] in ("completed", "failed"):
+                break
+            time.sleep(1)
+        if job["status"] == "failed":
+            print(f"ERROR: job failed: {job.get('error')}")
+            sys.exit(1)
+        result = job["result"]
+    elif args.upload:
+        resp = requests.post(
+            f"{args.url}{endpoint}",
+            data=image_bytes,
+            headers={"Content-Type": "application/octet-stream"},
+            timeout=120,
+        )
+    else:
+        resp = requests.post(
+            f"{args.url}{endpoint}",
+            json={"image_base64": image_base64},
+            timeout=120,
+        )
+    if not args.job:
+        resp.raise_for_status()
+        result = resp.json()
 
     # Print results
     print(f"Items found: {result['items_found']}")
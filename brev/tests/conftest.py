@@ -0,0 +1,14 @@
+import os
+import sys
+import tempfile
+
+# Configure the server before vision_pipeline is imported: stub models, no
+# vLLM, and throwaway cache / job / index storage.
+_tmp = tempfile.mkdtemp(prefix="vlyzo-tests-")
+os.environ.setdefault("INFERENCE_BACKEND", "stub")
+os.environ.setdefault("SKIP_LLM", "1")
+os.environ.setdefault("CACHE_DIR", "")
+os.environ.setdefault("JOBS_DB", os.path.join(_tmp, "jobs.sqlite3"))
+os.environ.setdefault("INDEX_DIR", os.path.join(_tmp, "index"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
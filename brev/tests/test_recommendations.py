@@ -0,0 +1,177 @@
+import pytest
+
+pytest.importorskip("torch")
+
+import vision_pipeline as vp  # noqa: E402
+
+RANKING = (
+    '{"recommendations": [{"candidate": 2, "description": "quote \\" and brace } inside"},'
+    ' {"candidate": 1}]}'
+)
+
+
+def feed_in_chunks(text: str, size: int) -> list[dict]:
+    stream = vp.JSONObjectStream()
+    objects = []
+    for start in range(0, len(text), size):
+        objects.extend(stream.feed(text[start : start + size]))
+    return objects
+
+
+@pytest.mark.parametrize("size", [1, 7, 1000])
+def test_json_stream_yields_objects_as_they_close(size):
+    assert feed_in_chunks(RANKING, size) == [
+        {"candidate": 2, "description": 'quote " and brace } inside'},
+        {"candidate": 1},
+    ]
+
+
+@pytest.mark.parametrize(
+    "preamble",
+    [
+        'He said "{" and then ',
+        'Sure {"x": 1} — here {are} "the picks: ',
+        '{"note": "{"} ',
+    ],
+)
+@pytest.mark.parametrize("size", [1, 7, 1000])
+def test_json_stream_skips_preamble_with_braces_and_quotes(preamble, size):
+    assert [obj["candidate"] for obj in feed_in_chunks(preamble + RANKING, size)] == [2, 1]
+
+
+@pytest.mark.parametrize(
+    "members",
+    [
+        '"note": "ok", ',
+        '"note": "a \\"quoted\\" [list] {x}", "count": 2, "ok": true, ',
+        '"meta": {"tags": ["a", "}"], "n": 1.5}, "skip": null, ',
+    ],
+)
+@pytest.mark.parametrize("size", [1, 7, 1000])
+def test_json_stream_finds_the_array_under_any_key(members, size):
+    text = "{" + members + RANKING[1:]
+    assert [obj["candidate"] for obj in feed_in_chunks(text, size)] == [2, 1]
+
+
+def test_json_stream_recovers_after_a_bad_element():
+    text = '{"recommendations": [{"candidate": 1, oops}, {"candidate": 3}]}'
+    assert feed_in_chunks(text, 1) == [{"candidate": 3}]
+
+
+def shard_wardrobe(n: int) -> tuple[list[dict], list[dict]]:
+    """``n`` same-sized top+bottom candidates, scored so that c5 and c6 are best."""
+    wardrobe, candidates = [], []
+    for i in range(n):
+        top = {"id": f"t{i:02d}", "category": "Shirt", "color": "white"}
+        bottom = {"id": f"b{i:02d}", "category": "Jeans", "color": "navy"}
+        wardrobe += [top, bottom]
+        candidates.append(
+            {
+                "outfit_items": [top["id"], bottom["id"]],
+                "occasion": "everyday",
+                "description": f"c{i}",
+                "style_tags": [],
+                "score": 0.9 if i in (5, 6) else 0.5 - i / 100,
+            }
+        )
+    return wardrobe, candidates
+
+
+def reduce_shards(monkeypatch, n: int, per_shard: int, count: int):
+    wardrobe, candidates = shard_wardrobe(n)
+    by_id = {item["id"]: item for item in wardrobe}
+    messages = vp._ranking_messages(by_id, candidates[:per_shard], None, None, count)
+    budget = sum(vp.count_tokens(m["content"]) for m in messages)
+    monkeypatch.setattr(vp, "LLM_PROMPT_TOKEN_BUDGET", budget)
+
+    ranked: list[list[str]] = []
+
+    async def rank_last_first(shard, messages, deadline):
+        ranked.append([c["description"] for c in shard])
+        return list(reversed(shard))
+
+    monkeypatch.setattr(vp, "_rank_prompt", rank_last_first)
+
+    async def run():
+        deadline = vp.asyncio.get_running_loop().time() + 10
+        return await vp._reduce_shards(wardrobe, candidates, deadline, None, None, count)
+
+    final, _ = vp.asyncio.run(run())
+    return [c["description"] for c in final], ranked
+
+
+def test_reduce_shards_keeps_winners_from_every_shard(monkeypatch):
+    final, ranked = reduce_shards(monkeypatch, n=8, per_shard=2, count=1)
+    assert ranked == [
+        ["c0", "c1"], ["c2", "c3"], ["c4", "c5"], ["c6", "c7"],  # map over 4 shards
+        ["c1", "c3"], ["c5", "c7"],  # their winners, re-sharded
+    ]
+    assert final == ["c3", "c7"]
+
+
+def test_reduce_shards_falls_back_to_best_scored_winners(monkeypatch):
+    # Two picks per shard of two: the shard rankings can't shrink the list
+    final, ranked = reduce_shards(monkeypatch, n=8, per_shard=2, count=2)
+    assert len(ranked) == 4
+    assert final == ["c5", "c6"]
+
+
+class FakeLLM:
+    def __init__(self, text: str):
+        self.text = text
+
+    async def chat(self, messages, max_tokens, deadline):
+        return self.text
+
+    async def chat_stream(self, messages, max_tokens, deadline):
+        for start in range(0, len(self.text), 5):
+            yield self.text[start : start + 5]
+
+
+def small_wardrobe() -> list[dict]:
+    items = [
+        ("t1", "Top", "white"), ("t2", "Top", "black"),
+        ("b1", "Bottom", "navy"), ("b2", "Bottom", "khaki"),
+        ("s1", "Shoes", "white"),
+    ]
+    return [
+        vp.WardrobeItem(id=item_id, category=category, color=color).model_dump()
+        for item_id, category, color in items
+    ]
+
+
+def generate_both(monkeypatch, reply: str) -> tuple[dict, dict, list[dict]]:
+    monkeypatch.setattr(vp, "LLM_AVAILABLE", True)
+    monkeypatch.setattr(vp, "count_tokens", lambda text: len(text) // 4 + 1)
+    monkeypatch.setattr(vp, "llm_client", FakeLLM(reply))
+    wardrobe = small_wardrobe()
+    emitted: list[dict] = []
+
+    async def run():
+        deadline = vp.asyncio.get_running_loop().time() + 10
+        plain = await vp.generate_recommendations(wardrobe, None, None, deadline)
+        streamed = await vp._generate_streamed(wardrobe, None, None, deadline, emitted.append)
+        return plain, streamed
+
+    plain, streamed = vp.asyncio.run(run())
+    return plain, streamed, emitted
+
+
+def test_streamed_and_plain_results_match(monkeypatch):
+    reply = '{"recommendations": [{"candidate": 3}, {"candidate": 1}, {"candidate": 2}]}'
+    plain, streamed, emitted = generate_both(monkeypatch, reply)
+    assert plain == streamed
+    assert emitted == streamed["recommendations"]
+    assert streamed["source"] == "llm" and "llm_error" not in streamed
+
+
+def test_short_llm_answer_is_padded_and_not_cached(monkeypatch):
+    plain, streamed, emitted = generate_both(monkeypatch, '{"recommendations": [{"candidate": 2}]}')
+    assert plain == streamed
+    assert emitted == streamed["recommendations"]
+    assert len(streamed["recommendations"]) == vp.RECOMMEND_COUNT
+    assert streamed["llm_error"] == f"LLM returned 1 of {vp.RECOMMEND_COUNT} outfits"
+
+    cache = vp.RecommendationCache(8, 60)
+    cache.put("key", {"t1"}, None, streamed)
+    assert cache.get("key") is None
@@ -9,24 +9,62 @@ Run on Brev:   uvicorn vision_pipeline:app --host 0.0.0.0 --port 8000
 Skip LLM:      SKIP_LLM=1 python vision_pipeline.py   (for CPU-only testing)
 
 Endpoints:
-  GET  /health              → server + GPU status
+  GET  /health              → server + GPU status (liveness)
+  GET  /ready               → 200 once models are loaded + warmed, per-model timings
+  GET  /metrics             → Prometheus metrics (stage latencies, batches, queues, memory)
+  GET  /cache/stats         → vision result + recommendation cache counters
   POST /process-outfit      → full outfit photo → segmented + classified items
   POST /process-single      → single item photo → classified item
-  POST /recommend-outfits   → full wardrobe → outfit recommendations from Nemotron
+  POST /process-outfit/upload, /process-single/upload
+                            → same, with a raw (multipart or octet-stream) image body
+  POST /process-outfit/stream → per-item results as NDJSON or SSE (?format=sse)
+  Vision endpoints take embedding_encoding (list, f32, f16, int8), crop_format
+  (png, webp, jpeg, none), crop_quality and crop_max_side — in the JSON body,
+  or as query parameters for raw uploads, /process-batch and /jobs.
+  POST /process-batch       → many images (multipart or JSON) → per-image results as NDJSON/SSE
+  POST /reclassify          → stored embeddings (+ optional custom label banks) → fresh attributes
+  POST /similar-items       → nearest items to an embedding (or indexed item id)
+  POST /index/upsert, /index/remove
+                            → add / replace / delete embeddings in the in-process index
+  POST /jobs                → enqueue an outfit/single image, returns a job id (202)
+  GET  /jobs/{job_id}       → job status, plus the result once completed
+  POST /recommend-outfits   → full wardrobe → local outfit candidates, ranked by Nemotron
+  POST /recommend-outfits/stream → recommendations as NDJSON/SSE, one event per outfit
+  POST /recommend-outfits/invalidate → drop cached recommendations for a user / items
 """
 
 import os
 import io
 import json
+import zlib
 import base64
+import re
+import hashlib
+import time
+import uuid
+import random
+import queue
+import sqlite3
+import asyncio
 import logging
-from typing import Optional
-
+import resource
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, AsyncIterator, BinaryIO, Callable, Iterator, Literal, Optional, Union
+
+import httpx
+import orjson
 import torch
-import torch.nn as nn
 import numpy as np
+import onnxruntime as ort
 from PIL import Image
 from rembg import remove
+from rembg.sessions import sessions_class
+from scipy import ndimage
 from transformers import (
     SegformerImageProcessor,
     AutoModelForSemanticSegmentation,
@@ -35,9 +73,11 @@ from transformers import (
     AutoTokenizer,
     AutoModelForCausalLM,
 )
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from starlette.datastructures import UploadFile
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Config
@@ -47,6 +87,63 @@ DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 PORT = int(os.getenv("PORT", "8000"))
 API_KEY = os.getenv("VISION_API_KEY", "")
 SKIP_LLM = os.getenv("SKIP_LLM", "").strip() in ("1", "true", "yes")
+CLIP_BATCH_SIZE = int(os.getenv("CLIP_BATCH_SIZE", "32"))  # crops per FashionCLIP forward
+SEGFORMER_BATCH_SIZE = int(os.getenv("SEGFORMER_BATCH_SIZE", "8"))  # images per SegFormer forward
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "10"))  # how long a batch waits to fill
+VISION_WORKERS = int(os.getenv("VISION_WORKERS", "4"))  # concurrent vision pipeline runs
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "8"))  # concurrent vLLM calls (and candidate threads)
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "120"))  # default per-request deadline
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))  # on 5xx / 429 / connection errors
+CACHE_MAX_ITEMS = int(os.getenv("CACHE_MAX_ITEMS", "256"))  # in-memory result cache, 0 = off
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.expanduser("~/.cache/vlyzo/results"))  # "" = off
+CACHE_DISK_MAX_MB = int(os.getenv("CACHE_DISK_MAX_MB", "2048"))
+MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", "25"))  # raw image upload limit
+BATCH_MAX_IMAGES = int(os.getenv("BATCH_MAX_IMAGES", "100"))  # images per /process-batch call
+BATCH_STAGE_WORKERS = int(os.getenv("BATCH_STAGE_WORKERS", "4"))  # workers per batch model stage
+BATCH_QUEUE_DEPTH = int(os.getenv("BATCH_QUEUE_DEPTH", "16"))  # decoded images buffered per stage
+# In-process embedding index: exact top-k below INDEX_IVF_MIN_ITEMS vectors per
+# namespace, IVF (k-means lists, INDEX_IVF_PROBE lists searched) at or above it
+INDEX_DIR = os.getenv("INDEX_DIR", os.path.expanduser("~/.cache/vlyzo/index"))
+INDEX_MODE = os.getenv("INDEX_MODE", "auto").strip().lower()  # auto, exact or ivf
+INDEX_IVF_MIN_ITEMS = int(os.getenv("INDEX_IVF_MIN_ITEMS", "50000"))
+INDEX_IVF_PROBE = int(os.getenv("INDEX_IVF_PROBE", "8"))
+RECLASSIFY_MAX_ITEMS = int(os.getenv("RECLASSIFY_MAX_ITEMS", "100000"))  # per /reclassify call
+RECLASSIFY_CHUNK = int(os.getenv("RECLASSIFY_CHUNK", "8192"))  # embeddings per matmul
+RECOMMEND_CANDIDATES = int(os.getenv("RECOMMEND_CANDIDATES", "12"))  # local outfits sent to the LLM
+RECOMMEND_COUNT = int(os.getenv("RECOMMEND_COUNT", "3"))  # outfits returned
+LLM_PROMPT_TOKEN_BUDGET = int(os.getenv("LLM_PROMPT_TOKEN_BUDGET", "2048"))  # per ranking call
+RECOMMEND_CACHE_ITEMS = int(os.getenv("RECOMMEND_CACHE_ITEMS", "512"))  # 0 = off
+RECOMMEND_CACHE_TTL_S = float(os.getenv("RECOMMEND_CACHE_TTL_S", "86400"))
+JOBS_DB = os.getenv("JOBS_DB", os.path.expanduser("~/.cache/vlyzo/jobs.sqlite3"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))  # concurrent /jobs pipeline runs
+JOB_RETENTION_HOURS = float(os.getenv("JOB_RETENTION_HOURS", "24"))  # finished jobs kept
+# rembg and SegFormer run on a copy whose longest side is at most WORK_MAX_SIDE
+# (0 = full size). Crops are cut at that resolution unless full-resolution
+# crops are requested, in which case masks are projected back to the original.
+WORK_MAX_SIDE = int(os.getenv("WORK_MAX_SIDE", "1024"))
+FULL_RES_CROPS = os.getenv("FULL_RES_CROPS", "").strip() in ("1", "true", "yes")
+
+# SegFormer / FashionCLIP runtime: torch (eager PyTorch), onnx or onnx-int8
+# (graphs from `python export_onnx.py export [--int8]`, read from ONNX_DIR).
+# "stub" swaps every model (rembg included) for deterministic CPU stand-ins
+# with no downloads, for benchmarks and smoke tests (see benchmark.py).
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch").strip().lower()
+ONNX_DIR = os.getenv("ONNX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "onnx"))
+ONNX_INTRA_THREADS = int(os.getenv("ONNX_INTRA_THREADS", "0"))  # 0 = ONNX Runtime default
+
+# Bump PIPELINE_VERSION whenever pre/post-processing changes the output, so
+# cached results from the previous pipeline are not served.
+PIPELINE_VERSION = "3.2.0"
+SEGFORMER_MODEL_ID = "mattmdjaga/segformer_b2_clothes"
+FASHIONCLIP_MODEL_ID = "patrickjohncyh/fashion-clip"
+
+# rembg: u2net (default), u2netp (fast), isnet-general-use, silueta (small u2net)
+REMBG_MODEL = os.getenv("REMBG_MODEL", "u2net")  # outfit photos
+REMBG_SINGLE_MODEL = os.getenv("REMBG_SINGLE_MODEL", REMBG_MODEL)  # single-item shots
+REMBG_SESSIONS = int(os.getenv("REMBG_SESSIONS", "2"))  # concurrent ONNX sessions per model
+REMBG_INTRA_THREADS = int(os.getenv("REMBG_INTRA_THREADS", "0"))  # 0 = ONNX Runtime default
+REMBG_INTER_THREADS = int(os.getenv("REMBG_INTER_THREADS", "0"))
+REMBG_PROVIDERS = [p for p in os.getenv("REMBG_PROVIDERS", "").split(",") if p]
 
 logging.basicConfig(
     level=logging.INFO,
@@ -152,34 +249,414 @@ MATERIALS = [
 SEASONS = ["spring", "summer", "autumn", "winter", "all-season"]
 
 # ──────────────────────────────────────────────────────────────────────────────
-# Model Loading
+# Metrics (Prometheus text format on /metrics)
+# ──────────────────────────────────────────────────────────────────────────────
+# Pipeline stages are wrapped in ``with stage("name"):``, which observes a
+# per-stage latency histogram and adds the time to the current request's
+# breakdown (returned as a Server-Timing header). The breakdown lives in a
+# contextvar; run_in_pool copies the context into worker threads so stages
+# run there are still attributed to the request. Gauges (queue depths, cache
+# hit rates, memory) are read from their owners at scrape time.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+def _label_str(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_str(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series: dict[tuple, list] = {}  # labels → [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, n in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_label_str(key + (('le', str(bound)),))} {n}")
+                lines.append(f"{self.name}_bucket{_label_str(key + (('le', '+Inf'),))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_label_str(key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_label_str(key)} {series[-1]}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("vlyzo_stage_seconds", "Latency of each pipeline stage")
+BATCH_SIZE = Histogram("vlyzo_batch_size", "Inputs per micro-batched model forward", BATCH_BUCKETS)
+BATCH_SECONDS = Histogram("vlyzo_batch_seconds", "Latency of one micro-batched model forward")
+HTTP_SECONDS = Histogram("vlyzo_http_request_seconds", "HTTP request latency (until headers)")
+HTTP_REQUESTS = Counter("vlyzo_http_requests_total", "HTTP requests by route and status")
+ITEMS_PROCESSED = Counter("vlyzo_items_total", "Garments segmented and classified")
+
+request_timings: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+
+
+@contextmanager
+def stage(name: str):
+    """Time a pipeline stage into STAGE_SECONDS and the request's breakdown."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        timings = request_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def _rss_bytes() -> tuple[int, int]:
+    """(current, peak) resident set size of this process."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # KiB on Linux
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        current = 0
+    return current, max(current, peak)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Inference Backends (torch / onnx / onnx-int8)
+# ──────────────────────────────────────────────────────────────────────────────
+# SegFormer and both FashionCLIP towers sit behind one small interface, so
+# CPU hosts can run exported ONNX graphs (optionally int8-quantized) instead
+# of eager PyTorch. Every method takes and returns CPU tensors; CLIP features
+# are the raw projections (callers normalize).
+
+BACKEND_PARTS = ("segformer", "clip")
+
+
+def _ort_providers() -> list[str]:
+    available = ort.get_available_providers()
+    if DEVICE == "cuda" and "CUDAExecutionProvider" in available:
+        return ["CUDAExecutionProvider", "CPUExecutionProvider"]
+    return ["CPUExecutionProvider"]
+
+
+class TorchBackend:
+    name = "torch"
+
+    def __init__(self, device: str = DEVICE):
+        self.device = device
+        self.segformer = None
+        self.clip = None
+        self.logit_scale: Optional[float] = None
+
+    def load(self, *parts: str) -> "TorchBackend":
+        """Load the given parts ("segformer", "clip"), or all of them."""
+        for part in parts or BACKEND_PARTS:
+            if part == "segformer":
+                model = AutoModelForSemanticSegmentation.from_pretrained(SEGFORMER_MODEL_ID)
+                self.segformer = model.to(self.device).eval()
+            elif part == "clip":
+                model = CLIPModel.from_pretrained(FASHIONCLIP_MODEL_ID)
+                self.clip = model.to(self.device).eval()
+                self.logit_scale = self.clip.logit_scale.exp().item()
+        return self
+
+    def segformer_logits(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        with torch.no_grad():
+            return self.segformer(pixel_values=pixel_values.to(self.device)).logits.cpu()
+
+    def clip_image_features(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        inputs = {"pixel_values": pixel_values.to(self.device)}
+        with torch.no_grad():
+            output = self.clip.get_image_features(**inputs)
+            # Handle both old (raw tensor) and new (structured output) transformers versions
+            if hasattr(output, "image_embeds"):
+                feat = output.image_embeds
+            elif isinstance(output, torch.Tensor):
+                feat = output
+            else:
+                vision_out = self.clip.vision_model(**inputs)
+                feat = self.clip.visual_projection(vision_out.pooler_output)
+        return feat.float().cpu()
+
+    def clip_text_features(
+        self, input_ids: torch.Tensor, attention_mask: torch.Tensor
+    ) -> torch.Tensor:
+        inputs = {
+            "input_ids": input_ids.to(self.device),
+            "attention_mask": attention_mask.to(self.device),
+        }
+        with torch.no_grad():
+            output = self.clip.get_text_features(**inputs)
+            if hasattr(output, "text_embeds"):
+                feat = output.text_embeds
+            elif isinstance(output, torch.Tensor):
+                feat = output
+            else:
+                text_out = self.clip.text_model(**inputs)
+                feat = self.clip.text_projection(text_out.pooler_output)
+        return feat.float().cpu()
+
+
+class OnnxBackend:
+    """ONNX Runtime sessions for the graphs written by export_onnx.py."""
+
+    GRAPHS = {"segformer": ("segformer",), "clip": ("clip_image", "clip_text")}
+
+    def __init__(self, directory: str, quantized: bool = False):
+        self.name = "onnx-int8" if quantized else "onnx"
+        self.directory = directory
+        self.quantized = quantized
+        self.sessions: dict = {}
+        self.logit_scale: Optional[float] = None
+
+    def _read_meta(self) -> dict:
+        meta_path = os.path.join(self.directory, "meta.json")
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError(
+                f"No ONNX export in {self.directory}. Run: python export_onnx.py export"
+                + (" --int8" if self.quantized else "")
+            )
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if (meta["segformer"], meta["fashionclip"]) != (SEGFORMER_MODEL_ID, FASHIONCLIP_MODEL_ID):
+            raise ValueError(f"ONNX export in {self.directory} is for different models: {meta}")
+        return meta
+
+    def load(self, *parts: str) -> "OnnxBackend":
+        """Open the sessions for the given parts ("segformer", "clip"), or all."""
+        meta = self._read_meta()
+        self.logit_scale = meta["logit_scale"]
+
+        sess_opts = ort.SessionOptions()
+        sess_opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if ONNX_INTRA_THREADS:
+            sess_opts.intra_op_num_threads = ONNX_INTRA_THREADS
+        suffix = ".int8.onnx" if self.quantized else ".onnx"
+        for part in parts or BACKEND_PARTS:
+            for graph in self.GRAPHS[part]:
+                path = os.path.join(self.directory, graph + suffix)
+                if not os.path.exists(path):
+                    raise FileNotFoundError(f"Missing ONNX graph: {path}")
+                self.sessions[graph] = ort.InferenceSession(
+                    path, sess_opts, providers=_ort_providers()
+                )
+        return self
+
+    def _run(self, graph: str, **inputs: torch.Tensor) -> torch.Tensor:
+        feeds = {name: tensor.cpu().numpy() for name, tensor in inputs.items()}
+        return torch.from_numpy(self.sessions[graph].run(None, feeds)[0])
+
+    def segformer_logits(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        return self._run("segformer", pixel_values=pixel_values)
+
+    def clip_image_features(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        return self._run("clip_image", pixel_values=pixel_values)
+
+    def clip_text_features(
+        self, input_ids: torch.Tensor, attention_mask: torch.Tensor
+    ) -> torch.Tensor:
+        return self._run("clip_text", input_ids=input_ids, attention_mask=attention_mask)
+
+
+class StubBackend:
+    """Deterministic stand-in for SegFormer and FashionCLIP.
+
+    Foreground pixels (anything darker than the near-white studio background)
+    are labelled upper-clothes / pants / shoes by height; CLIP features are a
+    fixed random projection of the pixels or token ids. Shapes and dtypes match
+    the real models, the values mean nothing.
+    """
+
+    name = "stub"
+    IMAGE_SIDE = 32  # CLIP pixels are projected from a 32×32 thumbnail
+    VOCAB = 4096
+    DIM = 512
+
+    def __init__(self, seed: int = 0):
+        self.seed = seed
+        self._image_proj: Optional[torch.Tensor] = None
+        self._token_proj: Optional[torch.Tensor] = None
+        self.logit_scale: Optional[float] = None
+
+    def load(self, *parts: str) -> "StubBackend":
+        if self._image_proj is None:
+            gen = torch.Generator().manual_seed(self.seed)
+            self._image_proj = torch.randn(3 * self.IMAGE_SIDE**2, self.DIM, generator=gen)
+            self._token_proj = torch.randn(self.VOCAB, self.DIM, generator=gen)
+            self.logit_scale = 100.0
+        return self
+
+    def segformer_logits(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        b, _, h, w = pixel_values.shape
+        foreground = pixel_values.mean(dim=1) < 0.9  # (B, H, W)
+        row = torch.arange(h).view(1, h, 1).expand(b, h, w)
+        garment = torch.full((b, h, w), 9, dtype=torch.long)  # Left-shoe
+        garment[row < 0.85 * h] = 6  # Pants
+        garment[row < 0.45 * h] = 4  # Upper-clothes
+        labels = garment * foreground
+        logits = torch.nn.functional.one_hot(labels, len(SEGFORMER_LABELS)).float() * 10
+        return logits.permute(0, 3, 1, 2)
+
+    def clip_image_features(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        thumbs = torch.nn.functional.interpolate(
+            pixel_values, size=(self.IMAGE_SIDE, self.IMAGE_SIDE), mode="area"
+        )
+        return (thumbs.flatten(1) - 0.5) @ self._image_proj
+
+    def clip_text_features(
+        self, input_ids: torch.Tensor, attention_mask: torch.Tensor
+    ) -> torch.Tensor:
+        mask = attention_mask.unsqueeze(-1).float()
+        return (self._token_proj[input_ids] * mask).sum(dim=1) / mask.sum(dim=1)
+
+
+def load_backend(name: str):
+    """Construct a backend; nothing is loaded until ``.load()``."""
+    if name == "torch":
+        return TorchBackend()
+    if name in ("onnx", "onnx-int8"):
+        return OnnxBackend(ONNX_DIR, quantized=name == "onnx-int8")
+    if name == "stub":
+        return StubBackend()
+    raise ValueError(f"Unknown INFERENCE_BACKEND: {name!r} (torch, onnx, onnx-int8, stub)")
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Model Registry
 # ──────────────────────────────────────────────────────────────────────────────
+# Nothing is loaded at import time. On server startup every registered model
+# loads in parallel in the background and then runs a synthetic warmup
+# inference; /health answers immediately (liveness) while /ready reports
+# per-model progress and timings (readiness). Code paths call models.get(),
+# which loads just that model on demand when used outside the server (tests,
+# tooling) and otherwise waits for the background load.
+
+
+class ModelRegistry:
+    def __init__(self):
+        self._specs: dict[str, tuple[Callable, Optional[Callable], tuple]] = {}
+        self._loaded: dict[str, Future] = {}
+        self._status: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def register(
+        self,
+        name: str,
+        loader: Callable[[], Any],
+        warmup: Optional[Callable[[Any], None]] = None,
+        depends_on: tuple[str, ...] = (),
+    ) -> None:
+        self._specs[name] = (loader, warmup, depends_on)
+        self._status[name] = {"state": "pending"}
+
+    def start(self) -> None:
+        """Begin loading every registered model in the background."""
+        for name in self._specs:
+            self._ensure(name)
+
+    def get(self, name: str) -> Any:
+        """The loaded model; blocks until it is loaded, raises if loading failed."""
+        return self._ensure(name).result()
+
+    def _ensure(self, name: str) -> Future:
+        with self._lock:
+            future = self._loaded.get(name)
+            if future is None:
+                future = self._loaded[name] = Future()
+                threading.Thread(
+                    target=self._load, args=(name, future), name=f"load-{name}", daemon=True
+                ).start()
+        return future
+
+    def _load(self, name: str, future: Future) -> None:
+        loader, warmup, depends_on = self._specs[name]
+        status = self._status[name]
+        try:
+            for dep in depends_on:
+                self.get(dep)
+
+            status["state"] = "loading"
+            t0 = time.perf_counter()
+            value = loader()
+            status["load_s"] = round(time.perf_counter() - t0, 3)
+            # Callers may use the model while it warms up
+            future.set_result(value)
+
+            if warmup is not None:
+                status["state"] = "warming"
+                t0 = time.perf_counter()
+                warmup(value)
+                status["warmup_s"] = round(time.perf_counter() - t0, 3)
+            status["state"] = "ready"
+            logger.info(
+                f"  [models] {name} ready (load {status['load_s']}s"
+                + (f", warmup {status['warmup_s']}s)" if "warmup_s" in status else ")")
+            )
+            if self.ready():
+                logger.info("All models ready.")
+        except Exception as e:
+            status["state"] = "failed"
+            status["error"] = str(e)
+            logger.error(f"  [models] {name} failed to load: {e}", exc_info=True)
+            if not future.done():
+                future.set_exception(e)
+
+    def ready(self) -> bool:
+        return all(st["state"] == "ready" for st in self._status.values())
+
+    def status(self) -> dict:
+        return {name: dict(st) for name, st in self._status.items()}
+
+
+models = ModelRegistry()
+inference_backend = load_backend(INFERENCE_BACKEND)
 
 logger.info(f"Device: {DEVICE}")
 if DEVICE == "cuda":
     logger.info(f"GPU: {torch.cuda.get_device_name(0)}")
     logger.info(f"VRAM: {torch.cuda.get_device_properties(0).total_memory / 1e9:.1f} GB")
 
-logger.info("Loading SegFormer B2 (mattmdjaga/segformer_b2_clothes)...")
-segformer_processor = SegformerImageProcessor.from_pretrained(
-    "mattmdjaga/segformer_b2_clothes"
-)
-segformer_model = AutoModelForSemanticSegmentation.from_pretrained(
-    "mattmdjaga/segformer_b2_clothes"
-).to(DEVICE)
-segformer_model.eval()
-
-logger.info("Loading FashionCLIP (patrickjohncyh/fashion-clip)...")
-fashionclip_processor = CLIPProcessor.from_pretrained("patrickjohncyh/fashion-clip")
-fashionclip_model = CLIPModel.from_pretrained("patrickjohncyh/fashion-clip").to(DEVICE)
-fashionclip_model.eval()
-
-logger.info("rembg will lazy-load its U2-Net weights on first request.")
-
 # ── Nemotron-Nano-9B-v2 (served by vLLM on port 8001) ──
 # vLLM properly handles the Mamba-2 hybrid cache that transformers doesn't support.
 # Start vLLM separately: vllm serve nvidia/NVIDIA-Nemotron-Nano-9B-v2 --port 8001 --trust-remote-code
 VLLM_URL = os.getenv("VLLM_URL", "http://localhost:8001")
+LLM_MODEL = "nvidia/NVIDIA-Nemotron-Nano-9B-v2"
 LLM_AVAILABLE = not SKIP_LLM
 
 if SKIP_LLM:
@@ -188,7 +665,100 @@ else:
     logger.info(f"Nemotron will be called via vLLM at {VLLM_URL}")
     logger.info("Make sure vLLM is running: vllm serve nvidia/NVIDIA-Nemotron-Nano-9B-v2 --port 8001 --trust-remote-code")
 
-logger.info("All models ready.")
+# ──────────────────────────────────────────────────────────────────────────────
+# Inference Scheduler (cross-request micro-batching)
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+class MicroBatcher:
+    """Queues single inputs from concurrent requests and runs them as batches.
+
+    One worker thread per model pulls up to ``max_batch_size`` queued inputs,
+    waiting at most ``max_wait_ms`` for the batch to fill, calls ``batch_fn``
+    once and resolves each caller's future with its own output.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        batch_fn: Callable[[list], list],
+        max_batch_size: int,
+        max_wait_ms: float,
+    ):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._queue: queue.Queue = queue.Queue()
+        self._worker = threading.Thread(
+            target=self._run, name=f"batcher-{name}", daemon=True
+        )
+        self._worker.start()
+
+    def submit(self, item: Any) -> Future:
+        future: Future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def map(self, items: list) -> list:
+        """Submit every item at once (so they share batches) and wait for all."""
+        futures = [self.submit(item) for item in items]
+        return [future.result() for future in futures]
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def _collect(self) -> list[tuple[Any, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            BATCH_SIZE.observe(len(batch), model=self.name)
+            start = time.perf_counter()
+            try:
+                outputs = self.batch_fn([item for item, _ in batch])
+                BATCH_SECONDS.observe(time.perf_counter() - start, model=self.name)
+            except Exception as e:
+                logger.error(f"  [{self.name}] Batch of {len(batch)} failed: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), output in zip(batch, outputs):
+                future.set_result(output)
+
+
+def _segformer_forward(images: list[Image.Image]) -> list[torch.Tensor]:
+    """RGB images → per-image SegFormer logits at model resolution (1, 18, h, w)."""
+    processor = models.get("segformer")
+    pixel_values = processor(images=images, return_tensors="pt")["pixel_values"]
+    return list(inference_backend.segformer_logits(pixel_values).split(1))
+
+
+def _fashionclip_forward(images: list[Image.Image]) -> list[torch.Tensor]:
+    """RGB images → per-image normalized FashionCLIP embeddings (512,)."""
+    processor = models.get("fashionclip")
+    pixel_values = processor(images=images, return_tensors="pt")["pixel_values"]
+    return list(_image_features(pixel_values))
+
+
+segformer_batcher = MicroBatcher(
+    "segformer", _segformer_forward, SEGFORMER_BATCH_SIZE, BATCH_MAX_WAIT_MS
+)
+fashionclip_batcher = MicroBatcher(
+    "fashionclip", _fashionclip_forward, CLIP_BATCH_SIZE, BATCH_MAX_WAIT_MS
+)
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Image Helpers
@@ -196,15 +766,77 @@ logger.info("All models ready.")
 
 
 def decode_base64_image(b64: str) -> Image.Image:
+    return load_image(decode_base64_bytes(b64))
+
+
+def decode_base64_bytes(b64: str) -> bytes:
     if "," in b64 and b64.index(",") < 100:
         b64 = b64.split(",", 1)[1]
-    return Image.open(io.BytesIO(base64.b64decode(b64))).convert("RGB")
+    return base64.b64decode(b64)
 
 
-def encode_image_base64(img: Image.Image, fmt: str = "PNG") -> str:
-    buf = io.BytesIO()
-    img.save(buf, format=fmt)
-    return base64.b64encode(buf.getvalue()).decode()
+def load_image(source: Union[bytes, BinaryIO], max_side: int = 0) -> Image.Image:
+    """Decode raw image bytes or a readable file object (no extra copy).
+
+    With ``max_side``, the result is downscaled so its longest side fits;
+    JPEGs use draft mode, letting libjpeg decode at 1/2, 1/4 or 1/8 scale
+    instead of decoding every pixel and resizing afterwards.
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    img = Image.open(source)
+    if max_side and max(img.size) > max_side:
+        target = _fit_size(img.size, max_side)
+        if img.format == "JPEG":
+            img.draft("RGB", target)
+        img = img.convert("RGB")
+        if img.size != target:
+            img = img.resize(target, Image.BILINEAR, reducing_gap=2.0)
+        return img
+    return img.convert("RGB")
+
+
+def _fit_size(size: tuple[int, int], max_side: int) -> tuple[int, int]:
+    w, h = size
+    scale = max_side / max(w, h)
+    return max(1, round(w * scale)), max(1, round(h * scale))
+
+
+def prepare_input(
+    source: Union[bytes, BinaryIO], full_resolution: bool = False
+) -> tuple[Image.Image, Optional[Image.Image]]:
+    """Decode an upload into ``(working, original)``.
+
+    ``working`` fits WORK_MAX_SIDE and is what rembg and SegFormer see.
+    ``original`` is the full-resolution decode, returned only when
+    full-resolution crops are wanted and it is actually larger.
+    """
+    with stage("decode"):
+        if not full_resolution:
+            return load_image(source, WORK_MAX_SIDE), None
+        original = load_image(source)
+        if not WORK_MAX_SIDE or max(original.size) <= WORK_MAX_SIDE:
+            return original, None
+        working = original.resize(
+            _fit_size(original.size, WORK_MAX_SIDE), Image.BILINEAR, reducing_gap=2.0
+        )
+        return working, original
+
+
+def project_alpha(original: Image.Image, clean: Image.Image) -> Image.Image:
+    """Carry the background-removal alpha of a downscaled working image over
+    to the full-resolution original."""
+    alpha = clean.getchannel("A").resize(original.size, Image.BILINEAR)
+    out = original.convert("RGBA")
+    out.putalpha(alpha)
+    return out
+
+
+def encode_image_base64(img: Image.Image, fmt: str = "PNG", **save_kwargs) -> str:
+    with stage("encode"):
+        buf = io.BytesIO()
+        img.save(buf, format=fmt, **save_kwargs)
+        return base64.b64encode(buf.getvalue()).decode()
 
 
 def to_rgba(img: Image.Image) -> Image.Image:
@@ -225,9 +857,75 @@ def rgba_to_white_bg(img: Image.Image) -> Image.Image:
 # ──────────────────────────────────────────────────────────────────────────────
 
 
-def remove_background(image: Image.Image) -> Image.Image:
+def _new_rembg_session(
+    model_name: str, providers: list[str], intra_threads: int, inter_threads: int
+):
+    """rembg's new_session() only reads thread counts from OMP_NUM_THREADS, so
+    build the session class directly with our own SessionOptions."""
+    sess_opts = ort.SessionOptions()
+    if intra_threads:
+        sess_opts.intra_op_num_threads = intra_threads
+    if inter_threads:
+        sess_opts.inter_op_num_threads = inter_threads
+    for session_class in sessions_class:
+        if session_class.name() == model_name:
+            return session_class(model_name, sess_opts, providers)
+    raise ValueError(f"Unknown rembg model: {model_name}")
+
+
+def _rembg_providers() -> list[str]:
+    return REMBG_PROVIDERS or _ort_providers()
+
+
+class BackgroundRemover:
+    """A pool of long-lived rembg sessions for one model.
+
+    A session is borrowed by one thread at a time, so up to ``size`` removals
+    run concurrently and further callers wait for a free session.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        size: int,
+        providers: list[str],
+        intra_threads: int = 0,
+        inter_threads: int = 0,
+    ):
+        self.model_name = model_name
+        self.size = max(1, size)
+        self._sessions: queue.Queue = queue.Queue()
+        for _ in range(self.size):
+            self._sessions.put(
+                _new_rembg_session(model_name, providers, intra_threads, inter_threads)
+            )
+
+    def remove(self, image: Image.Image) -> Image.Image:
+        session = self._sessions.get()
+        try:
+            return to_rgba(remove(image, session=session))
+        finally:
+            self._sessions.put(session)
+
+    def warmup(self) -> None:
+        """Run every session once so ONNX Runtime allocates before traffic."""
+        sessions = [self._sessions.get() for _ in range(self.size)]
+        try:
+            dummy = Image.new("RGB", (320, 320), (255, 255, 255))
+            for session in sessions:
+                remove(dummy, session=session)
+        finally:
+            for session in sessions:
+                self._sessions.put(session)
+
+
+def remove_background(
+    image: Image.Image, remover: Optional[BackgroundRemover] = None
+) -> Image.Image:
     logger.info("  [Step 1] Removing background...")
-    result = to_rgba(remove(image))
+    remover = remover or models.get("rembg")["outfit"]
+    with stage("rembg"):
+        result = remover.remove(image)
     logger.info(f"  [Step 1] Done. Size: {result.size}")
     return result
 
@@ -240,6 +938,7 @@ def remove_background(image: Image.Image) -> Image.Image:
 def segment_clothing(
     image: Image.Image,
     min_area: float = 0.005,
+    source: Optional[Image.Image] = None,
 ) -> list[dict]:
     """
     Segment clothing items using SegFormer B2 (trained on ATR dataset).
@@ -247,62 +946,59 @@ def segment_clothing(
 
     Unlike CLIPSeg, SegFormer was specifically trained for this task
     and outputs 18 semantic labels with pixel-level accuracy.
+
+    ``source`` is an optional higher-resolution RGBA version of ``image``;
+    masks are then produced at its size and crops are cut from it.
     """
     logger.info("  [Step 2] Segmenting with SegFormer...")
 
     rgb = image.convert("RGB")
-    w, h = rgb.size
-
-    # Run SegFormer
-    inputs = segformer_processor(images=rgb, return_tensors="pt")
-    inputs = {k: v.to(DEVICE) for k, v in inputs.items()}
-
-    with torch.no_grad():
-        outputs = segformer_model(**inputs)
-
-    # Upsample logits to original image size
-    logits = outputs.logits.cpu()
-    upsampled = nn.functional.interpolate(
-        logits,
-        size=(h, w),
-        mode="bilinear",
-        align_corners=False,
-    )
-    seg_map = upsampled.argmax(dim=1)[0].numpy()  # (H, W) with label IDs
+    target = source if source is not None else image
+    w, h = target.size
 
-    # Extract each clothing item
-    found: list[dict] = []
-    merge_masks: dict[str, np.ndarray] = {}  # for merging L/R shoes
+    # Run SegFormer (batched with concurrent requests by the scheduler)
+    with stage("segformer"):
+        logits = segformer_batcher.submit(rgb).result()
 
-    for label_id, label_name in CLOTHING_LABELS.items():
-        mask = (seg_map == label_id).astype(np.uint8)
-        area_ratio = mask.sum() / (h * w)
+    # Argmax at model resolution (~128×128); the full-size (18, H, W) logit
+    # tensor is never built
+    with stage("mask_postprocess"):
+        logits = logits[0].float().numpy()  # (18, lh, lw)
+        seg_low = logits.argmax(axis=0)
 
-        if area_ratio < min_area:
-            continue
+        # Per-label areas from one bincount pass
+        areas = np.bincount(seg_low.ravel(), minlength=logits.shape[0]) / seg_low.size
 
-        # Merge left/right shoes into a single "Shoes" entry
+    # Keep labels above min_area, merging left/right shoes into "Shoes"
+    groups: dict[str, list[int]] = {}
+    for label_id, label_name in CLOTHING_LABELS.items():
+        if areas[label_id] < min_area:
+            continue
         merged_name = MERGE_LABELS.get(label_name, label_name)
-        if merged_name in merge_masks:
-            merge_masks[merged_name] = np.logical_or(
-                merge_masks[merged_name], mask
-            ).astype(np.uint8)
-        else:
-            merge_masks[merged_name] = mask
+        groups.setdefault(merged_name, []).append(label_id)
 
-    # Crop each merged mask
-    for label_name, mask in merge_masks.items():
-        area_ratio = mask.sum() / (h * w)
-        cropped = _crop_mask(image, mask)
+    # Upsample only each surviving item's bounding box, then crop. The RGBA
+    # array is built once and shared by every item's crop.
+    found: list[dict] = []
+    rgba = np.asarray(to_rgba(target)) if groups else None
+    for label_name, label_ids in groups.items():
+        with stage("mask_postprocess"):
+            mask, offset = _upsample_label_mask(logits, seg_low, label_ids, (h, w))
+        if mask is None:
+            continue
+
+        with stage("crop"):
+            cropped = _crop_mask(rgba, mask, offset)
         if cropped is None:
             continue
 
         found.append({
             "label": label_name,
-            "mask": mask,
+            "mask": mask,  # bounding-box coordinates, see "offset"
+            "offset": offset,
             "cropped": cropped,
             "confidence": 1.0,  # SegFormer is deterministic, no confidence score
-            "area": area_ratio,
+            "area": float(areas[label_ids].sum()),
         })
 
     labels = [f["label"] for f in found]
@@ -310,65 +1006,238 @@ def segment_clothing(
     return found
 
 
+def _bilinear_axis(
+    n_out: int, n_in: int, start: int, stop: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Source indices and weights that bilinear interpolation (align_corners=False,
+    as in F.interpolate) uses for output positions ``start..stop-1`` on one axis."""
+    src = np.maximum((np.arange(start, stop) + 0.5) * (n_in / n_out) - 0.5, 0)
+    i0 = np.minimum(np.floor(src).astype(np.int64), n_in - 1)
+    i1 = np.minimum(i0 + 1, n_in - 1)
+    return i0, i1, (src - i0).astype(np.float32)
+
+
+def _upsample_label_mask(
+    logits: np.ndarray,
+    seg_low: np.ndarray,
+    label_ids: list[int],
+    out_size: tuple[int, int],
+    tile_rows: int = 64,
+) -> tuple[Optional[np.ndarray], tuple[int, int]]:
+    """Full-resolution mask of ``label_ids`` inside its bounding box only.
+
+    Within the box this matches argmax over bilinearly upsampled logits, but
+    the logits are upsampled a band of ``tile_rows`` rows at a time, so peak
+    memory is ~18 × tile_rows × box width floats instead of 18 × H × W.
+    Returns ``(mask, (top, left))`` with the mask in bounding-box coordinates.
+    """
+    h, w = out_size
+    lh, lw = seg_low.shape
+
+    in_group = np.isin(seg_low, label_ids)
+    rows = np.flatnonzero(in_group.any(axis=1))
+    cols = np.flatnonzero(in_group.any(axis=0))
+    if rows.size == 0:
+        return None, (0, 0)
+
+    # Grow the low-res box by one cell (bilinear blending reaches one model
+    # pixel past the argmax footprint) and project it to output pixels
+    r0, r1 = max(rows[0] - 1, 0), min(rows[-1] + 2, lh)
+    c0, c1 = max(cols[0] - 1, 0), min(cols[-1] + 2, lw)
+    top, bottom = int(np.floor(r0 * h / lh)), min(h, int(np.ceil(r1 * h / lh)))
+    left, right = int(np.floor(c0 * w / lw)), min(w, int(np.ceil(c1 * w / lw)))
+
+    mask = np.empty((bottom - top, right - left), dtype=np.uint8)
+    x0, x1, wx = _bilinear_axis(w, lw, left, right)
+    for start in range(top, bottom, tile_rows):
+        stop = min(start + tile_rows, bottom)
+        y0, y1, wy = _bilinear_axis(h, lh, start, stop)
+        band = logits[:, y0] * (1 - wy)[:, None] + logits[:, y1] * wy[:, None]
+        tile = band[:, :, x0] * (1 - wx) + band[:, :, x1] * wx  # (18, rows, box width)
+        mask[start - top : stop - top] = np.isin(tile.argmax(axis=0), label_ids)
+    return mask, (top, left)
+
+
 def _crop_mask(
-    image: Image.Image, mask: np.ndarray, pad: int = 10
+    rgba: np.ndarray,
+    mask: np.ndarray,
+    offset: tuple[int, int] = (0, 0),
+    pad: int = 10,
 ) -> Optional[Image.Image]:
     """Crop image using the largest connected component of the mask.
     For merged items (e.g. left+right shoes), this gives CLIP a tight
-    crop of one shoe rather than a wide sparse image with a gap."""
-    from scipy import ndimage
+    crop of one shoe rather than a wide sparse image with a gap.
 
+    ``rgba`` is the whole (H, W, 4) image, shared across items; ``mask``
+    covers only the item's bounding box, whose top-left corner is at
+    ``offset``. Labelling runs on that region and only the crop is copied."""
     labeled, n_components = ndimage.label(mask)
     if n_components == 0:
         return None
 
     # Use the largest connected component for tight cropping
     if n_components > 1:
-        component_sizes = ndimage.sum(mask, labeled, range(1, n_components + 1))
+        component_sizes = np.bincount(labeled.ravel())[1:]
         largest_id = int(np.argmax(component_sizes)) + 1
-        crop_mask = (labeled == largest_id).astype(np.uint8)
     else:
-        crop_mask = mask
+        largest_id = 1
+    rows, cols = ndimage.find_objects(labeled, max_label=largest_id)[largest_id - 1]
+
+    # Component box + padding, in image coordinates
+    top, left = offset
+    h, w = rgba.shape[:2]
+    r0 = max(0, top + rows.start - pad)
+    r1 = min(h, top + rows.stop + pad)
+    c0 = max(0, left + cols.start - pad)
+    c1 = min(w, left + cols.stop + pad)
+
+    # Keep alpha only on the component (the padded crop may overhang the mask)
+    keep = np.zeros((r1 - r0, c1 - c0), dtype=bool)
+    mr0, mr1 = max(r0, top), min(r1, top + mask.shape[0])
+    mc0, mc1 = max(c0, left), min(c1, left + mask.shape[1])
+    keep[mr0 - r0 : mr1 - r0, mc0 - c0 : mc1 - c0] = (
+        labeled[mr0 - top : mr1 - top, mc0 - left : mc1 - left] == largest_id
+    )
 
-    rows = np.any(crop_mask, axis=1)
-    cols = np.any(crop_mask, axis=0)
-    if not rows.any() or not cols.any():
-        return None
+    crop = rgba[r0:r1, c0:c1].copy()
+    crop[:, :, 3] = np.where(keep, crop[:, :, 3], 0)
+    return Image.fromarray(crop, "RGBA")
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Step 3 — Classification + Embedding (FashionCLIP)
+# ──────────────────────────────────────────────────────────────────────────────
 
-    r0, r1 = np.where(rows)[0][[0, -1]]
-    c0, c1 = np.where(cols)[0][[0, -1]]
 
-    h, w = mask.shape
-    r0 = max(0, r0 - pad)
-    r1 = min(h - 1, r1 + pad)
-    c0 = max(0, c0 - pad)
-    c1 = min(w - 1, c1 + pad)
+PROMPT_TEMPLATE = "a photo of {}"
 
-    rgba = np.array(to_rgba(image))
-    alpha = np.zeros((h, w), dtype=np.uint8)
-    alpha[crop_mask > 0] = 255
-    rgba[:, :, 3] = np.minimum(rgba[:, :, 3], alpha)
+# Every attribute FashionCLIP predicts, in the order they appear in ItemOut
+LABEL_BANKS = {
+    "category": CATEGORIES,
+    "style": STYLES,
+    "color": COLORS,
+    "pattern": PATTERNS,
+    "material": MATERIALS,
+    "season": SEASONS,
+}
 
-    return Image.fromarray(rgba[r0 : r1 + 1, c0 : c1 + 1], "RGBA")
 
+def _image_features(pixel_values: torch.Tensor, backend=None) -> torch.Tensor:
+    """L2-normalized FashionCLIP image embeddings, shape (B, 512)."""
+    feat = (backend or inference_backend).clip_image_features(pixel_values)
+    return feat / feat.norm(p=2, dim=-1, keepdim=True)
 
-# ──────────────────────────────────────────────────────────────────────────────
-# Step 3 — Classification + Embedding (FashionCLIP)
-# ──────────────────────────────────────────────────────────────────────────────
 
+def _text_features(prompts: list[str], backend=None) -> torch.Tensor:
+    """L2-normalized FashionCLIP text embeddings, shape (N, 512)."""
+    inputs = models.get("fashionclip")(
+        text=prompts, return_tensors="pt", padding=True, truncation=True
+    )
+    feat = (backend or inference_backend).clip_text_features(
+        inputs["input_ids"], inputs["attention_mask"]
+    )
+    return feat / feat.norm(p=2, dim=-1, keepdim=True)
+
+
+class LabelBankClassifier:
+    """Zero-shot classifier over a fixed set of label banks.
+
+    All prompts are encoded once into a single normalized text matrix, so an
+    image needs one image-tower pass, one matmul and a softmax per bank slice.
+    This gives the same probabilities as CLIP's ``logits_per_image`` per bank.
+    """
+
+    def __init__(
+        self,
+        banks: dict[str, list[str]],
+        template: str = PROMPT_TEMPLATE,
+        backend=None,
+    ):
+        backend = backend or inference_backend
+        self.banks = banks
+        self.slices: dict[str, slice] = {}
+        prompts: list[str] = []
+        for name, labels in banks.items():
+            self.slices[name] = slice(len(prompts), len(prompts) + len(labels))
+            prompts.extend(template.format(label) for label in labels)
+        self.text_matrix = _text_features(prompts, backend)  # (n_prompts, 512)
+        self.logit_scale = backend.logit_scale
+
+    def probabilities(self, image_feats: torch.Tensor) -> dict[str, torch.Tensor]:
+        """Per-bank softmax probabilities, each of shape (B, len(bank))."""
+        image_feats = image_feats.to(self.text_matrix.device)
+        with torch.no_grad():
+            logits = self.logit_scale * image_feats @ self.text_matrix.T
+        logits = logits.float().cpu()
+        return {
+            name: logits[:, s].softmax(dim=-1) for name, s in self.slices.items()
+        }
+
+    def attributes(self, image_feats: torch.Tensor) -> list[dict]:
+        """Top label per bank (top 3 for category) for each row of features.
+
+        Ranking and rounding run once per bank over the whole batch; only
+        building the result dicts is per row."""
+        probs = self.probabilities(image_feats)
+        ranked = {}
+        for name, labels in self.banks.items():
+            p = probs[name].numpy()
+            k = min(3 if name == "category" else 1, len(labels))
+            idx = np.argsort(-p, axis=1, kind="stable")[:, :k]
+            conf = np.round(np.take_along_axis(p, idx, axis=1).astype(np.float64), 4)
+            ranked[name] = [
+                [{"label": labels[i], "confidence": c} for i, c in zip(row_idx, row_conf)]
+                for row_idx, row_conf in zip(idx.tolist(), conf.tolist())
+            ]
+        return [dict(zip(ranked, row)) for row in zip(*ranked.values())]
+
+
+def classify_items(images: list[Image.Image]) -> list[dict]:
+    """Classify many crops with batched FashionCLIP image-tower passes.
+
+    All crops are queued on the FashionCLIP scheduler together, so they share
+    batches of up to CLIP_BATCH_SIZE (with crops from concurrent requests);
+    results come back in the same order as ``images``.
+    """
+    if not images:
+        return []
 
-def classify_item(image: Image.Image) -> dict:
     # Composite onto white bg — CLIP expects solid backgrounds, not transparency
-    rgb = rgba_to_white_bg(image)
+    rgbs = [rgba_to_white_bg(img) for img in images]
+
+    with stage("clip"):
+        feats = torch.stack(fashionclip_batcher.map(rgbs))
+        attrs = models.get("label_banks").attributes(feats)
+    ITEMS_PROCESSED.inc(len(images))
+    return [
+        _classification(item_attrs, feat) for item_attrs, feat in zip(attrs, feats)
+    ]
+
+
+def classify_item(image: Image.Image) -> dict:
+    return classify_items([image])[0]
+
+
+def _classification(attrs: dict, feat: torch.Tensor) -> dict:
+    return {
+        **_attribute_fields(attrs),
+        "embedding": feat.numpy(),  # float32 (512,), encoded per request by _item_out
+    }
+
+
+def _attribute_fields(attrs: dict) -> dict:
+    """ItemOut attribute fields + tags from LabelBankClassifier.attributes().
 
-    cat = _zs_classify(rgb, CATEGORIES, top_k=3)
-    sty = _zs_classify(rgb, STYLES)[0]
-    col = _zs_classify(rgb, COLORS)[0]
-    pat = _zs_classify(rgb, PATTERNS)[0]
-    mat = _zs_classify(rgb, MATERIALS)[0]
-    sea = _zs_classify(rgb, SEASONS)[0]
+    Banks beyond LABEL_BANKS (custom banks on /reclassify) are added as extra
+    top-1 fields and tags."""
+    cat = attrs["category"]
+    sty = attrs["style"][0]
+    col = attrs["color"][0]
+    pat = attrs["pattern"][0]
+    mat = attrs["material"][0]
+    sea = attrs["season"][0]
 
-    emb = _embedding(rgb)
+    extra = {name: top[0] for name, top in attrs.items() if name not in LABEL_BANKS}
 
     tags = list(
         set(
@@ -379,6 +1248,7 @@ def classify_item(image: Image.Image) -> dict:
                 pat["label"],
                 mat["label"],
                 sea["label"],
+                *(attr["label"] for attr in extra.values()),
             ]
         )
     )
@@ -391,39 +1261,97 @@ def classify_item(image: Image.Image) -> dict:
         "pattern": pat,
         "material": mat,
         "season": sea,
+        **extra,
         "tags": tags,
-        "embedding": emb,
     }
 
 
-def _zs_classify(img: Image.Image, labels: list[str], top_k: int = 1) -> list[dict]:
-    prompts = [f"a photo of {l}" for l in labels]
-    inputs = fashionclip_processor(
-        text=prompts, images=img, return_tensors="pt", padding=True, truncation=True
-    )
-    inputs = {k: v.to(DEVICE) for k, v in inputs.items()}
-    with torch.no_grad():
-        out = fashionclip_model(**inputs)
-    probs = out.logits_per_image.softmax(dim=1)[0]
-    idxs = probs.argsort(descending=True)[:top_k]
-    return [{"label": labels[i], "confidence": round(probs[i].item(), 4)} for i in idxs]
-
-
-def _embedding(img: Image.Image) -> list[float]:
-    inputs = fashionclip_processor(images=img, return_tensors="pt")
-    inputs = {k: v.to(DEVICE) for k, v in inputs.items()}
-    with torch.no_grad():
-        output = fashionclip_model.get_image_features(**inputs)
-    # Handle both old (raw tensor) and new (structured output) transformers versions
-    if hasattr(output, "image_embeds"):
-        feat = output.image_embeds
-    elif isinstance(output, torch.Tensor):
-        feat = output
-    else:
-        vision_out = fashionclip_model.vision_model(**inputs)
-        feat = fashionclip_model.visual_projection(vision_out.pooler_output)
-    feat = feat / feat.norm(p=2, dim=-1, keepdim=True)
-    return feat[0].cpu().tolist()
+# ──────────────────────────────────────────────────────────────────────────────
+# Response Encoding (embeddings + crops)
+# ──────────────────────────────────────────────────────────────────────────────
+# By default an item carries its embedding as a JSON float list and its crop
+# as a lossless PNG, which together dominate response size and encode time.
+# Clients can ask for a base64 binary embedding (float32, float16 or int8 with
+# a per-vector scale, little-endian) and a WebP / JPEG-on-white crop at a
+# given quality, downscaled to crop_max_side, or no crop at all. The encoding
+# is part of the result-cache key. Responses are serialized with orjson,
+# which writes the numpy embedding directly.
+
+
+class ItemEncoding(BaseModel):
+    embedding_encoding: Literal["list", "f32", "f16", "int8"] = "list"
+    crop_format: Literal["png", "webp", "jpeg", "none"] = "png"
+    crop_quality: int = Field(85, ge=1, le=100)  # webp / jpeg only
+    crop_max_side: int = Field(0, ge=0)  # 0 = crop at pipeline resolution
+
+    def cache_key(self) -> str:
+        """Suffix for the result-cache key; empty for the default encoding."""
+        parts = []
+        if self.embedding_encoding != "list":
+            parts.append(f"emb={self.embedding_encoding}")
+        if self.crop_format != "png":
+            parts.append(f"crop={self.crop_format}")
+            if self.crop_format != "none":
+                parts.append(f"q={self.crop_quality}")
+        if self.crop_max_side and self.crop_format != "none":
+            parts.append(f"max={self.crop_max_side}")
+        return ",".join(parts)
+
+    def encoding_only(self) -> "ItemEncoding":
+        """Drop the fields request models add (image data) when keeping just the encoding."""
+        return ItemEncoding.model_validate(self.model_dump(include=set(ItemEncoding.model_fields)))
+
+
+DEFAULT_ITEM_ENCODING = ItemEncoding()
+
+
+def dump_json(obj: Any) -> bytes:
+    return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def encode_embedding(vec: np.ndarray, encoding: str) -> dict:
+    """ItemOut embedding fields; int8 values decode as ``int8 * embedding_scale``."""
+    if encoding == "list":
+        return {"embedding": vec}
+    if encoding == "int8":
+        scale = float(np.abs(vec).max()) / 127 or 1.0
+        quantized = np.clip(np.rint(vec / scale), -127, 127).astype(np.int8)
+        return {
+            "embedding": base64.b64encode(quantized.tobytes()).decode(),
+            "embedding_scale": scale,
+        }
+    dtype = "<f2" if encoding == "f16" else "<f4"
+    return {"embedding": base64.b64encode(vec.astype(dtype).tobytes()).decode()}
+
+
+def decode_embedding(
+    value: Union[list[float], str], encoding: str, scale: Optional[float] = None
+) -> np.ndarray:
+    """Inverse of encode_embedding: a float32 vector."""
+    if encoding == "list":
+        return np.asarray(value, dtype=np.float32)
+    if not isinstance(value, str):
+        raise ValueError(f"{encoding} embeddings are base64 strings")
+    raw = base64.b64decode(value)
+    if encoding == "int8":
+        if scale is None:
+            raise ValueError("int8 embeddings need embedding_scale")
+        return np.frombuffer(raw, dtype=np.int8).astype(np.float32) * scale
+    return np.frombuffer(raw, dtype="<f2" if encoding == "f16" else "<f4").astype(np.float32)
+
+
+def encode_crop(img: Image.Image, encoding: ItemEncoding) -> Optional[str]:
+    if encoding.crop_format == "none":
+        return None
+    if encoding.crop_max_side and max(img.size) > encoding.crop_max_side:
+        img = img.resize(
+            _fit_size(img.size, encoding.crop_max_side), Image.LANCZOS, reducing_gap=2.0
+        )
+    if encoding.crop_format == "webp":
+        return encode_image_base64(img, "WEBP", quality=encoding.crop_quality)
+    if encoding.crop_format == "jpeg":
+        return encode_image_base64(rgba_to_white_bg(img), "JPEG", quality=encoding.crop_quality)
+    return encode_image_base64(img)
 
 
 # ──────────────────────────────────────────────────────────────────────────────
@@ -431,53 +1359,94 @@ def _embedding(img: Image.Image) -> list[float]:
 # ──────────────────────────────────────────────────────────────────────────────
 
 
-def process_outfit(image: Image.Image) -> dict:
-    """Full outfit photo → rembg → SegFormer → FashionCLIP per item."""
-    logger.info("Processing outfit photo...")
+# Pipeline functions take the working image plus, optionally, the
+# full-resolution original to cut crops from (see prepare_input).
 
-    clean = remove_background(image)
-    segments = segment_clothing(clean)
 
-    if not segments:
-        logger.warning("No clothing items detected!")
-        return {"items_found": 0, "items": []}
+def process_outfit(
+    image: Image.Image,
+    original: Optional[Image.Image] = None,
+    encoding: ItemEncoding = DEFAULT_ITEM_ENCODING,
+) -> dict:
+    """Full outfit photo → rembg → SegFormer → FashionCLIP (one batch for all items)."""
+    return process_outfits([image], [original], encoding)[0]
 
-    items = []
-    for seg in segments:
-        logger.info(f"  [Step 3] Classifying '{seg['label']}'...")
-        cls = classify_item(seg["cropped"])
 
-        items.append(
-            {
-                "segment_label": seg["label"],
-                "segment_confidence": round(seg["confidence"], 4),
-                "category": cls["category"],
-                "top_categories": cls["top_categories"],
-                "style": cls["style"],
-                "color": cls["color"],
-                "pattern": cls["pattern"],
-                "material": cls["material"],
-                "season": cls["season"],
-                "tags": cls["tags"],
-                "embedding": cls["embedding"],
-                "cropped_image_base64": encode_image_base64(seg["cropped"]),
-            }
-        )
+def process_outfits(
+    images: list[Image.Image],
+    originals: Optional[list[Optional[Image.Image]]] = None,
+    encoding: ItemEncoding = DEFAULT_ITEM_ENCODING,
+) -> list[dict]:
+    """Outfit photos → rembg → SegFormer per photo, then one batched
+    FashionCLIP pass over the crops of every photo."""
+    logger.info(f"Processing {len(images)} outfit photo(s)...")
+
+    originals = originals or [None] * len(images)
+    all_segments = [
+        segment_outfit(image, original) for image, original in zip(images, originals)
+    ]
+
+    crops = [seg["cropped"] for segments in all_segments for seg in segments]
+    logger.info(f"  [Step 3] Classifying {len(crops)} items...")
+    classified = iter(classify_items(crops))
+
+    results = []
+    for segments in all_segments:
+        if not segments:
+            logger.warning("No clothing items detected!")
+        items = [
+            _item_out(seg["label"], seg["confidence"], next(classified), seg["cropped"], encoding)
+            for seg in segments
+        ]
+        results.append({"items_found": len(items), "items": items})
+
+    logger.info(f"Done! {len(crops)} items classified.")
+    return results
+
+
+def segment_outfit(
+    image: Image.Image, original: Optional[Image.Image] = None
+) -> list[dict]:
+    """Outfit photo → rembg → SegFormer (everything before FashionCLIP)."""
+    clean = remove_background(image)
+    source = project_alpha(original, clean) if original is not None else None
+    return segment_clothing(clean, source=source)
 
-    logger.info(f"Done! {len(items)} items classified.")
-    return {"items_found": len(items), "items": items}
 
+def classify_segment(seg: dict, encoding: ItemEncoding = DEFAULT_ITEM_ENCODING) -> dict:
+    """One segment → FashionCLIP → ItemOut dict (used by the streaming path)."""
+    cls = classify_item(seg["cropped"])
+    return _item_out(seg["label"], seg["confidence"], cls, seg["cropped"], encoding)
 
-def process_single(image: Image.Image) -> dict:
+
+def process_single(
+    image: Image.Image,
+    original: Optional[Image.Image] = None,
+    encoding: ItemEncoding = DEFAULT_ITEM_ENCODING,
+) -> dict:
     """Single item photo → rembg → FashionCLIP (skip SegFormer)."""
     logger.info("Processing single item...")
 
-    clean = remove_background(image)
+    clean = remove_background(image, models.get("rembg")["single"])
     cls = classify_item(clean)
 
+    cropped = project_alpha(original, clean) if original is not None else clean
+    item = _item_out("single_item", 1.0, cls, cropped, encoding)
+
+    logger.info(f"Done! Classified as: {cls['category']['label']}")
+    return {"items_found": 1, "items": [item]}
+
+
+def _item_out(
+    segment_label: str,
+    segment_confidence: float,
+    cls: dict,
+    cropped: Image.Image,
+    encoding: ItemEncoding = DEFAULT_ITEM_ENCODING,
+) -> dict:
     item = {
-        "segment_label": "single_item",
-        "segment_confidence": 1.0,
+        "segment_label": segment_label,
+        "segment_confidence": round(segment_confidence, 4),
         "category": cls["category"],
         "top_categories": cls["top_categories"],
         "style": cls["style"],
@@ -486,208 +1455,3410 @@ def process_single(image: Image.Image) -> dict:
         "material": cls["material"],
         "season": cls["season"],
         "tags": cls["tags"],
-        "embedding": cls["embedding"],
-        "cropped_image_base64": encode_image_base64(clean),
+        **encode_embedding(cls["embedding"], encoding.embedding_encoding),
     }
-
-    logger.info(f"Done! Classified as: {cls['category']['label']}")
-    return {"items_found": 1, "items": [item]}
+    crop = encode_crop(cropped, encoding)
+    if crop is not None:
+        item["cropped_image_base64"] = crop
+    return item
 
 
 # ──────────────────────────────────────────────────────────────────────────────
-# FastAPI
+# Model Registrations
 # ──────────────────────────────────────────────────────────────────────────────
+# "segformer" / "fashionclip" resolve to their image processors (the weights
+# live in inference_backend), "label_banks" to the LabelBankClassifier and
+# "rembg" to the outfit / single-item BackgroundRemover pools.
 
 
-class OutfitRequest(BaseModel):
-    image_base64: str
+def _load_segformer() -> SegformerImageProcessor:
+    processor = SegformerImageProcessor.from_pretrained(SEGFORMER_MODEL_ID)
+    inference_backend.load("segformer")
+    return processor
 
 
-class AttrResult(BaseModel):
-    label: str
-    confidence: float
+def _load_fashionclip() -> CLIPProcessor:
+    processor = CLIPProcessor.from_pretrained(FASHIONCLIP_MODEL_ID)
+    inference_backend.load("clip")
+    return processor
 
 
-class ItemOut(BaseModel):
-    segment_label: str
-    segment_confidence: float
-    category: AttrResult
-    top_categories: list[AttrResult]
-    style: AttrResult
-    color: AttrResult
-    pattern: AttrResult
-    material: AttrResult
-    season: AttrResult
-    tags: list[str]
-    embedding: list[float]
-    cropped_image_base64: str
+def _load_label_banks() -> LabelBankClassifier:
+    classifier = LabelBankClassifier(LABEL_BANKS)
+    logger.info(
+        f"Label banks ready: {classifier.text_matrix.shape[0]} prompts "
+        f"across {len(LABEL_BANKS)} banks."
+    )
+    return classifier
 
 
-class OutfitResponse(BaseModel):
-    items_found: int
-    items: list[ItemOut]
+def _load_rembg() -> dict[str, BackgroundRemover]:
+    providers = _rembg_providers()
+    logger.info(f"Loading rembg ({REMBG_MODEL}, {REMBG_SESSIONS} sessions, {providers})...")
+    removers = {
+        "outfit": BackgroundRemover(
+            REMBG_MODEL, REMBG_SESSIONS, providers, REMBG_INTRA_THREADS, REMBG_INTER_THREADS
+        )
+    }
+    if REMBG_SINGLE_MODEL == REMBG_MODEL:
+        removers["single"] = removers["outfit"]
+    else:
+        removers["single"] = BackgroundRemover(
+            REMBG_SINGLE_MODEL,
+            REMBG_SESSIONS,
+            providers,
+            REMBG_INTRA_THREADS,
+            REMBG_INTER_THREADS,
+        )
+    return removers
 
 
-# ──────────────────────────────────────────────────────────────────────────────
-# Step 4 — Outfit Recommendations (Nemotron-Nano-9B-v2)
-# ──────────────────────────────────────────────────────────────────────────────
+class StubProcessor:
+    """Image / text preprocessing for StubBackend, called like a HF processor."""
 
-RECOMMENDATION_SYSTEM_PROMPT = """You are an expert fashion stylist. Given a user's wardrobe items as JSON, suggest 3 outfit combinations.
+    def __init__(self, side: int):
+        self.side = side
 
-Rules:
-- Each outfit needs a top + bottom (or dress) + shoes if available
-- Good color coordination and style cohesion
-- Return ONLY valid JSON, nothing else
+    def __call__(self, images=None, text=None, return_tensors="pt", **_) -> dict:
+        if text is not None:
+            ids = [
+                [zlib.crc32(tok.encode()) % StubBackend.VOCAB for tok in t.lower().split()] or [0]
+                for t in text
+            ]
+            width = max(len(row) for row in ids)
+            return {
+                "input_ids": torch.tensor([row + [0] * (width - len(row)) for row in ids]),
+                "attention_mask": torch.tensor(
+                    [[1] * len(row) + [0] * (width - len(row)) for row in ids]
+                ),
+            }
+        arrays = [
+            np.asarray(img.convert("RGB").resize((self.side, self.side), Image.BILINEAR))
+            for img in images
+        ]
+        pixels = torch.from_numpy(np.stack(arrays)).permute(0, 3, 1, 2).float() / 255
+        return {"pixel_values": pixels}
 
-Output format:
-{"recommendations": [{"outfit_items": ["id1", "id2", "id3"], "occasion": "casual day out", "description": "Why these work", "style_tags": ["minimalist"]}]}"""
 
+class StubRemover:
+    """BackgroundRemover stand-in: keys out pixels close to the corner colour."""
 
-def generate_recommendations(
-    wardrobe: list[dict],
-    occasion: Optional[str] = None,
-    season: Optional[str] = None,
-) -> dict:
-    """Call Nemotron via vLLM's OpenAI-compatible API for outfit recommendations."""
-    if not LLM_AVAILABLE:
-        raise RuntimeError("LLM disabled. Set SKIP_LLM=0 and start vLLM.")
+    model_name = "stub"
 
-    import requests as req_lib
+    def remove(self, image: Image.Image) -> Image.Image:
+        rgb = np.asarray(image.convert("RGB")).astype(np.int16)
+        corners = np.stack([rgb[0, 0], rgb[0, -1], rgb[-1, 0], rgb[-1, -1]])
+        background = np.median(corners, axis=0)
+        alpha = (np.abs(rgb - background).sum(axis=-1) > 30).astype(np.uint8) * 255
+        return Image.fromarray(np.dstack([rgb.astype(np.uint8), alpha]), "RGBA")
 
-    # Build the user message with the full wardrobe
-    wardrobe_text = json.dumps(wardrobe)
-    user_msg = f"My wardrobe: {wardrobe_text}"
-    if occasion:
-        user_msg += f"\nOccasion: {occasion}"
-    if season:
-        user_msg += f"\nSeason: {season}"
+    def warmup(self) -> None:
+        pass
 
-    logger.info(f"  [Nemotron] Generating recommendations for {len(wardrobe)} items via vLLM...")
 
-    # Call vLLM's OpenAI-compatible chat endpoint
-    response = req_lib.post(
-        f"{VLLM_URL}/v1/chat/completions",
-        json={
-            "model": "nvidia/NVIDIA-Nemotron-Nano-9B-v2",
-            "messages": [
-                {"role": "system", "content": "/no_think\n" + RECOMMENDATION_SYSTEM_PROMPT},
-                {"role": "user", "content": user_msg},
-            ],
-            "max_tokens": 1024,
-            "temperature": 0,
-        },
-        timeout=120,
-    )
+def _load_stub_rembg() -> dict[str, StubRemover]:
+    remover = StubRemover()
+    return {"outfit": remover, "single": remover}
 
-    if response.status_code != 200:
-        error_text = response.text
-        logger.error(f"  [Nemotron] vLLM error ({response.status_code}): {error_text}")
-        raise RuntimeError(f"vLLM error: {error_text}")
 
-    data = response.json()
-    response_text = data["choices"][0]["message"]["content"].strip()
+def _load_stub_segformer() -> StubProcessor:
+    inference_backend.load("segformer")
+    return StubProcessor(128)  # SegFormer's logits are 1/4 of its 512 input
+
+
+def _load_stub_fashionclip() -> StubProcessor:
+    inference_backend.load("clip")
+    return StubProcessor(224)
+
+
+def _warmup_image(size: tuple[int, int]) -> Image.Image:
+    img = Image.new("RGB", size, (235, 235, 235))
+    img.paste((40, 60, 120), (size[0] // 4, size[1] // 4, 3 * size[0] // 4, 3 * size[1] // 4))
+    return img
+
+
+def _warmup_rembg(removers: dict[str, BackgroundRemover]) -> None:
+    for remover in {id(r): r for r in removers.values()}.values():
+        remover.warmup()
+
+
+def _warmup_segformer(_) -> None:
+    _segformer_forward([_warmup_image((512, 512))])
+
+
+def _warmup_label_banks(classifier: LabelBankClassifier) -> None:
+    feats = torch.stack(_fashionclip_forward([_warmup_image((224, 224))]))
+    classifier.attributes(feats)
 
-    logger.info(f"  [Nemotron] Raw response: {response_text[:300]}...")
 
-    # Parse JSON from the response
+def _load_llm_tokenizer():
+    """Nemotron's tokenizer, for prompt token budgets; None falls back to an estimate."""
     try:
-        json_start = response_text.find("{")
-        json_end = response_text.rfind("}") + 1
-        if json_start >= 0 and json_end > json_start:
-            result = json.loads(response_text[json_start:json_end])
-        else:
-            result = {"recommendations": [], "raw_response": response_text}
-    except json.JSONDecodeError:
-        logger.warning("  [Nemotron] Failed to parse JSON, returning raw response.")
-        result = {"recommendations": [], "raw_response": response_text}
+        return AutoTokenizer.from_pretrained(LLM_MODEL, trust_remote_code=True)
+    except Exception as e:
+        logger.warning(f"  [models] LLM tokenizer unavailable ({e}); estimating prompt tokens")
+        return None
 
-    logger.info(f"  [Nemotron] Generated {len(result.get('recommendations', []))} recommendations.")
-    return result
+
+if INFERENCE_BACKEND == "stub":
+    models.register("rembg", _load_stub_rembg, _warmup_rembg)
+    models.register("segformer", _load_stub_segformer, _warmup_segformer)
+    models.register("fashionclip", _load_stub_fashionclip)
+else:
+    models.register("rembg", _load_rembg, _warmup_rembg)
+    models.register("segformer", _load_segformer, _warmup_segformer)
+    models.register("fashionclip", _load_fashionclip)
+if LLM_AVAILABLE:
+    models.register("llm_tokenizer", _load_llm_tokenizer)
+models.register(
+    "label_banks", _load_label_banks, _warmup_label_banks, depends_on=("fashionclip",)
+)
 
 
 # ──────────────────────────────────────────────────────────────────────────────
-# FastAPI
+# Result Cache (content-addressed, memory LRU + disk)
 # ──────────────────────────────────────────────────────────────────────────────
 
-app = FastAPI(
-    title="Vlyzo Vision + LLM Pipeline",
-    description="rembg → SegFormer → FashionCLIP + Nemotron-Nano-9B",
-    version="3.0.0",
-)
-app.add_middleware(
-    CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]
-)
 
+class LRUCache:
+    """Thread-safe, size-bounded LRU mapping."""
 
-@app.get("/health")
-async def health():
-    models = [
-        "rembg/u2net",
-        "mattmdjaga/segformer_b2_clothes",
-        "patrickjohncyh/fashion-clip",
-    ]
-    if LLM_AVAILABLE:
-        models.append("nvidia/NVIDIA-Nemotron-Nano-9B-v2 (via vLLM)")
-    return {
-        "status": "ok",
-        "device": DEVICE,
-        "gpu": torch.cuda.get_device_name(0) if DEVICE == "cuda" else None,
-        "llm_available": LLM_AVAILABLE,
-        "vllm_url": VLLM_URL if LLM_AVAILABLE else None,
-        "models": models,
-    }
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
 
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
 
-@app.post("/process-outfit", response_model=OutfitResponse)
-async def api_outfit(req: OutfitRequest):
-    try:
-        img = decode_base64_image(req.image_base64)
-        return process_outfit(img)
-    except Exception as e:
-        logger.error(f"Error: {e}", exc_info=True)
-        raise HTTPException(500, detail=str(e))
+    def put(self, key: str, value: Any) -> None:
+        if self.max_items <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
 
+    def pop(self, key: str) -> Optional[Any]:
+        with self._lock:
+            return self._data.pop(key, None)
 
-@app.post("/process-single", response_model=OutfitResponse)
-async def api_single(req: OutfitRequest):
-    try:
-        img = decode_base64_image(req.image_base64)
-        return process_single(img)
-    except Exception as e:
-        logger.error(f"Error: {e}", exc_info=True)
-        raise HTTPException(500, detail=str(e))
+    def items(self) -> list[tuple[str, Any]]:
+        with self._lock:
+            return list(self._data.items())
 
+    def __len__(self) -> int:
+        return len(self._data)
 
-class WardrobeItem(BaseModel):
-    id: str
-    category: str
-    color: str
-    style: str = ""
-    material: str = ""
-    season: str = ""
 
+class ResultCache:
+    """Serialized endpoint responses keyed by image content + pipeline version.
 
-class RecommendRequest(BaseModel):
-    wardrobe: list[WardrobeItem]
-    occasion: Optional[str] = None
-    season: Optional[str] = None
+    The key is a SHA-256 of the uploaded image bytes, the endpoint and a
+    fingerprint of everything that shapes the output (pipeline version,
+    model ids, label banks). A bounded LRU sits in front of a directory of
+    JSON files that survives restarts; the disk tier is pruned oldest-first
+    once it grows past ``disk_max_mb``.
+    """
 
+    PRUNE_EVERY = 100  # disk writes between size checks
+
+    def __init__(self, max_items: int, directory: str, disk_max_mb: int):
+        self.memory = LRUCache(max_items)
+        self.directory = directory
+        self.disk_max_bytes = disk_max_mb * 1024 * 1024
+        self.fingerprint = hashlib.sha256(
+            json.dumps(
+                [
+                    PIPELINE_VERSION,
+                    SEGFORMER_MODEL_ID,
+                    FASHIONCLIP_MODEL_ID,
+                    REMBG_MODEL,
+                    REMBG_SINGLE_MODEL,
+                    WORK_MAX_SIDE,
+                    INFERENCE_BACKEND,
+                    PROMPT_TEMPLATE,
+                    LABEL_BANKS,
+                ]
+            ).encode()
+        ).hexdigest()[:16]
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def open(self) -> None:
+        """Create the disk tier's directory (at server startup, not import)."""
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def key(
+        self,
+        kind: str,
+        digest: str,
+        full_resolution: bool = False,
+        encoding: ItemEncoding = DEFAULT_ITEM_ENCODING,
+    ) -> str:
+        """``digest`` is the hex SHA-256 of the uploaded image bytes."""
+        if full_resolution:
+            kind += "+full"
+        if encoding.cache_key():
+            kind += f"+{encoding.cache_key()}"
+        return hashlib.sha256(f"{kind}:{self.fingerprint}:{digest}".encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[bytes]:
+        body = self.memory.get(key)
+        if body is not None:
+            with self._lock:
+                self.memory_hits += 1
+            return body
+
+        if self.directory:
+            try:
+                with open(self._path(key), "rb") as f:
+                    body = f.read()
+            except FileNotFoundError:
+                body = None
+            if body is not None:
+                self.memory.put(key, body)
+                with self._lock:
+                    self.disk_hits += 1
+                return body
+
+        with self._lock:
+            self.misses += 1
+        return None
 
-@app.post("/recommend-outfits")
-async def api_recommend(req: RecommendRequest):
-    try:
-        wardrobe_dicts = [item.model_dump() for item in req.wardrobe]
-        result = generate_recommendations(
-            wardrobe=wardrobe_dicts,
-            occasion=req.occasion,
-            season=req.season,
-        )
-        return result
-    except RuntimeError as e:
-        raise HTTPException(503, detail=str(e))
-    except Exception as e:
-        logger.error(f"Error: {e}", exc_info=True)
-        raise HTTPException(500, detail=str(e))
+    def put(self, key: str, body: bytes) -> None:
+        self.memory.put(key, body)
+        if not self.directory:
+            return
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(body)
+        os.replace(tmp, path)  # atomic, so readers never see a partial file
+
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % self.PRUNE_EVERY == 0
+        if prune:
+            self._prune_disk()
+
+    def _prune_disk(self) -> None:
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue  # skip in-flight .tmp writes
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "hits": hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_items": len(self.memory),
+            "disk_enabled": bool(self.directory),
+            "pipeline_fingerprint": self.fingerprint,
+        }
+
+
+result_cache = ResultCache(CACHE_MAX_ITEMS, CACHE_DIR, CACHE_DISK_MAX_MB)
+
+VISION_PIPELINES = {
+    "outfit": process_outfit,
+    "single": process_single,
+}
+
+
+def run_vision_cached(
+    kind: str,
+    source: Union[bytes, BinaryIO],
+    digest: Optional[str] = None,
+    full_resolution: bool = False,
+    encoding: ItemEncoding = DEFAULT_ITEM_ENCODING,
+) -> tuple[bytes, bool]:
+    """Serve a serialized OutfitResponse from cache, or run the pipeline.
+
+    ``source`` is the raw image (bytes or file object); pass ``digest`` when
+    its SHA-256 was already computed while reading it.
+    Returns ``(json_body, cache_hit)``.
+    """
+    if digest is None:
+        digest = hashlib.sha256(source).hexdigest()
+    key = result_cache.key(kind, digest, full_resolution, encoding)
+    body = result_cache.get(key)
+    if body is not None:
+        return body, True
+
+    working, original = prepare_input(source, full_resolution)
+    result = VISION_PIPELINES[kind](working, original, encoding)
+    body = dump_json(result)
+    result_cache.put(key, body)
+    return body, False
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Staged Batch Pipeline (for POST /process-batch)
+# ──────────────────────────────────────────────────────────────────────────────
+# Bulk imports run through long-lived stages — decode → rembg → segment →
+# classify — each with its own worker threads, connected by bounded queues.
+# While one image is in rembg the next is decoding and the previous one is in
+# SegFormer or FashionCLIP, so every resource stays busy. The model stages get
+# several workers each, so their calls meet in the micro-batchers and run as
+# real batches. A task that fails or hits the result cache skips the rest of
+# the stages and goes straight to its ``done`` callback.
+
+
+class BatchTask:
+    """One image moving through batch_pipeline; stages fill in its fields."""
+
+    __slots__ = (
+        "index",
+        "filename",
+        "kind",
+        "data",
+        "full_resolution",
+        "encoding",
+        "done",
+        "key",
+        "working",
+        "original",
+        "clean",
+        "segments",
+        "body",
+        "cached",
+        "error",
+    )
+
+    def __init__(
+        self,
+        index: int,
+        filename: Optional[str],
+        kind: str,
+        data: bytes,
+        full_resolution: bool,
+        encoding: ItemEncoding,
+        done: Callable[["BatchTask"], None],
+    ):
+        self.index = index
+        self.filename = filename
+        self.kind = kind
+        self.data = data
+        self.full_resolution = full_resolution
+        self.encoding = encoding
+        self.done = done
+        self.key = None
+        self.working = self.original = self.clean = None
+        self.segments: list[dict] = []
+        self.body: Optional[bytes] = None
+        self.cached = False
+        self.error: Optional[str] = None
+
+
+class StagedPipeline:
+    def __init__(self, stages: list[tuple[str, Callable[[BatchTask], None], int]]):
+        self.stages = stages
+        # Raw uploads are already in memory; decoded images between stages are
+        # not, so only the later queues are bounded (backpressure on decode).
+        self._queues = [queue.Queue()] + [
+            queue.Queue(maxsize=BATCH_QUEUE_DEPTH) for _ in stages[1:]
+        ]
+        for i, (name, fn, workers) in enumerate(stages):
+            for w in range(max(1, workers)):
+                threading.Thread(
+                    target=self._run, args=(i, fn), name=f"batch-{name}-{w}", daemon=True
+                ).start()
+
+    def submit(self, task: BatchTask) -> None:
+        self._queues[0].put(task)
+
+    def _run(self, i: int, fn: Callable[[BatchTask], None]) -> None:
+        last = i == len(self.stages) - 1
+        while True:
+            task = self._queues[i].get()
+            if task.body is None and task.error is None:
+                try:
+                    fn(task)
+                except Exception as e:
+                    logger.error(f"  [batch] image {task.index} failed: {e}", exc_info=True)
+                    task.error = str(e)
+            if last or task.body is not None or task.error is not None:
+                task.working = task.original = task.clean = task.data = None
+                task.segments = []
+                try:
+                    task.done(task)
+                except Exception as e:
+                    # A failing callback must not take the stage thread down with it
+                    logger.error(
+                        f"  [batch] image {task.index} callback failed: {e}", exc_info=True
+                    )
+            else:
+                self._queues[i + 1].put(task)
+
+
+def _batch_decode(task: BatchTask) -> None:
+    digest = hashlib.sha256(task.data).hexdigest()
+    task.key = result_cache.key(task.kind, digest, task.full_resolution, task.encoding)
+    task.body = result_cache.get(task.key)
+    if task.body is not None:
+        task.cached = True
+        return
+    task.working, task.original = prepare_input(task.data, task.full_resolution)
+
+
+def _batch_rembg(task: BatchTask) -> None:
+    remover = models.get("rembg")["outfit" if task.kind == "outfit" else "single"]
+    task.clean = remove_background(task.working, remover)
+
+
+def _batch_segment(task: BatchTask) -> None:
+    source = project_alpha(task.original, task.clean) if task.original is not None else None
+    if task.kind == "outfit":
+        task.segments = segment_clothing(task.clean, source=source)
+    else:
+        # Single items skip SegFormer; classify the working-res cutout
+        cropped = source if source is not None else task.clean
+        task.segments = [
+            {"label": "single_item", "confidence": 1.0, "cropped": cropped, "classify": task.clean}
+        ]
+
+
+def _batch_classify(task: BatchTask) -> None:
+    classified = classify_items([seg.get("classify", seg["cropped"]) for seg in task.segments])
+    items = [
+        _item_out(seg["label"], seg["confidence"], cls, seg["cropped"], task.encoding)
+        for seg, cls in zip(task.segments, classified)
+    ]
+    task.body = dump_json({"items_found": len(items), "items": items})
+    result_cache.put(task.key, task.body)
+
+
+batch_pipeline = StagedPipeline(
+    [
+        ("decode", _batch_decode, 2),
+        ("rembg", _batch_rembg, REMBG_SESSIONS),
+        ("segment", _batch_segment, BATCH_STAGE_WORKERS),
+        ("classify", _batch_classify, BATCH_STAGE_WORKERS),
+    ]
+)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Embedding Index (similar items + duplicate detection)
+# ──────────────────────────────────────────────────────────────────────────────
+# One index per namespace (e.g. a user's wardrobe, or the global catalogue).
+# Vectors live densely in a memory-mapped float32 file, so search over a
+# namespace is a single BLAS matrix-vector product and restarts just re-map the
+# file. Removal moves the last row into the freed slot to keep rows dense.
+# Row ids are an append-only log ("+ id" / "- id" records, replayed on open),
+# so a write costs O(batch) on disk; meta.json is a small header holding the
+# committed log length, and the log is compacted once it is mostly churn.
+# Large namespaces switch to an IVF layout: spherical k-means centroids split
+# the rows into ~sqrt(n) lists and a query only scores the rows of its
+# INDEX_IVF_PROBE closest lists. Centroids are retrained whenever the index
+# has doubled since the last training.
+# Writers are serialised by _write_lock and hold it through training and disk
+# writes; _lock only guards the in-memory swaps, so searches never wait on them.
+
+INDEX_NAMESPACE_RE = re.compile(r"^[A-Za-z0-9_.:-]{1,128}$")
+
+
+def _drop_id(ids: list[str], slots: dict[str, int], item_id: str) -> Optional[tuple[int, int]]:
+    """Remove ``item_id`` by moving the last id into its slot; returns (slot, last)."""
+    slot = slots.pop(item_id, None)
+    if slot is None:
+        return None
+    last = len(ids) - 1
+    if slot != last:
+        moved = ids[last]
+        ids[slot] = moved
+        slots[moved] = slot
+    ids.pop()
+    return slot, last
+
+
+class EmbeddingIndex:
+    INITIAL_CAPACITY = 1024
+    KMEANS_ITERS = 10
+    KMEANS_SAMPLE_PER_LIST = 64
+    LOG_COMPACT_RATIO = 2  # rewrite the id log once it holds 2× more records than ids
+
+    def __init__(self, directory: str, mode: str = INDEX_MODE):
+        self.directory = directory
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        meta_path = self._path("meta.json")
+        meta = {}
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+        self.dim: Optional[int] = meta.get("dim")
+        self.trained_size = meta.get("trained_size", 0)
+        self._log_name = meta.get("log", "ids.0.log")
+        self._log_bytes = meta.get("log_bytes", 0)
+        self._log_records = 0
+        self._stale_log: Optional[str] = None
+        self.ids: list[str] = []
+        self.slots: dict[str, int] = {}
+        if "ids" in meta:
+            # Older indexes kept every id in meta.json; move them into a log
+            self.ids = meta["ids"]
+            self.slots = {item_id: slot for slot, item_id in enumerate(self.ids)}
+            self._compact_log()
+            self._write_header()
+        else:
+            self._replay_log()
+
+        self._vectors: Optional[np.memmap] = None
+        self._assign: Optional[np.memmap] = None
+        self.centroids: Optional[np.ndarray] = None
+        self._lists: Optional[tuple[np.ndarray, np.ndarray]] = None
+        if self.dim is not None:
+            self._open(self._capacity_on_disk())
+            centroids_path = self._path("centroids.npy")
+            if self.trained_size and os.path.exists(centroids_path):
+                self.centroids = np.load(centroids_path)
+
+    # ── storage ──
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _capacity_on_disk(self) -> int:
+        return os.path.getsize(self._path("vectors.f32")) // (4 * self.dim)
+
+    def _open(self, capacity: int) -> None:
+        """(Re)map the vector and list-assignment files, growing them to ``capacity``."""
+        for name, itemsize in (("vectors.f32", 4 * self.dim), ("assign.i32", 4)):
+            path = self._path(name)
+            mode = "r+b" if os.path.exists(path) else "w+b"
+            with open(path, mode) as f:
+                f.truncate(capacity * itemsize)
+        self._vectors = np.memmap(
+            self._path("vectors.f32"), dtype=np.float32, mode="r+", shape=(capacity, self.dim)
+        )
+        self._assign = np.memmap(
+            self._path("assign.i32"), dtype=np.int32, mode="r+", shape=(capacity,)
+        )
+
+    def _reserve(self, size: int) -> None:
+        capacity = len(self._vectors) if self._vectors is not None else 0
+        if size <= capacity:
+            return
+        new_capacity = max(self.INITIAL_CAPACITY, capacity * 2, size)
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._assign.flush()
+        self._vectors = self._assign = None
+        self._open(new_capacity)
+
+    def _replay_log(self) -> None:
+        path = self._path(self._log_name)
+        if not os.path.exists(path):
+            return
+        with open(path, "r+b") as f:
+            # Records past the committed length were written after the last header
+            f.truncate(self._log_bytes)
+            data = f.read()
+        for line in data.splitlines():
+            op, item_id = orjson.loads(line)
+            if op == "+":
+                self.slots[item_id] = len(self.ids)
+                self.ids.append(item_id)
+            else:
+                _drop_id(self.ids, self.slots, item_id)
+            self._log_records += 1
+
+    def _compact_log(self) -> None:
+        """Rewrite the live ids into a fresh log generation (committed by the next header)."""
+        old = self._log_name
+        generation = int(old.split(".")[1]) + 1
+        self._log_name = f"ids.{generation}.log"
+        data = b"".join(orjson.dumps(["+", item_id]) + b"\n" for item_id in self.ids)
+        with open(self._path(self._log_name), "wb") as f:
+            f.write(data)
+        self._log_bytes = len(data)
+        self._log_records = len(self.ids)
+        self._stale_log = old
+
+    def _write_header(self) -> None:
+        meta_path = self._path("meta.json")
+        tmp = f"{meta_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(
+                {
+                    "dim": self.dim,
+                    "size": len(self.ids),
+                    "trained_size": self.trained_size,
+                    "log": self._log_name,
+                    "log_bytes": self._log_bytes,
+                },
+                f,
+            )
+        os.replace(tmp, meta_path)
+        if self._stale_log:
+            if os.path.exists(self._path(self._stale_log)):
+                os.remove(self._path(self._stale_log))
+            self._stale_log = None
+
+    def _save(self, records: list[tuple[str, str]]) -> None:
+        """Flush the memmaps, append ``records`` to the id log and commit the header."""
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._assign.flush()
+        if self._log_records + len(records) > self.LOG_COMPACT_RATIO * max(
+            len(self.ids), self.INITIAL_CAPACITY
+        ):
+            self._compact_log()
+        elif records:
+            data = b"".join(orjson.dumps(record) + b"\n" for record in records)
+            with open(self._path(self._log_name), "ab") as f:
+                f.write(data)
+            self._log_bytes += len(data)
+            self._log_records += len(records)
+        self._write_header()
+
+    # ── mutation ──
+
+    def upsert(self, ids: list[str], vectors: np.ndarray) -> None:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        with self._write_lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Expected {self.dim}-d embeddings, got {vectors.shape[1]}-d")
+
+            records = []
+            with self._lock:
+                new = sum(1 for item_id in dict.fromkeys(ids) if item_id not in self.slots)
+                self._reserve(len(self.ids) + new)
+                for item_id, vec in zip(ids, vectors):
+                    slot = self.slots.get(item_id)
+                    if slot is None:
+                        slot = self.slots[item_id] = len(self.ids)
+                        self.ids.append(item_id)
+                        records.append(("+", item_id))
+                    self._vectors[slot] = vec
+                    self._assign[slot] = (
+                        int(np.argmax(self.centroids @ vec)) if self.centroids is not None else -1
+                    )
+                self._lists = None
+
+            if self._use_ivf() and (
+                self.centroids is None or len(self.ids) >= 2 * self.trained_size
+            ):
+                self._train()
+            self._save(records)
+
+    def remove(self, ids: list[str]) -> int:
+        records = []
+        with self._write_lock:
+            with self._lock:
+                for item_id in ids:
+                    moved = _drop_id(self.ids, self.slots, item_id)
+                    if moved is None:
+                        continue
+                    slot, last = moved
+                    if slot != last:
+                        self._vectors[slot] = self._vectors[last]
+                        self._assign[slot] = self._assign[last]
+                    records.append(("-", item_id))
+                if records:
+                    self._lists = None
+            if records:
+                self._save(records)
+        return len(records)
+
+    def train(self) -> None:
+        """Fit IVF centroids (spherical k-means) and reassign every row."""
+        with self._write_lock:
+            self._train()
+            self._save([])
+
+    def _train(self) -> None:
+        # Runs under _write_lock, so rows can't change underneath it; searches
+        # keep using the old centroids and assignments until the swap below.
+        n = len(self.ids)
+        n_lists = max(1, int(np.sqrt(n)))
+        rng = np.random.default_rng(0)
+        sample_size = min(n, n_lists * self.KMEANS_SAMPLE_PER_LIST)
+        sample = np.asarray(self._vectors[np.sort(rng.choice(n, sample_size, replace=False))])
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)]
+        for _ in range(self.KMEANS_ITERS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Empty lists keep their previous centroid
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+        centroids = centroids.astype(np.float32)
+
+        assign = np.empty(n, dtype=np.int32)
+        chunk = 65536
+        for start in range(0, n, chunk):
+            block = self._vectors[start : min(start + chunk, n)]
+            assign[start : start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+
+        with self._lock:
+            self._assign[:n] = assign
+            self.centroids = centroids
+            self.trained_size = n
+            self._lists = None
+        np.save(self._path("centroids.npy"), centroids)
+        logger.info(f"  [index] trained {n_lists} IVF lists over {n} vectors")
+
+    # ── search ──
+
+    def _use_ivf(self) -> bool:
+        if self.mode == "exact":
+            return False
+        return self.mode == "ivf" or len(self.ids) >= INDEX_IVF_MIN_ITEMS
+
+    def _inverted_lists(self) -> tuple[np.ndarray, np.ndarray]:
+        """Row ids sorted by list, and each list's [start, end) bounds."""
+        if self._lists is None:
+            assign = np.asarray(self._assign[: len(self.ids)])
+            order = np.argsort(assign, kind="stable")
+            bounds = np.searchsorted(assign[order], np.arange(len(self.centroids) + 1))
+            self._lists = (order, bounds)
+        return self._lists
+
+    def search(
+        self,
+        query: np.ndarray,
+        k: int = 10,
+        exclude: tuple[str, ...] = (),
+        min_score: Optional[float] = None,
+    ) -> list[tuple[str, float]]:
+        query = np.asarray(query, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        with self._lock:
+            n = len(self.ids)
+            if n == 0:
+                return []
+            if query.shape[0] != self.dim:
+                raise ValueError(f"Expected a {self.dim}-d embedding, got {query.shape[0]}-d")
+
+            if self._use_ivf() and self.centroids is not None:
+                order, bounds = self._inverted_lists()
+                n_probe = min(INDEX_IVF_PROBE, len(self.centroids))
+                probes = np.argpartition(-(self.centroids @ query), n_probe - 1)[:n_probe]
+                # Sorted rows keep the memmap reads sequential
+                rows = np.sort(np.concatenate([order[bounds[p] : bounds[p + 1]] for p in probes]))
+                scores = self._vectors[rows] @ query
+            else:
+                rows = None
+                scores = self._vectors[:n] @ query
+
+            want = min(len(scores), k + len(exclude))
+            if want == 0:
+                return []
+            top = np.argpartition(-scores, want - 1)[:want]
+            top = top[np.argsort(-scores[top])]
+            results = []
+            for i in top:
+                row = int(rows[i]) if rows is not None else int(i)
+                score = float(scores[i])
+                if min_score is not None and score < min_score:
+                    break
+                if self.ids[row] in exclude:
+                    continue
+                results.append((self.ids[row], round(score, 6)))
+                if len(results) == k:
+                    break
+            return results
+
+    def vector(self, item_id: str) -> Optional[np.ndarray]:
+        with self._lock:
+            slot = self.slots.get(item_id)
+            return None if slot is None else np.array(self._vectors[slot])
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.ids),
+            "dim": self.dim,
+            "mode": "ivf" if self._use_ivf() and self.centroids is not None else "exact",
+            "ivf_lists": 0 if self.centroids is None else len(self.centroids),
+        }
+
+
+class IndexStore:
+    """Namespace → EmbeddingIndex, opened lazily from ``directory/<namespace>``."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._indexes: dict[str, EmbeddingIndex] = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, create: bool = True) -> Optional[EmbeddingIndex]:
+        if not INDEX_NAMESPACE_RE.match(namespace):
+            raise ValueError(f"Invalid namespace: {namespace!r}")
+        with self._lock:
+            index = self._indexes.get(namespace)
+            if index is None:
+                path = os.path.join(self.directory, namespace)
+                if not create and not os.path.exists(path):
+                    return None
+                index = self._indexes[namespace] = EmbeddingIndex(path)
+            return index
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {ns: index.stats() for ns, index in self._indexes.items()}
+
+
+index_store = IndexStore(INDEX_DIR)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Re-classification (stored embeddings → attributes, for POST /reclassify)
+# ──────────────────────────────────────────────────────────────────────────────
+# Attributes are a softmax over (image embedding · prompt embeddings), so a
+# taxonomy change only needs the stored embeddings: no rembg, SegFormer or
+# image tower. Label-bank overrides and extra banks are merged into
+# LABEL_BANKS and encoded once by the text tower; the resulting classifiers
+# are kept in a small LRU. Embeddings are scored RECLASSIFY_CHUNK rows per
+# matmul.
+
+custom_classifiers = LRUCache(16)
+
+
+def label_bank_classifier(
+    banks: Optional[dict[str, list[str]]] = None, template: Optional[str] = None
+) -> LabelBankClassifier:
+    """The startup classifier, or one for LABEL_BANKS merged with ``banks``."""
+    if not banks and template in (None, PROMPT_TEMPLATE):
+        return models.get("label_banks")
+    merged = {**LABEL_BANKS, **(banks or {})}
+    template = template or PROMPT_TEMPLATE
+    key = hashlib.sha256(json.dumps([merged, template]).encode()).hexdigest()
+    classifier = custom_classifiers.get(key)
+    if classifier is None:
+        models.get("fashionclip")  # text tower + tokenizer
+        classifier = LabelBankClassifier(merged, template)
+        custom_classifiers.put(key, classifier)
+        logger.info(
+            f"  [reclassify] encoded {classifier.text_matrix.shape[0]} prompts "
+            f"for {len(merged)} banks"
+        )
+    return classifier
+
+
+def reclassify_embeddings(
+    embeddings: np.ndarray,
+    banks: Optional[dict[str, list[str]]] = None,
+    template: Optional[str] = None,
+) -> list[dict]:
+    """(N, 512) FashionCLIP image embeddings → attribute fields + tags per row."""
+    classifier = label_bank_classifier(banks, template)
+    dim = classifier.text_matrix.shape[1]
+    if embeddings.ndim != 2 or embeddings.shape[1] != dim:
+        raise ValueError(f"Expected {dim}-d embeddings, got shape {embeddings.shape}")
+
+    with stage("reclassify"):
+        # Stored vectors are unit-norm, but f16 / int8 round trips drift slightly
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = (embeddings / np.maximum(norms, 1e-12)).astype(np.float32)
+        results: list[dict] = []
+        for start in range(0, len(embeddings), RECLASSIFY_CHUNK):
+            chunk = torch.from_numpy(embeddings[start : start + RECLASSIFY_CHUNK])
+            results.extend(_attribute_fields(attrs) for attrs in classifier.attributes(chunk))
+    return results
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Job Queue (SQLite-backed, for POST /jobs)
+# ──────────────────────────────────────────────────────────────────────────────
+# Uploads are persisted with their parameters and drained by a fixed pool of
+# worker threads, so a burst of uploads queues up instead of holding HTTP
+# connections open for the whole pipeline. Status values mirror the
+# processing_jobs table (pending / processing / completed / failed). Jobs that
+# were mid-flight when the server stopped go back to pending on startup.
+
+JOB_STATUSES = ("pending", "processing", "completed", "failed")
+
+
+class JobQueue:
+    CLEANUP_EVERY_S = 600
+
+    def __init__(self, path: str, workers: int, retention_hours: float):
+        self.path = path
+        self.workers = workers
+        self.retention_s = retention_hours * 3600
+        self._db: Optional[sqlite3.Connection] = None
+        self._reader: Optional[sqlite3.Connection] = None  # status reads, never behind a write
+        self._lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._stopping = False
+        self._threads: list[threading.Thread] = []
+        self._last_cleanup = 0.0
+
+    def open(self) -> None:
+        """Connect to the database and create the schema (at server startup)."""
+        if self._db is not None:
+            return
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                full_resolution INTEGER NOT NULL,
+                encoding TEXT,
+                status TEXT NOT NULL,
+                image BLOB,
+                digest TEXT NOT NULL,
+                result BLOB,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )
+            """
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at)")
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        if "encoding" not in columns:  # databases from before item encodings
+            self._db.execute("ALTER TABLE jobs ADD COLUMN encoding TEXT")
+        if self.path == ":memory:":
+            self._reader, self._read_lock = self._db, self._lock
+        else:
+            # WAL lets this read-only connection see committed rows while a
+            # worker holds _lock writing a result blob
+            self._reader = sqlite3.connect(
+                f"file:{self.path}?mode=ro", uri=True, check_same_thread=False
+            )
+
+    def _read(self, sql: str, params: tuple = ()) -> list[tuple]:
+        with self._read_lock:
+            return self._reader.execute(sql, params).fetchall()
+
+    def _execute(self, sql: str, params: tuple = ()) -> list[tuple]:
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def start(self) -> None:
+        with self._lock:
+            recovered = self._db.execute(
+                "UPDATE jobs SET status = 'pending', started_at = NULL "
+                "WHERE status = 'processing'"
+            ).rowcount
+        if recovered:
+            logger.info(f"  [jobs] re-queued {recovered} interrupted jobs")
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self) -> None:
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify_all()
+
+    def submit(
+        self,
+        kind: str,
+        image: bytes,
+        digest: str,
+        full_resolution: bool,
+        encoding: ItemEncoding = DEFAULT_ITEM_ENCODING,
+    ) -> str:
+        job_id = uuid.uuid4().hex
+        self._execute(
+            "INSERT INTO jobs (id, kind, full_resolution, encoding, status, image, digest, "
+            "created_at) VALUES (?, ?, ?, ?, 'pending', ?, ?, ?)",
+            (
+                job_id,
+                kind,
+                int(full_resolution),
+                encoding.model_dump_json(),
+                image,
+                digest,
+                time.time(),
+            ),
+        )
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        rows = self._read(
+            "SELECT kind, status, result, error, created_at, started_at, finished_at "
+            "FROM jobs WHERE id = ?",
+            (job_id,),
+        )
+        if not rows:
+            return None
+        kind, status, result, error, created_at, started_at, finished_at = rows[0]
+        job = {
+            "job_id": job_id,
+            "kind": kind,
+            "status": status,
+            "created_at": created_at,
+            "started_at": started_at,
+            "finished_at": finished_at,
+        }
+        if status == "pending":
+            job["queue_position"] = self._read(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'pending' AND created_at <= ?",
+                (created_at,),
+            )[0][0]
+        if result is not None:
+            job["result"] = orjson.loads(result)
+        if error is not None:
+            job["error"] = error
+        return job
+
+    def counts(self) -> dict:
+        counts = dict.fromkeys(JOB_STATUSES, 0)
+        counts.update(self._read("SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+        return counts
+
+    def _claim(self) -> Optional[tuple]:
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT id, kind, full_resolution, encoding, image, digest FROM jobs "
+                    "WHERE status = 'pending' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET status = 'processing', started_at = ? WHERE id = ?",
+                        (time.time(), row[0]),
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return row
+
+    def _worker(self) -> None:
+        while True:
+            with self._wakeup:
+                if self._stopping:
+                    return
+            job = self._claim()
+            if job is None:
+                self._cleanup()
+                with self._wakeup:
+                    if not self._stopping:
+                        self._wakeup.wait(timeout=1.0)
+                continue
+
+            job_id, kind, full_resolution, encoding, image, digest = job
+            try:
+                encoding = (
+                    ItemEncoding.model_validate_json(encoding) if encoding else DEFAULT_ITEM_ENCODING
+                )
+                body, _ = run_vision_cached(kind, image, digest, bool(full_resolution), encoding)
+                self._execute(
+                    "UPDATE jobs SET status = 'completed', result = ?, image = NULL, "
+                    "finished_at = ? WHERE id = ?",
+                    (body, time.time(), job_id),
+                )
+            except Exception as e:
+                logger.error(f"  [jobs] {job_id} failed: {e}", exc_info=True)
+                self._execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, image = NULL, "
+                    "finished_at = ? WHERE id = ?",
+                    (str(e), time.time(), job_id),
+                )
+
+    def _cleanup(self) -> None:
+        now = time.time()
+        with self._lock:
+            if now - self._last_cleanup < self.CLEANUP_EVERY_S:
+                return
+            self._last_cleanup = now
+        self._execute(
+            "DELETE FROM jobs WHERE status IN ('completed', 'failed') AND finished_at < ?",
+            (now - self.retention_s,),
+        )
+
+
+job_queue = JobQueue(JOBS_DB, JOB_WORKERS, JOB_RETENTION_HOURS)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# FastAPI
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+class OutfitRequest(ItemEncoding):
+    image_base64: str
+    full_resolution: Optional[bool] = None  # crops at source resolution (default: FULL_RES_CROPS)
+
+
+class AttrResult(BaseModel):
+    label: str
+    confidence: float
+
+
+class ItemOut(BaseModel):
+    segment_label: str
+    segment_confidence: float
+    category: AttrResult
+    top_categories: list[AttrResult]
+    style: AttrResult
+    color: AttrResult
+    pattern: AttrResult
+    material: AttrResult
+    season: AttrResult
+    tags: list[str]
+    embedding: Union[list[float], str]  # base64 unless embedding_encoding is "list"
+    embedding_scale: Optional[float] = None  # int8 only
+    cropped_image_base64: Optional[str] = None  # absent with crop_format "none"
+
+
+class OutfitResponse(BaseModel):
+    items_found: int
+    items: list[ItemOut]
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Step 4 — Outfit Recommendations (Nemotron-Nano-9B-v2)
+# ──────────────────────────────────────────────────────────────────────────────
+
+# Outfits are assembled locally: wardrobe items are slotted by their
+# FashionCLIP category (ai_category), the user-facing category (fine labels or
+# the app's coarse Top / Bottom / Shoes / Outerwear) or SegFormer segment
+# label, matched case-insensitively; top+bottom / one-piece bases are extended with
+# shoes and an optional outer layer in a small beam search, and each outfit is
+# scored on FashionCLIP embedding compatibility plus color, pattern, style,
+# season and occasion rules. Nemotron only ranks and describes the best
+# RECOMMEND_CANDIDATES; without vLLM the top candidates are returned directly.
+# Wardrobes that can't be slotted into any outfit go to Nemotron whole.
+
+# ── Outfit candidates (local) ──
+
+SLOT_BY_CATEGORY = {
+    **dict.fromkeys(
+        ["T-Shirt", "Shirt", "Blouse", "Tank Top", "Crop Top", "Sweater", "Hoodie"], "top"
+    ),
+    **dict.fromkeys(["Cardigan", "Jacket", "Coat", "Blazer", "Vest"], "outer"),
+    **dict.fromkeys(["Jeans", "Trousers", "Shorts", "Skirt", "Leggings", "Joggers"], "bottom"),
+    **dict.fromkeys(["Dress", "Jumpsuit", "Romper"], "one_piece"),
+    **dict.fromkeys(["Sneakers", "Boots", "Sandals", "Heels", "Loafers", "Flats"], "shoes"),
+}
+
+SLOT_BY_SEGMENT = {
+    "Upper-clothes": "top",
+    "Pants": "bottom",
+    "Skirt": "bottom",
+    "Dress": "one_piece",
+    "Shoes": "shoes",
+}
+
+# The app's wardrobe sections (wardrobe_items.category)
+SLOT_BY_COARSE_CATEGORY = {
+    **dict.fromkeys(["Top", "Tops"], "top"),
+    **dict.fromkeys(["Bottom", "Bottoms"], "bottom"),
+    **dict.fromkeys(["Outerwear", "Outer"], "outer"),
+    **dict.fromkeys(["Shoes", "Shoe", "Footwear"], "shoes"),
+    **dict.fromkeys(["Dress", "Dresses", "One-Piece"], "one_piece"),
+}
+
+_SLOT_LOOKUP = {
+    label.lower(): slot
+    for table in (SLOT_BY_SEGMENT, SLOT_BY_COARSE_CATEGORY, SLOT_BY_CATEGORY)
+    for label, slot in table.items()
+}
+
+NEUTRAL_COLORS = {
+    "black", "white", "cream", "grey", "charcoal", "navy",
+    "brown", "tan", "beige", "camel", "khaki",
+}
+
+COLOR_FAMILIES = {
+    **dict.fromkeys(["red", "burgundy", "maroon"], "red"),
+    **dict.fromkeys(["pink", "coral"], "pink"),
+    **dict.fromkeys(["blue", "light blue", "royal blue", "teal"], "blue"),
+    **dict.fromkeys(["green", "olive", "sage", "mint", "emerald"], "green"),
+    **dict.fromkeys(["yellow", "mustard", "gold"], "yellow"),
+    **dict.fromkeys(["orange", "rust", "terracotta"], "orange"),
+    **dict.fromkeys(["purple", "lavender", "plum"], "purple"),
+}
+
+# Family pairs that read as deliberate (complementary / classic) or as clashing
+COLOR_PAIRS_GOOD = {
+    frozenset(p) for p in [("blue", "orange"), ("blue", "yellow"), ("green", "pink"),
+                           ("purple", "yellow"), ("blue", "pink"), ("green", "orange")]
+}
+COLOR_PAIRS_CLASH = {
+    frozenset(p) for p in [("red", "pink"), ("red", "orange"), ("pink", "orange"),
+                           ("red", "purple"), ("green", "purple"), ("orange", "purple")]
+}
+
+STYLE_GROUPS = {
+    **dict.fromkeys(["formal", "elegant", "classic", "preppy", "smart casual", "minimalist"], "polished"),
+    **dict.fromkeys(["casual", "streetwear", "grunge", "edgy"], "casual"),
+    **dict.fromkeys(["sporty", "athleisure"], "sporty"),
+    **dict.fromkeys(["bohemian", "romantic", "vintage"], "boho"),
+}
+
+OCCASION_KEYWORDS = {
+    "polished": ["work", "office", "interview", "meeting", "wedding", "formal", "dinner", "date", "party"],
+    "sporty": ["gym", "workout", "run", "sport", "hike", "training"],
+    "casual": ["casual", "weekend", "errand", "school", "college", "brunch", "travel"],
+    "boho": ["festival", "beach", "picnic", "vacation"],
+}
+
+OCCASION_BY_GROUP = {
+    "polished": "smart / work",
+    "casual": "casual day out",
+    "sporty": "active day",
+    "boho": "weekend / vacation",
+}
+
+CANDIDATE_BEAM = 40
+# Pairwise weights (sum to 1) and the share of per-item context fit in the score
+PAIR_WEIGHTS = {"embedding": 0.35, "color": 0.3, "style": 0.2, "pattern": 0.15}
+CONTEXT_WEIGHT = 0.3
+EMBED_COS_RANGE = (0.2, 0.8)  # FashionCLIP cosine mapped linearly onto 0..1
+
+
+def _slot(item: dict) -> Optional[str]:
+    for field in ("ai_category", "category", "segment_label"):
+        slot = _SLOT_LOOKUP.get((item.get(field) or "").strip().lower())
+        if slot:
+            return slot
+    return None
+
+
+def _color_score(a: str, b: str) -> float:
+    if not a or not b or a in NEUTRAL_COLORS or b in NEUTRAL_COLORS:
+        return 1.0
+    if a == "multicolor" or b == "multicolor":
+        return 0.0 if a == b else 0.6
+    fa, fb = COLOR_FAMILIES.get(a, a), COLOR_FAMILIES.get(b, b)
+    if fa == fb:
+        return 0.8  # tonal
+    pair = frozenset((fa, fb))
+    if pair in COLOR_PAIRS_GOOD:
+        return 0.8
+    if pair in COLOR_PAIRS_CLASH:
+        return 0.0
+    return 0.4
+
+
+def _style_score(a: str, b: str) -> float:
+    if not a or not b:
+        return 0.5
+    if a == b:
+        return 1.0
+    return 0.7 if STYLE_GROUPS.get(a) == STYLE_GROUPS.get(b) else 0.2
+
+
+def _pattern_score(a: str, b: str) -> float:
+    busy_a = bool(a) and a != "solid"
+    busy_b = bool(b) and b != "solid"
+    return 0.0 if busy_a and busy_b else 1.0
+
+
+def _occasion_group(occasion: Optional[str]) -> Optional[str]:
+    text = (occasion or "").lower()
+    for group, words in OCCASION_KEYWORDS.items():
+        if any(word in text for word in words):
+            return group
+    return None
+
+
+class OutfitScorer:
+    """Pairwise compatibility + per-item context fit for one wardrobe."""
+
+    def __init__(self, items: list[dict], occasion: Optional[str], season: Optional[str]):
+        self.items = items
+        n = len(items)
+
+        emb_idx = [i for i, it in enumerate(items) if it.get("embedding")]
+        self.embed_cos: Optional[np.ndarray] = None
+        if len(emb_idx) > 1:
+            emb = np.array([items[i]["embedding"] for i in emb_idx], dtype=np.float32)
+            emb /= np.maximum(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12)
+            lo, hi = EMBED_COS_RANGE
+            self.embed_cos = np.full((n, n), np.nan, dtype=np.float32)
+            self.embed_cos[np.ix_(emb_idx, emb_idx)] = np.clip(
+                (emb @ emb.T - lo) / (hi - lo), 0.0, 1.0
+            )
+
+        target = _occasion_group(occasion)
+        self.context = []
+        for it in items:
+            item_season = it.get("season", "")
+            season_fit = (
+                1.0 if not season or item_season in ("", "all-season", season.lower()) else 0.2
+            )
+            group = STYLE_GROUPS.get(it.get("style", ""))
+            if target is None:
+                occasion_fit = 1.0
+            elif group is None:
+                occasion_fit = 0.6
+            else:
+                occasion_fit = 1.0 if group == target else 0.3
+            self.context.append((season_fit + occasion_fit) / 2)
+        self._pairs: dict[tuple[int, int], float] = {}
+
+    def pair(self, i: int, j: int) -> float:
+        key = (i, j) if i < j else (j, i)
+        score = self._pairs.get(key)
+        if score is None:
+            a, b = self.items[i], self.items[j]
+            parts = {
+                "color": _color_score(a.get("color", ""), b.get("color", "")),
+                "style": _style_score(a.get("style", ""), b.get("style", "")),
+                "pattern": _pattern_score(a.get("pattern", ""), b.get("pattern", "")),
+            }
+            weights = dict(PAIR_WEIGHTS)
+            cos = self.embed_cos[i, j] if self.embed_cos is not None else np.nan
+            if np.isnan(cos):
+                weights.pop("embedding")  # renormalize over the rule scores
+            else:
+                parts["embedding"] = float(cos)
+            score = sum(weights[k] * parts[k] for k in weights) / sum(weights.values())
+            self._pairs[key] = score
+        return score
+
+    def outfit(self, members: tuple[int, ...]) -> float:
+        pairs = [self.pair(a, b) for k, a in enumerate(members) for b in members[k + 1 :]]
+        pair_score = sum(pairs) / len(pairs) if pairs else 0.5
+        context = sum(self.context[m] for m in members) / len(members)
+        return (1 - CONTEXT_WEIGHT) * pair_score + CONTEXT_WEIGHT * context
+
+
+def _describe(items: list[dict]) -> str:
+    names = [
+        f"{it.get('color', '')} "
+        f"{it.get('ai_category') or it.get('category') or it.get('segment_label', '')}".strip()
+        for it in items
+    ]
+    text = names[0] if len(names) == 1 else ", ".join(names[:-1]) + f" with {names[-1]}"
+    colors = [it.get("color", "") for it in items if it.get("color")]
+    if colors and all(c in NEUTRAL_COLORS for c in colors):
+        text += " — an easy neutral palette"
+    elif sum(c not in NEUTRAL_COLORS for c in colors) == 1:
+        text += " — one accent color against neutrals"
+    return text[0].upper() + text[1:] + "."
+
+
+def generate_candidates(
+    wardrobe: list[dict],
+    occasion: Optional[str] = None,
+    season: Optional[str] = None,
+    limit: int = RECOMMEND_CANDIDATES,
+) -> list[dict]:
+    """Top ``limit`` outfits from the wardrobe, best first, no LLM involved."""
+    with stage("candidates"):
+        return _generate_candidates(wardrobe, occasion, season, limit)
+
+
+def _generate_candidates(
+    wardrobe: list[dict], occasion: Optional[str], season: Optional[str], limit: int
+) -> list[dict]:
+    slots: dict[str, list[int]] = {}
+    for i, item in enumerate(wardrobe):
+        slot = _slot(item)
+        if slot:
+            slots.setdefault(slot, []).append(i)
+    scorer = OutfitScorer(wardrobe, occasion, season)
+
+    def best(outfits: list[tuple[int, ...]]) -> list[tuple[float, tuple[int, ...]]]:
+        scored = [(scorer.outfit(o), o) for o in outfits]
+        scored.sort(key=lambda x: (-x[0], x[1]))  # ties broken by item order: deterministic
+        return scored[:CANDIDATE_BEAM]
+
+    bases = [(t, b) for t in slots.get("top", []) for b in slots.get("bottom", [])]
+    bases += [(d,) for d in slots.get("one_piece", [])]
+    beam = best(bases)
+    if slots.get("shoes"):
+        beam = best([o + (s,) for _, o in beam for s in slots["shoes"]])
+    if slots.get("outer"):
+        # The layer is optional: keep it only where it scores better than without
+        beam = best([o for _, base in beam for o in [base] + [base + (x,) for x in slots["outer"]]])
+
+    # Prefer variety: skip outfits sharing two or more pieces with a chosen one
+    chosen, rest = [], []
+    for score, members in beam:
+        if all(len(set(members) & set(c)) < 2 for _, c in chosen):
+            chosen.append((score, members))
+        else:
+            rest.append((score, members))
+    chosen = (chosen + rest)[:limit]
+
+    target = _occasion_group(occasion)
+    candidates = []
+    for score, members in chosen:
+        items = [wardrobe[m] for m in members]
+        styles = [it["style"] for it in items if it.get("style")]
+        style_tags = sorted(set(styles), key=lambda st: (-styles.count(st), st))[:3]
+        groups = [STYLE_GROUPS[st] for st in styles if st in STYLE_GROUPS]
+        group = target or (max(set(groups), key=groups.count) if groups else None)
+        candidates.append(
+            {
+                "outfit_items": [it["id"] for it in items],
+                "occasion": occasion or OCCASION_BY_GROUP.get(group, "everyday"),
+                "description": _describe(items),
+                "style_tags": style_tags,
+                "score": round(score, 4),
+            }
+        )
+    return candidates
+
+
+# ── Ranking + descriptions (Nemotron-Nano-9B-v2) ──
+
+# The system prompt is byte-for-byte constant (no per-request formatting) so
+# vLLM's prefix cache can reuse its KV blocks across every ranking call.
+RECOMMENDATION_SYSTEM_PROMPT = """/no_think
+You are an expert fashion stylist. You are given a user's wardrobe items as a table (one row per item, "|"-separated, short ids) and numbered candidate outfits built from them (already checked for fit and color rules). Choose the best outfits for the request and explain them.
+
+Rules:
+- Pick at most the requested number of different candidates, best first
+- Only use candidate numbers that were given
+- Return ONLY valid JSON, nothing else
+
+Output format:
+{"recommendations": [{"candidate": 1, "occasion": "casual day out", "description": "Why these work", "style_tags": ["minimalist"]}]}"""
+
+PROMPT_ITEM_FIELDS = ("category", "color", "style", "pattern", "material", "season")
+CHARS_PER_TOKEN = 3.5  # estimate when the LLM tokenizer isn't available
+
+
+class LLMTimeout(RuntimeError):
+    pass
+
+
+class LLMClient:
+    """Pooled async client for vLLM's OpenAI-compatible API.
+
+    Keep-alive connections are reused across requests, at most
+    ``max_inflight`` generations run at once (callers queue for a slot), and
+    5xx / 429 / connection failures are retried with exponential backoff and
+    full jitter. Every call carries an absolute deadline (``loop.time()``);
+    the slot wait, each attempt and the backoff sleeps all stop at it.
+    Cancelling the awaiting task closes the connection, which makes vLLM
+    abort the generation instead of finishing it for nobody.
+    """
+
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+    BACKOFF_BASE_S = 0.25
+    BACKOFF_MAX_S = 4.0
+
+    def __init__(self, base_url: str, model: str, max_inflight: int, max_retries: int):
+        self.base_url = base_url
+        self.model = model
+        self.max_retries = max_retries
+        self._slots = asyncio.Semaphore(max_inflight)
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            limits=httpx.Limits(
+                max_connections=max_inflight, max_keepalive_connections=max_inflight
+            ),
+            timeout=httpx.Timeout(LLM_TIMEOUT_S, connect=5.0),
+        )
+        self.in_flight = 0
+        self.retries = 0
+
+    async def chat(self, messages: list[dict], max_tokens: int, deadline: float) -> str:
+        loop = asyncio.get_running_loop()
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": 0,
+        }
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=deadline - loop.time())
+        except asyncio.TimeoutError:
+            raise LLMTimeout("Deadline exceeded waiting for a vLLM slot")
+
+        self.in_flight += 1
+        try:
+            for attempt in range(self.max_retries + 1):
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise LLMTimeout("Deadline exceeded calling vLLM")
+                try:
+                    response = await self._client.post(
+                        "/v1/chat/completions", json=payload, timeout=remaining
+                    )
+                except httpx.TimeoutException:
+                    raise LLMTimeout("Deadline exceeded calling vLLM")
+                except httpx.TransportError as e:
+                    error = f"vLLM unreachable: {e!r}"
+                else:
+                    if response.status_code == 200:
+                        data = response.json()
+                        return data["choices"][0]["message"]["content"].strip()
+                    error = f"vLLM error ({response.status_code}): {response.text[:500]}"
+                    if response.status_code not in self.RETRY_STATUS:
+                        logger.error(f"  [Nemotron] {error}")
+                        raise RuntimeError(error)
+
+                if attempt == self.max_retries:
+                    break
+                delay = random.uniform(0, min(self.BACKOFF_MAX_S, self.BACKOFF_BASE_S * 2**attempt))
+                if loop.time() + delay >= deadline:
+                    break
+                self.retries += 1
+                logger.warning(f"  [Nemotron] {error} — retry {attempt + 1} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+            logger.error(f"  [Nemotron] {error}")
+            raise RuntimeError(error)
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    async def chat_stream(
+        self, messages: list[dict], max_tokens: int, deadline: float
+    ) -> AsyncIterator[str]:
+        """Yield content deltas as vLLM generates them (``stream: true``).
+
+        Retries apply only until the first token arrives. Closing the
+        generator early (enough output, or client gone) closes the
+        connection, which stops the generation in vLLM.
+        """
+        loop = asyncio.get_running_loop()
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": 0,
+            "stream": True,
+        }
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=deadline - loop.time())
+        except asyncio.TimeoutError:
+            raise LLMTimeout("Deadline exceeded waiting for a vLLM slot")
+
+        self.in_flight += 1
+        try:
+            for attempt in range(self.max_retries + 1):
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise LLMTimeout("Deadline exceeded calling vLLM")
+                started = False
+                try:
+                    async with self._client.stream(
+                        "POST", "/v1/chat/completions", json=payload, timeout=remaining
+                    ) as response:
+                        if response.status_code != 200:
+                            body = (await response.aread()).decode(errors="replace")
+                            error = f"vLLM error ({response.status_code}): {body[:500]}"
+                            if response.status_code not in self.RETRY_STATUS:
+                                logger.error(f"  [Nemotron] {error}")
+                                raise RuntimeError(error)
+                        else:
+                            async for line in response.aiter_lines():
+                                if loop.time() > deadline:
+                                    raise LLMTimeout("Deadline exceeded streaming from vLLM")
+                                if not line.startswith("data:"):
+                                    continue
+                                data = line[5:].strip()
+                                if data == "[DONE]":
+                                    return
+                                choices = json.loads(data).get("choices") or [{}]
+                                delta = (choices[0].get("delta") or {}).get("content")
+                                if delta:
+                                    started = True
+                                    yield delta
+                            return
+                except httpx.TimeoutException:
+                    raise LLMTimeout("Deadline exceeded calling vLLM")
+                except httpx.TransportError as e:
+                    if started:
+                        raise RuntimeError(f"vLLM stream interrupted: {e!r}")
+                    error = f"vLLM unreachable: {e!r}"
+
+                if attempt == self.max_retries:
+                    break
+                delay = random.uniform(0, min(self.BACKOFF_MAX_S, self.BACKOFF_BASE_S * 2**attempt))
+                if loop.time() + delay >= deadline:
+                    break
+                self.retries += 1
+                logger.warning(f"  [Nemotron] {error} — retry {attempt + 1} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+            logger.error(f"  [Nemotron] {error}")
+            raise RuntimeError(error)
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+
+llm_client = LLMClient(VLLM_URL, LLM_MODEL, LLM_WORKERS, LLM_MAX_RETRIES)
+
+
+def _parse_json_object(text: str) -> Optional[dict]:
+    try:
+        json_start = text.find("{")
+        json_end = text.rfind("}") + 1
+        if json_start >= 0 and json_end > json_start:
+            return json.loads(text[json_start:json_end])
+    except json.JSONDecodeError:
+        pass
+    return None
+
+
+class JSONObjectStream:
+    """Incrementally pull complete objects out of ``{..., "key": [{...}, {...}]}``.
+
+    Text is fed as it streams in; every object that closes directly inside an
+    array value of the top-level object is parsed and returned as soon as its
+    last brace arrives. Other members (strings, numbers, nested objects) are
+    skipped, so the array can sit under any key. Anything before the
+    top-level object (preamble) is skipped too: if the text after a ``{``
+    turns out not to be an object's members, scanning resumes right after
+    that brace, so quotes and braces in prose are harmless. An element that
+    fails to parse is dropped and the array scan restarts.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self) -> None:
+        self._state = "scan"
+        self._replay: Optional[list[str]] = None  # text after an unconfirmed top-level "{"
+        self._stack: list[str] = []
+        self._in_string = False
+        self._escape = False
+        self._buf: Optional[list[str]] = None  # current array element
+
+    def _string_char(self, ch: str) -> bool:
+        """Advance an open string; False once ``ch`` closes it."""
+        if self._escape:
+            self._escape = False
+        elif ch == "\\":
+            self._escape = True
+        elif ch == '"':
+            return False
+        return True
+
+    @staticmethod
+    def _member_step(state: str, ch: str) -> Optional[str]:
+        """Next state of the top-level object's grammar, or None if ``ch`` breaks it."""
+        if state == "key":
+            return {'"': "key_str", "}": "scan"}.get(ch)
+        if state == "colon":
+            return "value" if ch == ":" else None
+        if state == "value":
+            if ch in "]},:":
+                return None
+            return {"[": "array", '"': "skip_str", "{": "skip_nested"}.get(ch, "skip_scalar")
+        if state == "skip_scalar":
+            return {",": "key", "}": "scan"}.get(ch, "skip_scalar")
+        return {",": "key", "}": "scan"}.get(ch)  # after a value
+
+    def _nested_char(self, ch: str) -> Iterator[dict]:
+        """One character inside an array value (collecting) or a skipped nested value."""
+        collecting = self._state == "array"
+        if self._buf is not None:
+            self._buf.append(ch)
+        if self._in_string:
+            self._in_string = self._string_char(ch)
+            return
+        if ch == '"':
+            self._in_string = True
+        elif ch in "{[":
+            if collecting and ch == "{" and not self._stack:
+                self._buf = ["{"]
+            self._stack.append(ch)
+        elif ch in "}]":
+            if collecting and not self._stack:
+                # The array itself closes
+                self._state = "after" if ch == "]" else "scan"
+                return
+            self._stack.pop()
+            if not collecting:
+                if not self._stack:
+                    self._state = "after"
+                return
+            if ch == "}" and not self._stack and self._buf is not None:
+                text_obj = "".join(self._buf)
+                self._buf = None
+                try:
+                    obj = json.loads(text_obj)
+                except json.JSONDecodeError:
+                    self._stack = []
+                    self._in_string = self._escape = False
+                    return
+                if isinstance(obj, dict):
+                    yield obj
+
+    def feed(self, text: str) -> Iterator[dict]:
+        pending = deque(text)
+        while pending:
+            ch = pending.popleft()
+            if self._replay is not None:
+                self._replay.append(ch)
+            state = self._state
+            if state == "scan":
+                if ch == "{":
+                    self._state = "key"
+                    self._replay = []
+                continue
+            if state in ("array", "skip_nested"):
+                yield from self._nested_char(ch)
+                if self._state == "scan":
+                    self._replay = None
+                continue
+            if state in ("key_str", "skip_str"):
+                if not self._string_char(ch):
+                    self._state = "colon" if state == "key_str" else "after"
+                continue
+            if ch.isspace():
+                if state == "skip_scalar":
+                    self._state = "after"
+                continue
+
+            following = self._member_step(state, ch)
+            if following is None:
+                # Not an object's members after all: rescan from just after its "{"
+                replay = self._replay
+                self._reset()
+                pending.extendleft(reversed(replay if replay is not None else [ch]))
+                continue
+            self._state = following
+            if following == "array":
+                self._replay = None  # committed to this object
+                self._stack = []
+            elif following == "skip_nested":
+                self._stack = ["{"]
+            elif following == "scan":
+                self._replay = None
+
+
+# ── Prompt building ──
+# Items go in as a compact table keyed by short local aliases (i1, i2, ...)
+# instead of JSON with full UUIDs; the model answers with candidate numbers,
+# which map back to the real item ids. Each prompt is counted against
+# LLM_PROMPT_TOKEN_BUDGET, and candidate lists that don't fit are split into
+# shards that are ranked separately (map) before a final ranking over the
+# shard winners (reduce).
+
+
+def count_tokens(text: str) -> int:
+    tokenizer = models.get("llm_tokenizer") if LLM_AVAILABLE else None
+    if tokenizer is None:
+        return int(len(text) / CHARS_PER_TOKEN) + 1
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def _item_row(alias: str, item: dict) -> str:
+    values = [str(item.get(k) or "").replace("|", "/") for k in PROMPT_ITEM_FIELDS]
+    return "|".join([alias, *values])
+
+
+def _ranking_messages(
+    wardrobe: dict[str, dict],
+    candidates: list[dict],
+    occasion: Optional[str],
+    season: Optional[str],
+    count: int,
+) -> list[dict]:
+    """``wardrobe`` maps item id → item."""
+    aliases: dict[str, str] = {}
+    rows = ["id|" + "|".join(PROMPT_ITEM_FIELDS)]
+    for cand in candidates:
+        for item_id in cand["outfit_items"]:
+            if item_id not in aliases:
+                aliases[item_id] = f"i{len(aliases) + 1}"
+                rows.append(_item_row(aliases[item_id], wardrobe.get(item_id, {})))
+    listing = "\n".join(
+        f"{n}: {' '.join(aliases[i] for i in c['outfit_items'])}"
+        for n, c in enumerate(candidates, start=1)
+    )
+    user_msg = f"Items:\n{chr(10).join(rows)}\nCandidates:\n{listing}\nPick up to {count}."
+    if occasion:
+        user_msg += f"\nOccasion: {occasion}"
+    if season:
+        user_msg += f"\nSeason: {season}"
+    return [
+        {"role": "system", "content": RECOMMENDATION_SYSTEM_PROMPT},
+        {"role": "user", "content": user_msg},
+    ]
+
+
+def plan_ranking(
+    wardrobe: list[dict],
+    candidates: list[dict],
+    occasion: Optional[str],
+    season: Optional[str],
+    count: int,
+) -> list[tuple[list[dict], list[dict]]]:
+    """Split ``candidates`` into shards whose prompts fit the token budget.
+
+    Returns ``[(shard_candidates, messages), ...]``; one entry when it all fits.
+    """
+    by_id = {item["id"]: item for item in wardrobe}
+
+    def tokens(shard: list[dict]) -> int:
+        messages = _ranking_messages(by_id, shard, occasion, season, count)
+        return sum(count_tokens(m["content"]) for m in messages)
+
+    shards: list[list[dict]] = [[]]
+    for cand in candidates:
+        if shards[-1] and tokens(shards[-1] + [cand]) > LLM_PROMPT_TOKEN_BUDGET:
+            shards.append([])
+        shards[-1].append(cand)
+    if len(shards) > 1:
+        logger.info(
+            f"  [Nemotron] {len(candidates)} candidates over the {LLM_PROMPT_TOKEN_BUDGET}-token "
+            f"budget → {len(shards)} shards"
+        )
+    return [(shard, _ranking_messages(by_id, shard, occasion, season, count)) for shard in shards]
+
+
+def _pick(rec: Any, candidates: list[dict], seen: set[int]) -> Optional[dict]:
+    """Map one LLM recommendation onto its candidate, or None if invalid/repeated."""
+    n = rec.get("candidate") if isinstance(rec, dict) else None
+    if not isinstance(n, int) or not 1 <= n <= len(candidates) or n in seen:
+        return None
+    seen.add(n)
+    cand = candidates[n - 1]
+    return {
+        **cand,
+        "occasion": rec.get("occasion") or cand["occasion"],
+        "description": rec.get("description") or cand["description"],
+        "style_tags": rec.get("style_tags") or cand["style_tags"],
+    }
+
+
+async def _rank_prompt(candidates: list[dict], messages: list[dict], deadline: float) -> list[dict]:
+    with stage("llm"):
+        response_text = await llm_client.chat(messages, max_tokens=768, deadline=deadline)
+    logger.info(f"  [Nemotron] Raw response: {response_text[:300]}...")
+
+    parsed = _parse_json_object(response_text) or {}
+    seen: set[int] = set()
+    picks = [
+        pick
+        for rec in parsed.get("recommendations", [])
+        if (pick := _pick(rec, candidates, seen)) is not None
+    ]
+    if not picks:
+        raise RuntimeError(f"Unusable LLM ranking: {response_text[:200]}")
+    return picks
+
+
+async def _reduce_shards(
+    wardrobe: list[dict],
+    candidates: list[dict],
+    deadline: float,
+    occasion: Optional[str],
+    season: Optional[str],
+    count: int,
+) -> tuple[list[dict], list[dict]]:
+    """Shard until the candidates fit one prompt; returns ``(candidates, messages)``.
+
+    If a round of shard rankings stops shrinking the list, the winners with the
+    best local scores that fit the budget go to the final ranking.
+    """
+    while True:
+        plan = await run_in_pool(
+            llm_executor, plan_ranking, wardrobe, candidates, occasion, season, count
+        )
+        if len(plan) == 1:
+            return plan[0]
+        results = await asyncio.gather(
+            *(_rank_prompt(shard, messages, deadline) for shard, messages in plan),
+            return_exceptions=True,
+        )
+        winners = [
+            # Strip map-step wording; the final ranking re-describes the winners
+            next(c for c in shard if c["outfit_items"] == pick["outfit_items"])
+            for (shard, _), picks in zip(plan, results)
+            if not isinstance(picks, BaseException)
+            for pick in picks[:count]
+        ]
+        if not winners:
+            raise next(r for r in results if isinstance(r, BaseException))
+        if len(winners) >= len(candidates):
+            # Shards can't shrink the list any further: the final ranking gets
+            # the winners with the best local scores that fit one prompt
+            best = sorted(winners, key=lambda c: -c["score"])
+            plan = await run_in_pool(
+                llm_executor, plan_ranking, wardrobe, best, occasion, season, count
+            )
+            logger.info(
+                f"  [Nemotron] Final ranking over the top {len(plan[0][0])} of "
+                f"{len(winners)} shard winners by local score"
+            )
+            return plan[0]
+        candidates = winners
+
+
+async def rank_candidates(
+    wardrobe: list[dict],
+    candidates: list[dict],
+    deadline: float,
+    occasion: Optional[str] = None,
+    season: Optional[str] = None,
+    count: int = RECOMMEND_COUNT,
+) -> list[dict]:
+    """Ask Nemotron to choose and describe ``count`` of the local candidates."""
+    candidates, messages = await _reduce_shards(
+        wardrobe, candidates, deadline, occasion, season, count
+    )
+    logger.info(f"  [Nemotron] Ranking {len(candidates)} candidates via vLLM...")
+    return (await _rank_prompt(candidates, messages, deadline))[:count]
+
+
+async def stream_ranked_candidates(
+    wardrobe: list[dict],
+    candidates: list[dict],
+    deadline: float,
+    occasion: Optional[str] = None,
+    season: Optional[str] = None,
+    count: int = RECOMMEND_COUNT,
+) -> AsyncIterator[dict]:
+    """Like rank_candidates, but yields each pick as soon as its JSON object
+    closes in the token stream, and stops generation after ``count`` picks.
+    Over-budget candidate lists are sharded first; only the final ranking streams."""
+    candidates, messages = await _reduce_shards(
+        wardrobe, candidates, deadline, occasion, season, count
+    )
+    logger.info(f"  [Nemotron] Streaming ranking of {len(candidates)} candidates via vLLM...")
+    parser = JSONObjectStream()
+    seen: set[int] = set()
+    produced = 0
+    stream = llm_client.chat_stream(messages, max_tokens=768, deadline=deadline)
+    start = time.perf_counter()
+    try:
+        async for delta in stream:
+            for rec in parser.feed(delta):
+                pick = _pick(rec, candidates, seen)
+                if pick is None:
+                    continue
+                produced += 1
+                yield pick
+                if produced >= count:
+                    return
+    finally:
+        await stream.aclose()
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage="llm_stream")
+
+
+# ── Wardrobe-only generation ──
+# When slotting can't build a single candidate (categories it doesn't know,
+# or no top/bottom/one-piece), Nemotron composes the outfits itself from the
+# item table, as it did before local candidates. Items past the token budget
+# are left out of the prompt.
+
+WARDROBE_SYSTEM_PROMPT = """/no_think
+You are an expert fashion stylist. You are given a user's wardrobe items as a table (one row per item, "|"-separated, short ids). Suggest outfit combinations from them.
+
+Rules:
+- Each outfit needs a top + bottom (or dress) + shoes if available
+- Good color coordination and style cohesion
+- Only use item ids that were given
+- Return ONLY valid JSON, nothing else
+
+Output format:
+{"recommendations": [{"outfit_items": ["i1", "i2", "i3"], "occasion": "casual day out", "description": "Why these work", "style_tags": ["minimalist"]}]}"""
+
+
+def _wardrobe_messages(
+    wardrobe: list[dict], occasion: Optional[str], season: Optional[str], count: int
+) -> tuple[list[dict], dict[str, str]]:
+    """Returns ``(messages, alias → item id)`` for the items that fit the budget."""
+    suffix = f"\nSuggest {count} outfits."
+    if occasion:
+        suffix += f"\nOccasion: {occasion}"
+    if season:
+        suffix += f"\nSeason: {season}"
+    header = "id|" + "|".join(PROMPT_ITEM_FIELDS)
+    budget = LLM_PROMPT_TOKEN_BUDGET - count_tokens(
+        f"{WARDROBE_SYSTEM_PROMPT}\nItems:\n{header}{suffix}"
+    )
+    rows = [header]
+    aliases: dict[str, str] = {}
+    for item in wardrobe:
+        alias = f"i{len(aliases) + 1}"
+        row = _item_row(alias, item)
+        budget -= count_tokens(row) + 1
+        if budget < 0:
+            break
+        rows.append(row)
+        aliases[alias] = item["id"]
+    user_msg = f"Items:\n{chr(10).join(rows)}{suffix}"
+    return [
+        {"role": "system", "content": WARDROBE_SYSTEM_PROMPT},
+        {"role": "user", "content": user_msg},
+    ], aliases
+
+
+async def generate_from_wardrobe(
+    wardrobe: list[dict],
+    deadline: float,
+    occasion: Optional[str] = None,
+    season: Optional[str] = None,
+    count: int = RECOMMEND_COUNT,
+) -> list[dict]:
+    """Ask Nemotron to compose ``count`` outfits straight from the wardrobe."""
+    messages, aliases = await run_in_pool(
+        llm_executor, _wardrobe_messages, wardrobe, occasion, season, count
+    )
+    logger.info(f"  [Nemotron] Composing outfits from {len(aliases)} items via vLLM...")
+    with stage("llm"):
+        response_text = await llm_client.chat(messages, max_tokens=1024, deadline=deadline)
+    logger.info(f"  [Nemotron] Raw response: {response_text[:300]}...")
+
+    by_id = {item["id"]: item for item in wardrobe}
+    parsed = _parse_json_object(response_text) or {}
+    picks: list[dict] = []
+    seen: set[tuple[str, ...]] = set()
+    for rec in parsed.get("recommendations", []):
+        listed = rec.get("outfit_items") if isinstance(rec, dict) else None
+        if not isinstance(listed, list):
+            continue
+        known = [aliases[a] for a in listed if isinstance(a, str) and a in aliases]
+        items = tuple(dict.fromkeys(known))
+        if not items or items in seen:
+            continue
+        seen.add(items)
+        picks.append(
+            {
+                "outfit_items": list(items),
+                "occasion": rec.get("occasion") or occasion or "everyday",
+                "description": rec.get("description") or _describe([by_id[i] for i in items]),
+                "style_tags": rec.get("style_tags") or [],
+            }
+        )
+        if len(picks) == count:
+            break
+    if not picks:
+        raise RuntimeError(f"Unusable LLM outfits: {response_text[:200]}")
+    return picks
+
+
+def _top_up(picks: list[dict], candidates: list[dict]) -> list[dict]:
+    """Local candidates not already picked, enough to reach RECOMMEND_COUNT."""
+    picked = {tuple(p["outfit_items"]) for p in picks}
+    rest = [c for c in candidates if tuple(c["outfit_items"]) not in picked]
+    return rest[: max(0, RECOMMEND_COUNT - len(picks))]
+
+
+def recommendation_result(
+    candidates: list[dict], picks: list[dict], wanted: int, llm_error: Optional[str]
+) -> dict:
+    """The response body for both the JSON and the streaming endpoint (they
+    share cache entries): Nemotron's picks topped up from local candidates.
+
+    Fewer than ``wanted`` picks counts as a fallback, so it carries an
+    ``llm_error`` and stays out of the cache.
+    """
+    if llm_error is None and len(picks) < wanted:
+        llm_error = f"LLM returned {len(picks)} of {wanted} outfits"
+    result = {
+        "recommendations": picks + _top_up(picks, candidates),
+        "source": "llm" if picks else "candidates",
+    }
+    if llm_error is not None:
+        result["llm_error"] = llm_error
+    return result
+
+
+def _wanted_picks(wardrobe: list[dict], candidates: list[dict]) -> int:
+    """How many picks a complete LLM answer has (0 when the LLM isn't asked)."""
+    if not wardrobe or not LLM_AVAILABLE:
+        return 0
+    return min(RECOMMEND_COUNT, len(candidates)) if candidates else RECOMMEND_COUNT
+
+
+async def generate_recommendations(
+    wardrobe: list[dict],
+    occasion: Optional[str] = None,
+    season: Optional[str] = None,
+    deadline: Optional[float] = None,
+) -> dict:
+    """Local outfit candidates, ranked and described by Nemotron when available.
+
+    ``deadline`` is an event-loop time; past it the local ranking is returned.
+    Without any candidates, Nemotron composes outfits from the whole wardrobe.
+    """
+    if deadline is None:
+        deadline = asyncio.get_running_loop().time() + LLM_TIMEOUT_S
+    candidates = await run_in_pool(llm_executor, generate_candidates, wardrobe, occasion, season)
+    logger.info(f"  [outfits] {len(candidates)} candidates from {len(wardrobe)} items")
+    wanted = _wanted_picks(wardrobe, candidates)
+    picks: list[dict] = []
+    llm_error = None
+    if wanted:
+        try:
+            if candidates:
+                picks = await rank_candidates(wardrobe, candidates, deadline, occasion, season)
+            else:
+                picks = await generate_from_wardrobe(wardrobe, deadline, occasion, season)
+        except Exception as e:
+            # vLLM down or unusable output — the local ranking still stands
+            logger.warning(f"  [Nemotron] Falling back to local candidates: {e}")
+            llm_error = str(e)
+        else:
+            logger.info(f"  [Nemotron] Generated {len(picks)} recommendations.")
+    return recommendation_result(candidates, picks, wanted, llm_error)
+
+
+# ── Recommendation cache ──
+# Generation is deterministic (temperature 0), so a response is cached under a
+# hash of the canonical wardrobe, occasion, season, prompt version and model.
+# Entries expire after RECOMMEND_CACHE_TTL_S, are evicted LRU, and are dropped
+# early when any of their items change (index upserts/removals or an explicit
+# invalidate). Concurrent identical requests, streamed or not, share one
+# in-flight generation; streaming callers get its picks as they are produced.
+
+RECOMMEND_PROMPT_VERSION = "5"
+
+
+class _InFlight:
+    """A shared generation: its task, how many callers await it, and the picks
+    it has streamed so far (replayed to streaming callers that join late)."""
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+        self.picks: list[dict] = []
+        self.updated = asyncio.Event()
+
+    def emit(self, pick: dict) -> None:
+        self.picks.append(pick)
+        self.updated.set()
+        self.updated = asyncio.Event()
+
+
+class RecommendationCache:
+    def __init__(self, max_items: int, ttl_s: float):
+        self.memory = LRUCache(max_items)
+        self.ttl_s = ttl_s
+        self.fingerprint = hashlib.sha256(
+            json.dumps(
+                [
+                    RECOMMEND_PROMPT_VERSION,
+                    RECOMMENDATION_SYSTEM_PROMPT,
+                    WARDROBE_SYSTEM_PROMPT,
+                    LLM_MODEL,
+                    LLM_AVAILABLE,
+                    RECOMMEND_CANDIDATES,
+                    RECOMMEND_COUNT,
+                    LLM_PROMPT_TOKEN_BUDGET,
+                ]
+            ).encode()
+        ).hexdigest()[:16]
+        self._inflight: dict[str, _InFlight] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidated = 0
+
+    def key(self, wardrobe: list[dict], occasion: Optional[str], season: Optional[str]) -> str:
+        """Hash of the canonical request. Wardrobes can carry an embedding per
+        item, so callers run this in a worker thread, not on the event loop."""
+        canonical = orjson.dumps(
+            {
+                "wardrobe": sorted(wardrobe, key=lambda it: it["id"]),
+                "occasion": (occasion or "").strip().lower(),
+                "season": (season or "").strip().lower(),
+                "fingerprint": self.fingerprint,
+            },
+            option=orjson.OPT_SORT_KEYS,
+        )
+        return hashlib.sha256(canonical).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self.memory.get(key)
+        if entry is None:
+            return None
+        expires_at, _, _, body = entry
+        if time.monotonic() >= expires_at:
+            self.memory.pop(key)
+            return None
+        return body
+
+    async def get_or_generate(
+        self,
+        key: str,
+        item_ids: set[str],
+        owner: Optional[str],
+        generate: Callable[[], Any],
+    ) -> tuple[bytes, str]:
+        """``(json_body, "HIT" | "MISS" | "COALESCED")``.
+
+        ``generate`` returns an awaitable of the result dict and runs at most
+        once per key at a time, as a task shared by every caller waiting on
+        that key. If all of them are cancelled (clients gone), so is the task.
+        """
+        body = self.get(key)
+        if body is not None:
+            self.hits += 1
+            return body, "HIT"
+
+        entry, status = self._join(key, item_ids, owner, lambda emit: generate())
+        try:
+            return await asyncio.shield(entry.task), status
+        finally:
+            self._leave(entry)
+
+    async def stream_or_generate(
+        self,
+        key: str,
+        item_ids: set[str],
+        owner: Optional[str],
+        generate: Callable[[Callable[[dict], None]], Any],
+    ) -> AsyncIterator[tuple[str, Any]]:
+        """Streaming ``get_or_generate``: yields ``("outfit", pick)`` per
+        recommendation, then ``("done", (result, status))``.
+
+        ``generate(emit)`` calls ``emit(pick)`` as each pick is produced and
+        returns the result dict, whose recommendations start with the emitted
+        picks. Joining an in-flight generation yields its picks so far and then
+        the rest as they arrive; cached (or non-streamed) results are replayed.
+        """
+        body = self.get(key)
+        if body is not None:
+            self.hits += 1
+            result = json.loads(body)
+            for pick in result["recommendations"]:
+                yield "outfit", pick
+            yield "done", (result, "HIT")
+            return
+
+        entry, status = self._join(key, item_ids, owner, generate)
+        sent = 0
+        try:
+            while True:
+                updated = entry.updated
+                while sent < len(entry.picks):
+                    yield "outfit", entry.picks[sent]
+                    sent += 1
+                if entry.task.done():
+                    break
+                waiter = asyncio.ensure_future(updated.wait())
+                try:
+                    await asyncio.wait({entry.task, waiter}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    waiter.cancel()
+            result = json.loads(entry.task.result())
+        finally:
+            self._leave(entry)
+        for pick in result["recommendations"][sent:]:
+            yield "outfit", pick
+        yield "done", (result, status)
+
+    def _join(
+        self,
+        key: str,
+        item_ids: set[str],
+        owner: Optional[str],
+        generate: Callable[[Callable[[dict], None]], Any],
+    ) -> tuple[_InFlight, str]:
+        entry = self._inflight.get(key)
+        if entry is not None:
+            self.coalesced += 1
+            status = "COALESCED"
+        else:
+            self.misses += 1
+            status = "MISS"
+            entry = self._inflight[key] = _InFlight()
+            entry.task = asyncio.ensure_future(
+                self._generate(key, item_ids, owner, lambda: generate(entry.emit))
+            )
+            # Not in _generate: a task cancelled before it starts never runs its body
+            entry.task.add_done_callback(
+                lambda _: self._inflight.pop(key) if self._inflight.get(key) is entry else None
+            )
+        entry.waiters += 1
+        return entry, status
+
+    @staticmethod
+    def _leave(entry: _InFlight) -> None:
+        entry.waiters -= 1
+        if entry.waiters == 0 and not entry.task.done():
+            entry.task.cancel()
+
+    async def _generate(
+        self, key: str, item_ids: set[str], owner: Optional[str], generate: Callable[[], Any]
+    ) -> bytes:
+        return self.put(key, item_ids, owner, await generate())
+
+    def put(self, key: str, item_ids: set[str], owner: Optional[str], result: dict) -> bytes:
+        body = dump_json(result)
+        # Don't pin a fallback (LLM outage, or a short / unparseable answer)
+        # for the whole TTL
+        if "llm_error" not in result:
+            self.memory.put(key, (time.monotonic() + self.ttl_s, frozenset(item_ids), owner, body))
+        return body
+
+    def invalidate(
+        self, item_ids: Optional[set[str]] = None, owner: Optional[str] = None
+    ) -> int:
+        """Drop every entry that contains one of ``item_ids`` or belongs to ``owner``."""
+        dropped = 0
+        for key, (_, ids, entry_owner, _) in self.memory.items():
+            if (item_ids and not ids.isdisjoint(item_ids)) or (owner and entry_owner == owner):
+                if self.memory.pop(key) is not None:
+                    dropped += 1
+        self.invalidated += dropped
+        return dropped
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidated": self.invalidated,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+            "items": len(self.memory),
+            "in_flight": len(self._inflight),
+        }
+
+
+recommendation_cache = RecommendationCache(RECOMMEND_CACHE_ITEMS, RECOMMEND_CACHE_TTL_S)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# FastAPI
+# ──────────────────────────────────────────────────────────────────────────────
+
+app = FastAPI(
+    title="Vlyzo Vision + LLM Pipeline",
+    description="rembg → SegFormer → FashionCLIP + Nemotron-Nano-9B",
+    version="3.0.0",
+)
+app.add_middleware(
+    CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]
+)
+
+# The pipeline is blocking (torch, rembg, PIL), so endpoints hand it
+# to bounded thread pools and await the result. The event loop stays free for
+# /health and for other requests, and concurrent vision runs feed the
+# micro-batchers. Threads (not processes) keep a single copy of the models.
+vision_executor = ThreadPoolExecutor(
+    max_workers=VISION_WORKERS, thread_name_prefix="vision"
+)
+llm_executor = ThreadPoolExecutor(max_workers=LLM_WORKERS, thread_name_prefix="llm")
+# Index writes (and IVF retraining) get their own small pool so they never
+# queue behind vision work. Similar-item queries (and opening an index from
+# disk) use a separate pool so they never queue behind a long write.
+index_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="index")
+query_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="query")
+# Job queue calls (SQLite inserts of image blobs, status reads) stay off the loop too.
+jobs_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="jobs")
+
+
+async def run_in_pool(executor: ThreadPoolExecutor, fn: Callable, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    # Carry contextvars (the request's stage timings) into the worker thread
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(executor, ctx.run, functools.partial(fn, *args, **kwargs))
+
+
+def _full_resolution(requested: Optional[bool]) -> bool:
+    return FULL_RES_CROPS if requested is None else requested
+
+
+def _json_response(body: bytes, cache_hit: bool) -> Response:
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers={"X-Cache": "HIT" if cache_hit else "MISS"},
+    )
+
+
+@app.middleware("http")
+async def record_timings(request: Request, call_next):
+    timings: dict[str, float] = {}
+    request_timings.set(timings)
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    HTTP_SECONDS.observe(elapsed, path=path)
+    HTTP_REQUESTS.inc(path=path, status=str(response.status_code))
+    # Streamed bodies are produced after the headers go out, so a breakdown
+    # there would only cover the setup
+    media_type = response.headers.get("content-type", "").split(";")[0]
+    if media_type not in STREAM_MEDIA_TYPES.values():
+        parts = [f"{name};dur={secs * 1000:.1f}" for name, secs in timings.items()]
+        parts.append(f"total;dur={elapsed * 1000:.1f}")
+        response.headers["Server-Timing"] = ", ".join(parts)
+    return response
+
+
+@app.on_event("startup")
+def start_background_work():
+    result_cache.open()
+    job_queue.open()
+    models.start()
+    job_queue.start()
+
+
+@app.on_event("shutdown")
+async def close_llm_client():
+    await llm_client.aclose()
+
+
+@app.on_event("shutdown")
+def shutdown_executors():
+    job_queue.stop()
+    vision_executor.shutdown(wait=False, cancel_futures=True)
+    llm_executor.shutdown(wait=False, cancel_futures=True)
+    query_executor.shutdown(wait=False, cancel_futures=True)
+    jobs_executor.shutdown(wait=False, cancel_futures=True)
+    index_executor.shutdown(wait=True)
+
+
+@app.get("/health")
+async def health():
+    model_ids = [
+        f"rembg/{REMBG_MODEL}",
+        SEGFORMER_MODEL_ID,
+        FASHIONCLIP_MODEL_ID,
+    ]
+    if REMBG_SINGLE_MODEL != REMBG_MODEL:
+        model_ids.append(f"rembg/{REMBG_SINGLE_MODEL}")
+    if LLM_AVAILABLE:
+        model_ids.append("nvidia/NVIDIA-Nemotron-Nano-9B-v2 (via vLLM)")
+    return {
+        "status": "ok",
+        "device": DEVICE,
+        "inference_backend": inference_backend.name,
+        "gpu": torch.cuda.get_device_name(0) if DEVICE == "cuda" else None,
+        "llm_available": LLM_AVAILABLE,
+        "vllm_url": VLLM_URL if LLM_AVAILABLE else None,
+        "models": model_ids,
+        "models_ready": models.ready(),
+        "indexes": index_store.stats(),
+    }
+
+
+def _gauge(name: str, help: str, samples: list[tuple[dict, float]]) -> list[str]:
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+    for labels, value in samples:
+        lines.append(f"{name}{_label_str(tuple(sorted(labels.items())))} {value}")
+    return lines
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition."""
+    rss, peak_rss = _rss_bytes()
+    vision = result_cache.stats()
+    recs = recommendation_cache.stats()
+    jobs = await run_in_pool(jobs_executor, job_queue.counts)
+    queues = [
+        ({"queue": "segformer_batcher"}, segformer_batcher.depth()),
+        ({"queue": "fashionclip_batcher"}, fashionclip_batcher.depth()),
+        ({"queue": "vision_executor"}, vision_executor._work_queue.qsize()),
+        ({"queue": "llm_executor"}, llm_executor._work_queue.qsize()),
+        ({"queue": "jobs_pending"}, jobs["pending"]),
+    ] + [
+        ({"queue": f"batch_{name}"}, q.qsize())
+        for (name, _, _), q in zip(batch_pipeline.stages, batch_pipeline._queues)
+    ]
+    lines = []
+    for metric in (STAGE_SECONDS, BATCH_SIZE, BATCH_SECONDS, HTTP_SECONDS, HTTP_REQUESTS, ITEMS_PROCESSED):
+        lines += metric.render()
+    lines += _gauge("vlyzo_queue_depth", "Items waiting per queue", queues)
+    lines += _gauge("vlyzo_llm_in_flight", "vLLM requests in flight", [({}, llm_client.in_flight)])
+    lines += _gauge("vlyzo_llm_retries", "vLLM retries since start", [({}, llm_client.retries)])
+    lines += _gauge(
+        "vlyzo_cache_hit_rate",
+        "Cache hit rate since start",
+        [({"cache": "vision"}, vision["hit_rate"]), ({"cache": "recommendations"}, recs["hit_rate"])],
+    )
+    lines += _gauge(
+        "vlyzo_cache_lookups",
+        "Cache lookups since start by result",
+        [
+            ({"cache": "vision", "result": "memory_hit"}, vision["memory_hits"]),
+            ({"cache": "vision", "result": "disk_hit"}, vision["disk_hits"]),
+            ({"cache": "vision", "result": "miss"}, vision["misses"]),
+            ({"cache": "recommendations", "result": "hit"}, recs["hits"]),
+            ({"cache": "recommendations", "result": "coalesced"}, recs["coalesced"]),
+            ({"cache": "recommendations", "result": "miss"}, recs["misses"]),
+        ],
+    )
+    lines += _gauge(
+        "vlyzo_process_memory_bytes",
+        "Process resident memory",
+        [({"kind": "rss"}, rss), ({"kind": "peak_rss"}, peak_rss)],
+    )
+    if DEVICE == "cuda":
+        lines += _gauge(
+            "vlyzo_gpu_memory_bytes",
+            "CUDA memory held by torch",
+            [
+                ({"kind": "allocated"}, torch.cuda.memory_allocated()),
+                ({"kind": "peak_allocated"}, torch.cuda.max_memory_allocated()),
+            ],
+        )
+    lines += _gauge("vlyzo_models_ready", "1 once every model is loaded and warm", [({}, int(models.ready()))])
+    return Response(content="\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+
+@app.get("/ready")
+async def ready():
+    """Readiness: 200 once every model is loaded and warmed up, else 503."""
+    body = {"ready": models.ready(), "models": models.status()}
+    return Response(
+        content=json.dumps(body),
+        media_type="application/json",
+        status_code=200 if body["ready"] else 503,
+    )
+
+
+@app.post("/process-outfit", response_model=OutfitResponse)
+async def api_outfit(req: OutfitRequest):
+    try:
+        data = await run_in_pool(vision_executor, decode_base64_bytes, req.image_base64)
+        body, hit = await run_in_pool(
+            vision_executor,
+            run_vision_cached,
+            "outfit",
+            data,
+            full_resolution=_full_resolution(req.full_resolution),
+            encoding=req.encoding_only(),
+        )
+        return _json_response(body, hit)
+    except Exception as e:
+        logger.error(f"Error: {e}", exc_info=True)
+        raise HTTPException(500, detail=str(e))
+
+
+@app.post("/process-single", response_model=OutfitResponse)
+async def api_single(req: OutfitRequest):
+    try:
+        data = await run_in_pool(vision_executor, decode_base64_bytes, req.image_base64)
+        body, hit = await run_in_pool(
+            vision_executor,
+            run_vision_cached,
+            "single",
+            data,
+            full_resolution=_full_resolution(req.full_resolution),
+            encoding=req.encoding_only(),
+        )
+        return _json_response(body, hit)
+    except Exception as e:
+        logger.error(f"Error: {e}", exc_info=True)
+        raise HTTPException(500, detail=str(e))
+
+
+# ── Binary uploads ──
+# multipart/form-data (any file field) or a raw application/octet-stream /
+# image/* body. The image is read straight into a buffer (hashed on the way
+# in for the cache) and decoded by PIL from there — no base64 or JSON copy.
+
+UPLOAD_CHUNK = 1024 * 1024
+
+
+async def _read_body_stream(request: Request) -> tuple[io.BytesIO, str]:
+    limit = MAX_UPLOAD_MB * 1024 * 1024
+    hasher = hashlib.sha256()
+    buf = io.BytesIO()
+    async for chunk in request.stream():
+        if buf.tell() + len(chunk) > limit:
+            raise HTTPException(413, detail=f"Image larger than {MAX_UPLOAD_MB} MB")
+        hasher.update(chunk)
+        buf.write(chunk)
+    if buf.tell() == 0:
+        raise HTTPException(400, detail="Empty request body")
+    buf.seek(0)
+    return buf, hasher.hexdigest()
+
+
+async def _hash_upload(upload: UploadFile) -> str:
+    limit = MAX_UPLOAD_MB * 1024 * 1024
+    hasher = hashlib.sha256()
+    size = 0
+    while chunk := await upload.read(UPLOAD_CHUNK):
+        size += len(chunk)
+        if size > limit:
+            raise HTTPException(413, detail=f"Image larger than {MAX_UPLOAD_MB} MB")
+        hasher.update(chunk)
+    if size == 0:
+        raise HTTPException(400, detail="Empty file upload")
+    await upload.seek(0)
+    return hasher.hexdigest()
+
+
+async def _process_upload(
+    kind: str, request: Request, full_resolution: Optional[bool], encoding: ItemEncoding
+) -> Response:
+    full_resolution = _full_resolution(full_resolution)
+    content_type = request.headers.get("content-type", "")
+    try:
+        if content_type.startswith("multipart/form-data"):
+            async with request.form() as form:
+                upload = next(
+                    (v for v in form.values() if isinstance(v, UploadFile)), None
+                )
+                if upload is None:
+                    raise HTTPException(400, detail="No file field in multipart body")
+                digest = await _hash_upload(upload)
+                body, hit = await run_in_pool(
+                    vision_executor,
+                    run_vision_cached,
+                    kind,
+                    upload.file,
+                    digest,
+                    full_resolution,
+                    encoding,
+                )
+        else:
+            source, digest = await _read_body_stream(request)
+            body, hit = await run_in_pool(
+                vision_executor,
+                run_vision_cached,
+                kind,
+                source,
+                digest,
+                full_resolution,
+                encoding,
+            )
+        return _json_response(body, hit)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error: {e}", exc_info=True)
+        raise HTTPException(500, detail=str(e))
+
+
+@app.post("/process-outfit/upload", response_model=OutfitResponse)
+async def api_outfit_upload(
+    request: Request,
+    full_resolution: Optional[bool] = None,
+    encoding: ItemEncoding = Depends(),
+):
+    return await _process_upload("outfit", request, full_resolution, encoding)
+
+
+@app.post("/process-single/upload", response_model=OutfitResponse)
+async def api_single_upload(
+    request: Request,
+    full_resolution: Optional[bool] = None,
+    encoding: ItemEncoding = Depends(),
+):
+    return await _process_upload("single", request, full_resolution, encoding)
+
+
+# ── Streaming /process-outfit ──
+# Emits a "segments" event as soon as SegFormer is done, then one "item" event
+# per garment as its classification and crop are ready (in completion order,
+# tagged with the segment index), then "done". Crops from one photo still
+# share FashionCLIP batches through the scheduler.
+
+STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+
+def _format_event(event: str, data: dict, fmt: str) -> str:
+    if fmt == "sse":
+        return f"event: {event}\ndata: {dump_json(data).decode()}\n\n"
+    return dump_json({"event": event, **data}).decode() + "\n"
+
+
+def _segments_event(labels: list[str]) -> dict:
+    return {
+        "items_found": len(labels),
+        "segments": [{"index": i, "label": label} for i, label in enumerate(labels)],
+    }
+
+
+async def _stream_outfit(
+    data: bytes, fmt: str, full_resolution: bool, encoding: ItemEncoding
+):
+    try:
+        digest = await run_in_pool(vision_executor, lambda: hashlib.sha256(data).hexdigest())
+        key = result_cache.key("outfit", digest, full_resolution, encoding)
+        cached = await run_in_pool(vision_executor, result_cache.get, key)
+        if cached is not None:
+            items = orjson.loads(cached)["items"]
+            yield _format_event(
+                "segments", _segments_event([it["segment_label"] for it in items]), fmt
+            )
+            for i, item in enumerate(items):
+                yield _format_event("item", {"index": i, "item": item}, fmt)
+            yield _format_event("done", {"items_found": len(items), "cached": True}, fmt)
+            return
+
+        working, original = await run_in_pool(
+            vision_executor, prepare_input, data, full_resolution
+        )
+        segments = await run_in_pool(vision_executor, segment_outfit, working, original)
+        yield _format_event(
+            "segments", _segments_event([seg["label"] for seg in segments]), fmt
+        )
+
+        async def classify(index: int, seg: dict) -> tuple[int, dict]:
+            return index, await run_in_pool(vision_executor, classify_segment, seg, encoding)
+
+        tasks = [asyncio.ensure_future(classify(i, seg)) for i, seg in enumerate(segments)]
+        items: list[Optional[dict]] = [None] * len(segments)
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                index, item = await next_done
+                items[index] = item
+                yield _format_event("item", {"index": index, "item": item}, fmt)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        body = dump_json({"items_found": len(items), "items": items})
+        await run_in_pool(vision_executor, result_cache.put, key, body)
+        yield _format_event("done", {"items_found": len(items), "cached": False}, fmt)
+    except Exception as e:
+        logger.error(f"Error: {e}", exc_info=True)
+        yield _format_event("error", {"detail": str(e)}, fmt)
+
+
+@app.post("/process-outfit/stream")
+async def api_outfit_stream(req: OutfitRequest, format: str = "ndjson"):
+    if format not in STREAM_MEDIA_TYPES:
+        raise HTTPException(400, detail="format must be 'ndjson' or 'sse'")
+    try:
+        data = await run_in_pool(vision_executor, decode_base64_bytes, req.image_base64)
+    except Exception as e:
+        raise HTTPException(400, detail=f"Invalid image_base64: {e}")
+    return StreamingResponse(
+        _stream_outfit(data, format, _full_resolution(req.full_resolution), req.encoding_only()),
+        media_type=STREAM_MEDIA_TYPES[format],
+    )
+
+
+# ── Bulk ingestion ──
+# POST /process-batch?kind=outfit|single takes many images — multipart with one
+# file field per image, or JSON {"images": [{"image_base64", "filename"}, ...]} —
+# feeds them all into batch_pipeline and streams one "result" (or "error")
+# event per image in completion order, tagged with its index, then "done".
+
+
+class BatchImage(BaseModel):
+    image_base64: str
+    filename: Optional[str] = None
+
+
+class BatchRequest(ItemEncoding):
+    images: list[BatchImage]
+    kind: Optional[str] = None
+    full_resolution: Optional[bool] = None
+
+
+async def _read_upload(upload: UploadFile, limit: int) -> bytes:
+    buf = io.BytesIO()
+    while chunk := await upload.read(UPLOAD_CHUNK):
+        if buf.tell() + len(chunk) > limit:
+            raise HTTPException(
+                413, detail=f"{upload.filename or 'Image'} larger than {MAX_UPLOAD_MB} MB"
+            )
+        buf.write(chunk)
+    return buf.getvalue()
+
+
+async def _read_batch_images(
+    request: Request,
+) -> tuple[list[tuple[Optional[str], bytes]], Optional[BatchRequest]]:
+    """Images of a batch upload; every size limit is checked before the data
+    it covers is buffered, so oversized batches are rejected early."""
+    limit = MAX_UPLOAD_MB * 1024 * 1024
+    # Every image at the limit, plus base64 / multipart overhead
+    total_limit = BATCH_MAX_IMAGES * limit * 4 // 3 + 1024 * 1024
+    too_large = f"Batch larger than {BATCH_MAX_IMAGES} × {MAX_UPLOAD_MB} MB"
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > total_limit:
+        raise HTTPException(413, detail=too_large)
+
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("application/json"):
+        body = io.BytesIO()
+        async for chunk in request.stream():
+            if body.tell() + len(chunk) > total_limit:
+                raise HTTPException(413, detail=too_large)
+            body.write(chunk)
+        try:
+            req = BatchRequest.model_validate_json(body.getvalue())
+        except ValueError as e:
+            raise HTTPException(422, detail=str(e))
+        del body
+        if len(req.images) > BATCH_MAX_IMAGES:
+            raise HTTPException(413, detail=f"At most {BATCH_MAX_IMAGES} images per batch")
+        images = []
+        for i, img in enumerate(req.images):
+            # base64 is 4 chars per 3 bytes: reject before decoding
+            if len(img.image_base64) * 3 // 4 > limit + 3:
+                raise HTTPException(
+                    413, detail=f"{img.filename or 'Image'} larger than {MAX_UPLOAD_MB} MB"
+                )
+            try:
+                data = await run_in_pool(vision_executor, decode_base64_bytes, img.image_base64)
+            except Exception as e:
+                raise HTTPException(400, detail=f"Invalid image_base64 at index {i}: {e}")
+            images.append((img.filename, data))
+    elif content_type.startswith("multipart/form-data"):
+        req = None
+        images = []
+        async with request.form(max_files=BATCH_MAX_IMAGES) as form:
+            for _, value in form.multi_items():
+                if isinstance(value, UploadFile):
+                    if len(images) == BATCH_MAX_IMAGES:
+                        raise HTTPException(
+                            413, detail=f"At most {BATCH_MAX_IMAGES} images per batch"
+                        )
+                    images.append((value.filename, await _read_upload(value, limit)))
+    else:
+        raise HTTPException(415, detail="Send multipart/form-data or application/json")
+
+    if not images:
+        raise HTTPException(400, detail="No images in request")
+    for filename, data in images:
+        if len(data) > limit:  # data URIs / padding can slip past the estimate
+            raise HTTPException(413, detail=f"{filename or 'Image'} larger than {MAX_UPLOAD_MB} MB")
+    return images, req
+
+
+async def _stream_batch(
+    images: list[tuple[Optional[str], bytes]],
+    kind: str,
+    full_resolution: bool,
+    encoding: ItemEncoding,
+    fmt: str,
+):
+    loop = asyncio.get_running_loop()
+    finished: asyncio.Queue = asyncio.Queue()
+
+    def done(task: BatchTask) -> None:
+        loop.call_soon_threadsafe(finished.put_nowait, task)
+
+    for index, (filename, data) in enumerate(images):
+        batch_pipeline.submit(
+            BatchTask(index, filename, kind, data, full_resolution, encoding, done)
+        )
+    total = len(images)
+    del images  # tasks drop their bytes as they finish
+
+    failed = 0
+    for _ in range(total):
+        task = await finished.get()
+        if task.error is not None:
+            failed += 1
+            yield _format_event(
+                "error", {"index": task.index, "filename": task.filename, "detail": task.error}, fmt
+            )
+        else:
+            # The body is already serialized JSON; splice it in rather than re-parse
+            head = dump_json(
+                {"index": task.index, "filename": task.filename, "cached": task.cached}
+            ).decode()
+            data = f'{head[:-1]},"result":{task.body.decode()}}}'
+            if fmt == "sse":
+                yield f"event: result\ndata: {data}\n\n"
+            else:
+                yield f'{{"event":"result",{data[1:]}\n'
+    yield _format_event("done", {"images": total, "failed": failed}, fmt)
+
+
+@app.post("/process-batch")
+async def api_process_batch(
+    request: Request,
+    kind: str = "outfit",
+    full_resolution: Optional[bool] = None,
+    format: str = "ndjson",
+    encoding: ItemEncoding = Depends(),
+):
+    if format not in STREAM_MEDIA_TYPES:
+        raise HTTPException(400, detail="format must be 'ndjson' or 'sse'")
+    images, req = await _read_batch_images(request)
+    if req is not None:
+        kind = req.kind or kind
+        if req.full_resolution is not None:
+            full_resolution = req.full_resolution
+        encoding = req.encoding_only()
+    if kind not in VISION_PIPELINES:
+        raise HTTPException(400, detail=f"kind must be one of {sorted(VISION_PIPELINES)}")
+    logger.info(f"Batch of {len(images)} {kind} image(s) queued")
+    return StreamingResponse(
+        _stream_batch(images, kind, _full_resolution(full_resolution), encoding, format),
+        media_type=STREAM_MEDIA_TYPES[format],
+    )
+
+
+# ── Embedding index ──
+# Callers index the `embedding` returned with each item under their own ids
+# (e.g. wardrobe item UUIDs) in a namespace such as "user:<uuid>" or
+# "catalogue". /similar-items with a high min_score doubles as duplicate
+# detection; /index/upsert can also report near-duplicates of the new items.
+
+
+class IndexItem(BaseModel):
+    id: str
+    embedding: list[float]
+
+
+class IndexUpsertRequest(BaseModel):
+    namespace: str = "default"
+    items: list[IndexItem]
+    duplicate_threshold: Optional[float] = None  # report existing items at/above this cosine
+
+
+class IndexRemoveRequest(BaseModel):
+    namespace: str = "default"
+    ids: list[str]
+
+
+class SimilarRequest(BaseModel):
+    namespace: str = "default"
+    embedding: Optional[list[float]] = None
+    id: Optional[str] = None  # query with an already-indexed item instead
+    k: int = 10
+    min_score: Optional[float] = None
+    exclude_ids: list[str] = []
+
+
+def _index_upsert(req: IndexUpsertRequest) -> dict:
+    index = index_store.get(req.namespace)
+    ids = [item.id for item in req.items]
+    vectors = np.array([item.embedding for item in req.items], dtype=np.float32)
+
+    duplicates = []
+    if req.duplicate_threshold is not None:
+        for item_id, vec in zip(ids, vectors):
+            matches = index.search(vec, k=1, exclude=(item_id,), min_score=req.duplicate_threshold)
+            if matches:
+                duplicates.append(
+                    {"id": item_id, "duplicate_of": matches[0][0], "score": matches[0][1]}
+                )
+
+    index.upsert(ids, vectors)
+    recommendation_cache.invalidate(set(ids))
+    result = {"upserted": len(ids), **index.stats()}
+    if req.duplicate_threshold is not None:
+        result["duplicates"] = duplicates
+    return result
+
+
+@app.post("/index/upsert")
+async def api_index_upsert(req: IndexUpsertRequest):
+    if not req.items:
+        raise HTTPException(400, detail="No items")
+    try:
+        return await run_in_pool(index_executor, _index_upsert, req)
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+
+
+@app.post("/index/remove")
+async def api_index_remove(req: IndexRemoveRequest):
+    try:
+        index = await run_in_pool(query_executor, index_store.get, req.namespace, False)
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+    if index is None:
+        return {"removed": 0, "size": 0}
+    removed = await run_in_pool(index_executor, index.remove, req.ids)
+    recommendation_cache.invalidate(set(req.ids))
+    return {"removed": removed, "size": len(index.ids)}
+
+
+def _similar_items(req: SimilarRequest) -> dict:
+    start = time.perf_counter()
+    try:
+        index = index_store.get(req.namespace, create=False)
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+    if index is None:
+        raise HTTPException(404, detail=f"Unknown namespace: {req.namespace}")
+
+    exclude = tuple(req.exclude_ids)
+    if req.embedding is not None:
+        query = np.array(req.embedding, dtype=np.float32)
+    elif req.id is not None:
+        query = index.vector(req.id)
+        if query is None:
+            raise HTTPException(404, detail=f"Item not indexed: {req.id}")
+        exclude += (req.id,)
+    else:
+        raise HTTPException(400, detail="Provide embedding or id")
+
+    try:
+        matches = index.search(query, k=req.k, exclude=exclude, min_score=req.min_score)
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+    return {
+        "namespace": req.namespace,
+        "mode": index.stats()["mode"],
+        "results": [{"id": item_id, "score": score} for item_id, score in matches],
+        "took_ms": round((time.perf_counter() - start) * 1000, 3),
+    }
+
+
+@app.post("/similar-items")
+async def api_similar_items(req: SimilarRequest):
+    return await run_in_pool(query_executor, _similar_items, req)
+
+
+# ── Re-classification ──
+# Rescores stored embeddings (e.g. wardrobe_items.embedding) against the
+# current — or a caller-supplied — taxonomy. Large calls should send binary
+# embeddings (embedding_encoding f16 / f32 / int8, as returned by the vision
+# endpoints); the body is parsed off the event loop. reclassify.py drives
+# this in bulk.
+
+RESERVED_ATTRIBUTES = {"id", "top_categories", "tags", "embedding", "embedding_scale"}
+
+
+class ReclassifyItem(BaseModel):
+    id: str
+    embedding: Union[list[float], str]
+    embedding_scale: Optional[float] = None  # int8 only
+
+
+class ReclassifyRequest(BaseModel):
+    items: list[ReclassifyItem]
+    embedding_encoding: Literal["list", "f32", "f16", "int8"] = "list"
+    label_banks: dict[str, list[str]] = {}  # replace / add banks on top of LABEL_BANKS
+    prompt_template: Optional[str] = None  # "{}" is replaced by the label
+
+
+def _reclassify(body: bytes) -> bytes:
+    try:
+        req = ReclassifyRequest.model_validate_json(body)
+    except ValueError as e:
+        raise HTTPException(422, detail=str(e))
+    if not req.items:
+        raise HTTPException(400, detail="No items")
+    if len(req.items) > RECLASSIFY_MAX_ITEMS:
+        raise HTTPException(413, detail=f"At most {RECLASSIFY_MAX_ITEMS} items per call")
+    for name, labels in req.label_banks.items():
+        if not labels or name in RESERVED_ATTRIBUTES:
+            raise HTTPException(400, detail=f"Invalid label bank: {name!r}")
+    if req.prompt_template is not None and "{}" not in req.prompt_template:
+        raise HTTPException(400, detail="prompt_template must contain {}")
+
+    try:
+        embeddings = np.stack(
+            [
+                decode_embedding(item.embedding, req.embedding_encoding, item.embedding_scale)
+                for item in req.items
+            ]
+        )
+        results = reclassify_embeddings(embeddings, req.label_banks, req.prompt_template)
+    except (ValueError, IndexError, KeyError) as e:  # KeyError: stray {name} in the template
+        raise HTTPException(400, detail=str(e))
+    return dump_json(
+        {
+            "items": [{"id": item.id, **fields} for item, fields in zip(req.items, results)],
+            "prompt_template": req.prompt_template or PROMPT_TEMPLATE,
+            "label_banks": {
+                name: len(labels) for name, labels in {**LABEL_BANKS, **req.label_banks}.items()
+            },
+        }
+    )
+
+
+@app.post("/reclassify")
+async def api_reclassify(request: Request):
+    body = await request.body()
+    return Response(
+        content=await run_in_pool(vision_executor, _reclassify, body),
+        media_type="application/json",
+    )
+
+
+# ── Async jobs ──
+# POST /jobs?kind=outfit|single takes the same bodies as the sync endpoints
+# (base64 JSON, multipart or a raw image body) and answers 202 with a job id
+# right away; poll GET /jobs/{job_id} until status is completed or failed.
+
+
+class JobRequest(OutfitRequest):
+    kind: Optional[str] = None
+
+
+async def _read_job_image(request: Request) -> tuple[bytes, str, Optional[JobRequest]]:
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("application/json"):
+        try:
+            req = JobRequest.model_validate_json(await request.body())
+        except ValueError as e:
+            raise HTTPException(422, detail=str(e))
+        try:
+            data = await run_in_pool(vision_executor, decode_base64_bytes, req.image_base64)
+        except Exception as e:
+            raise HTTPException(400, detail=f"Invalid image_base64: {e}")
+        if len(data) > MAX_UPLOAD_MB * 1024 * 1024:
+            raise HTTPException(413, detail=f"Image larger than {MAX_UPLOAD_MB} MB")
+        return data, hashlib.sha256(data).hexdigest(), req
+    if content_type.startswith("multipart/form-data"):
+        async with request.form() as form:
+            upload = next((v for v in form.values() if isinstance(v, UploadFile)), None)
+            if upload is None:
+                raise HTTPException(400, detail="No file field in multipart body")
+            digest = await _hash_upload(upload)
+            return await upload.read(), digest, None
+    source, digest = await _read_body_stream(request)
+    return source.getvalue(), digest, None
+
+
+@app.post("/jobs", status_code=202)
+async def api_submit_job(
+    request: Request,
+    kind: str = "outfit",
+    full_resolution: Optional[bool] = None,
+    encoding: ItemEncoding = Depends(),
+):
+    data, digest, req = await _read_job_image(request)
+    if req is not None:
+        kind = req.kind or kind
+        full_resolution = req.full_resolution if req.full_resolution is not None else full_resolution
+        encoding = req.encoding_only()
+    if kind not in VISION_PIPELINES:
+        raise HTTPException(400, detail=f"kind must be one of {sorted(VISION_PIPELINES)}")
+
+    job_id = await run_in_pool(
+        jobs_executor,
+        job_queue.submit,
+        kind,
+        data,
+        digest,
+        _full_resolution(full_resolution),
+        encoding,
+    )
+    return {"job_id": job_id, "status": "pending", "status_url": f"/jobs/{job_id}"}
+
+
+@app.get("/jobs/{job_id}")
+async def api_get_job(job_id: str):
+    job = await run_in_pool(jobs_executor, job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(404, detail="Job not found (unknown id or expired)")
+    return job
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {**result_cache.stats(), "recommendations": recommendation_cache.stats()}
+
+
+class WardrobeItem(BaseModel):
+    id: str
+    category: str
+    color: str
+    style: str = ""
+    material: str = ""
+    season: str = ""
+    pattern: str = ""
+    ai_category: str = ""  # FashionCLIP label; slots outfits better than the coarse category
+    segment_label: str = ""
+    embedding: Optional[list[float]] = None  # FashionCLIP embedding, improves pairing
+
+
+class RecommendRequest(BaseModel):
+    wardrobe: list[WardrobeItem]
+    occasion: Optional[str] = None
+    season: Optional[str] = None
+    user_id: Optional[str] = None  # lets /recommend-outfits/invalidate drop this user's entries
+    timeout_s: Optional[float] = None  # deadline for the LLM step (default LLM_TIMEOUT_S)
+
+
+class RecommendInvalidateRequest(BaseModel):
+    user_id: Optional[str] = None
+    item_ids: list[str] = []
+
+
+# ── Recommendations ──
+# The deadline comes from the request (timeout_s, or an X-Request-Timeout
+# header in seconds) and defaults to LLM_TIMEOUT_S. Once it passes, the local
+# candidates are returned instead of waiting on vLLM. If the client
+# disconnects, its wait is cancelled, and so is the vLLM call when nobody else
+# is waiting on the same generation.
+
+DISCONNECT_POLL_S = 0.5
+
+
+def _recommend_inputs(req: RecommendRequest) -> tuple[list[dict], str]:
+    """The wardrobe as dicts and its cache key (run off the event loop)."""
+    wardrobe = [item.model_dump() for item in req.wardrobe]
+    return wardrobe, recommendation_cache.key(wardrobe, req.occasion, req.season)
+
+
+async def run_until_disconnect(request: Request, awaitable):
+    """Await ``awaitable``, cancelling it if the client goes away first."""
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_S)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                logger.info("Client disconnected — cancelling request")
+                task.cancel()
+                raise HTTPException(499, detail="Client closed request")
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+def _request_deadline(request: Request, timeout_s: Optional[float]) -> float:
+    if timeout_s is None:
+        header = request.headers.get("x-request-timeout")
+        try:
+            timeout_s = float(header) if header else LLM_TIMEOUT_S
+        except ValueError:
+            raise HTTPException(400, detail="X-Request-Timeout must be a number of seconds")
+    return asyncio.get_running_loop().time() + max(0.0, min(timeout_s, LLM_TIMEOUT_S))
+
+
+@app.post("/recommend-outfits")
+async def api_recommend(req: RecommendRequest, request: Request):
+    deadline = _request_deadline(request, req.timeout_s)
+    try:
+        wardrobe_dicts, key = await run_in_pool(llm_executor, _recommend_inputs, req)
+        body, status = await run_until_disconnect(
+            request,
+            recommendation_cache.get_or_generate(
+                key,
+                {item.id for item in req.wardrobe},
+                req.user_id,
+                lambda: generate_recommendations(
+                    wardrobe_dicts, req.occasion, req.season, deadline
+                ),
+            ),
+        )
+        return Response(content=body, media_type="application/json", headers={"X-Cache": status})
+    except HTTPException:
+        raise
+    except RuntimeError as e:
+        raise HTTPException(503, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error: {e}", exc_info=True)
+        raise HTTPException(500, detail=str(e))
+
+
+# Streaming variant: one "outfit" event per recommendation as soon as its JSON
+# object closes in the vLLM token stream, then "done". Cached results are
+# replayed, identical concurrent streams share one generation through the
+# cache, and if vLLM fails or stops short, local candidates fill the rest.
+
+
+async def _generate_streamed(
+    wardrobe: list[dict],
+    occasion: Optional[str],
+    season: Optional[str],
+    deadline: float,
+    emit: Callable[[dict], None],
+) -> dict:
+    """generate_recommendations, handing each pick to ``emit`` as it arrives."""
+    candidates = await run_in_pool(llm_executor, generate_candidates, wardrobe, occasion, season)
+    wanted = _wanted_picks(wardrobe, candidates)
+    picks: list[dict] = []
+    llm_error = None
+    if wanted:
+        try:
+            if candidates:
+                async for pick in stream_ranked_candidates(
+                    wardrobe, candidates, deadline, occasion, season
+                ):
+                    picks.append(pick)
+                    emit(pick)
+            else:
+                for pick in await generate_from_wardrobe(wardrobe, deadline, occasion, season):
+                    picks.append(pick)
+                    emit(pick)
+        except Exception as e:
+            logger.warning(f"  [Nemotron] Stream failed, filling from local candidates: {e}")
+            llm_error = str(e)
+
+    result = recommendation_result(candidates, picks, wanted, llm_error)
+    for cand in result["recommendations"][len(picks) :]:
+        emit(cand)
+    return result
+
+
+async def _stream_recommendations(req: RecommendRequest, deadline: float, fmt: str):
+    index = 0
+    try:
+        wardrobe, key = await run_in_pool(llm_executor, _recommend_inputs, req)
+        async for event, data in recommendation_cache.stream_or_generate(
+            key,
+            {item.id for item in req.wardrobe},
+            req.user_id,
+            lambda emit: _generate_streamed(wardrobe, req.occasion, req.season, deadline, emit),
+        ):
+            if event == "outfit":
+                yield _format_event("outfit", {"index": index, "outfit": data}, fmt)
+                index += 1
+            else:
+                result, status = data
+                yield _format_event(
+                    "done",
+                    {"source": result["source"], "cached": status == "HIT", "cache": status},
+                    fmt,
+                )
+    except Exception as e:
+        logger.error(f"Error: {e}", exc_info=True)
+        yield _format_event("error", {"detail": str(e)}, fmt)
+
+
+@app.post("/recommend-outfits/stream")
+async def api_recommend_stream(req: RecommendRequest, request: Request, format: str = "ndjson"):
+    if format not in STREAM_MEDIA_TYPES:
+        raise HTTPException(400, detail="format must be 'ndjson' or 'sse'")
+    return StreamingResponse(
+        _stream_recommendations(req, _request_deadline(request, req.timeout_s), format),
+        media_type=STREAM_MEDIA_TYPES[format],
+    )
+
+
+@app.post("/recommend-outfits/invalidate")
+async def api_recommend_invalidate(req: RecommendInvalidateRequest):
+    """Call when a user's wardrobe items are edited or deleted."""
+    dropped = recommendation_cache.invalidate(set(req.item_ids), req.user_id)
+    return {"invalidated": dropped}
 
 
 # ──────────────────────────────────────────────────────────────────────────────